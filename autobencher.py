@@ -1,7 +1,21 @@
 import os
-from autobencher.server import app
+from autobencher.server import (make_app, make_scheduler, make_deliveries,
+                                make_logs, make_collector)
+from autobencher.affinity import CoreAllocator, pin
 from tornado.ioloop import IOLoop
 
 if __name__ == "__main__":
+    slots = int(os.environ.get('BENCHMARK_SLOTS', 1))
+    allocator = CoreAllocator.from_environ(slots)
+    # threads started from here on, including the slots, inherit this
+    pin(allocator.housekeeping)
+    logs = make_logs(os.getcwd())
+    scheduler = make_scheduler(os.getcwd(), slots, allocator, logs)
+    scheduler.start()
+    collector = make_collector(os.getcwd(), scheduler)
+    if collector is not None:
+        collector.start()
+    app = make_app(scheduler, make_deliveries(os.getcwd()), logs=logs,
+                   collector=collector)
     app.listen(int(os.environ['PORT']))
     IOLoop.current().start()
@@ -0,0 +1,78 @@
+import logging
+import os
+import sys
+
+
+logger = logging.getLogger(__name__)
+
+
+def available_cores():
+    """Cores this process may run on, or None where affinity isn't
+       supported"""
+    if not hasattr(os, 'sched_getaffinity'):
+        return None
+    return sorted(os.sched_getaffinity(0))
+
+
+def pin(cores):
+    """Restrict the calling thread, and the threads and processes it starts
+       afterwards, to cores"""
+    if cores and hasattr(os, 'sched_setaffinity'):
+        os.sched_setaffinity(0, cores)
+
+
+# pins the interpreter and then replaces it with the real command
+_EXEC_PINNED = ('import os, sys; '
+                'os.sched_setaffinity(0, map(int, sys.argv[1].split(","))); '
+                'os.execvp(sys.argv[2], sys.argv[2:])')
+
+
+def pinned_command(args, cores):
+    """args wrapped so that the command, and the processes it starts, run on
+       cores. This avoids a preexec_fn, which isn't safe in a process with
+       threads."""
+    if not cores or not hasattr(os, 'sched_setaffinity'):
+        return list(args)
+    return [sys.executable, '-c', _EXEC_PINNED,
+            ','.join(str(core) for core in cores)] + list(args)
+
+
+class CoreAllocator(object):
+    """Splits the machine's cores into an exclusive set for each benchmark
+       slot, so that concurrent runs don't disturb each other's timings.
+       The first reserved cores, plus any that don't divide evenly between
+       the slots, are left for housekeeping such as clones, publishing and
+       the IOLoop. Slots get no cores, and aren't pinned, when there are
+       too few to go around."""
+
+    def __init__(self, cores, slots, reserved=1):
+        self._slot_cores = [None] * slots
+        self._housekeeping = sorted(cores) if cores is not None else None
+        if cores is None or not slots:
+            return
+
+        cores = sorted(cores)
+        per_slot = (len(cores) - reserved) // slots
+        if per_slot < 1:
+            logger.warning('%d cores are too few for %d pinned benchmark '
+                           'slots with %d reserved', len(cores), slots,
+                           reserved)
+            return
+
+        for slot in range(slots):
+            start = reserved + slot * per_slot
+            self._slot_cores[slot] = cores[start:start + per_slot]
+        self._housekeeping = cores[:reserved] + \
+            cores[reserved + slots * per_slot:]
+
+    @classmethod
+    def from_environ(cls, slots):
+        reserved = int(os.environ.get('RESERVED_CORES', 1))
+        return cls(available_cores(), slots, reserved)
+
+    @property
+    def housekeeping(self):
+        return self._housekeeping
+
+    def slot_cores(self, slot):
+        return self._slot_cores[slot]
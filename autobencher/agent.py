@@ -0,0 +1,163 @@
+import json
+import logging
+import os
+import socket
+import threading
+import time
+
+import requests
+
+from .job import Job
+from .limits import RunAborted
+from .factory import BenchmarkerFactory
+from .server import process_event
+
+
+logger = logging.getLogger(__name__)
+
+
+class Agent(object):
+    """Runs benchmark jobs claimed from an autobencher server on this
+       machine and sends the result files back, so that results from every
+       benchmark host end up in per-machine directories on the server.
+
+       Agents benchmark, report and publish pull requests the same way the
+       server's own slots do, so they need the same PUBLISH_URI and REPORT_*
+       settings. master is published by the server, from the results of
+       every machine."""
+
+    def __init__(self, server_uri, directory, machine=None, token=None,
+                 poll_interval=10, heartbeat_interval=30, cores=None):
+        self._server_uri = server_uri.rstrip('/')
+        self._dir = directory
+        self._machine = machine if machine is not None else \
+            socket.gethostname()
+        self._headers = {}
+        if token is not None:
+            self._headers['X-Agent-Token'] = token
+        self._poll_interval = poll_interval
+        self._heartbeat_interval = heartbeat_interval
+        self._cores = cores
+        self._factory = BenchmarkerFactory.makeFactory()
+
+    @classmethod
+    def from_environ(cls, directory, cores=None):
+        return cls(os.environ['AGENT_SERVER_URI'], directory,
+                   token=os.environ['AGENT_TOKEN'], cores=cores)
+
+    @property
+    def machine(self):
+        return self._machine
+
+    def register(self):
+        self._post('')
+
+    def run_forever(self):
+        self.register()
+        while True:
+            try:
+                ran = self.run_once()
+            except requests.RequestException:
+                logger.exception('Lost contact with %s', self._server_uri)
+                ran = False
+            if not ran:
+                time.sleep(self._poll_interval)
+
+    def run_once(self):
+        """Claim and run one job. Returns whether there was a job to run."""
+        response = self._post('/claim')
+        if response.status_code == 204:
+            return False
+
+        claimed = response.json()
+        job = Job(claimed['event'], claimed['id'], Job.RUNNING,
+                  key=claimed['key'], head_sha=claimed['head_sha'])
+        if self._cores:
+            job.metadata['cores'] = self._cores
+        logger.info('Running job %s', job.job_id)
+        started = time.time()
+
+        errors = []
+        aborted = []
+        worker = threading.Thread(target=self._run_job,
+                                  args=(job, errors, aborted),
+                                  name='autobencher-agent-job')
+        worker.start()
+        while worker.is_alive():
+            worker.join(self._heartbeat_interval)
+            if worker.is_alive():
+                self._heartbeat(job)
+
+        self._post('/jobs/%s' % job.job_id, {
+            'error': errors[0] if errors else None,
+            'aborted': bool(aborted),
+            'metadata': job.metadata,
+            'results': self._collect_results(job.key, started),
+            'benchmarks': self._collect_benchmarks(job.key, started),
+        })
+        return True
+
+    def _run_job(self, job, errors, aborted):
+        try:
+            process_event(self._factory, self._dir, job.event, job,
+                          publish_master=False)
+        except RunAborted as e:
+            logger.warning('Job %s aborted: %s', job.job_id, e)
+            aborted.append(True)
+            errors.append(str(e))
+        except Exception as e:
+            if not job.cancelled:
+                logger.exception('Job %s failed', job.job_id)
+            errors.append(str(e))
+
+    def _heartbeat(self, job):
+        try:
+            response = self._post('/jobs/%s/heartbeat' % job.job_id)
+        except requests.RequestException:
+            logger.warning('Heartbeat for job %s failed', job.job_id)
+            return
+        # the job was superseded or handed to another agent
+        if response.status_code == 404 or response.json()['cancelled']:
+            job.cancel()
+
+    def _collect_results(self, key, since):
+        """Result files this machine wrote for the run key since the job
+           started, by file name"""
+        if key is None:
+            return {}
+        results_dir = os.path.join(self._dir, 'runs', key, 'results',
+                                   self._machine)
+        results = {}
+        try:
+            entries = list(os.scandir(results_dir))
+        except FileNotFoundError:
+            return results
+        for entry in entries:
+            if entry.name.endswith('.json') and \
+                    entry.stat().st_mtime >= since:
+                with open(entry.path) as result_fp:
+                    results[entry.name] = json.load(result_fp)
+        return results
+
+    def _collect_benchmarks(self, key, since):
+        """The benchmark list asv wrote for the run key since the job
+           started, or None"""
+        if key is None:
+            return None
+        path = os.path.join(self._dir, 'runs', key, 'results',
+                            'benchmarks.json')
+        try:
+            if os.stat(path).st_mtime < since:
+                return None
+            with open(path) as benchmarks_fp:
+                return json.load(benchmarks_fp)
+        except FileNotFoundError:
+            return None
+
+    def _post(self, path, body=None):
+        uri = '%s/agents/%s%s' % (self._server_uri, self._machine, path)
+        response = requests.post(uri, data=json.dumps(body or {}),
+                                 headers=self._headers, timeout=60)
+        if response.status_code not in (200, 204, 404):
+            response.raise_for_status()
+        return response
@@ -0,0 +1,159 @@
+import itertools
+
+from fnmatch import fnmatchcase
+
+import numpy as np
+
+
+# Detect if more than 1/3 slower
+DEFAULT_THRESHOLD = .3333
+
+
+class Change(object):
+    def __init__(self, configuration, benchmark, params, base, tip,
+                 threshold):
+        self.configuration = configuration
+        self.benchmark = benchmark
+        self.params = params
+        self.base = base
+        self.tip = tip
+        self.threshold = threshold
+
+    @property
+    def ratio(self):
+        return self.tip / self.base
+
+    @property
+    def name(self):
+        if self.params:
+            return '%s(%s)' % (self.benchmark, ', '.join(self.params))
+        return self.benchmark
+
+    def to_dict(self):
+        return {
+            'configuration': self.configuration,
+            'benchmark': self.benchmark,
+            'params': list(self.params),
+            'base': self.base,
+            'tip': self.tip,
+            'ratio': self.ratio,
+            'threshold': self.threshold,
+        }
+
+
+class ComparisonReport(object):
+    def __init__(self, regressions, improvements, compared):
+        self.regressions = regressions
+        self.improvements = improvements
+        self.compared = compared
+        # set when the regression was bisected to a commit
+        self.first_bad_commit = None
+        # set when suspected regressions were rerun to confirm them
+        self.confirmation = None
+
+    @property
+    def has_regressions(self):
+        return len(self.regressions) > 0
+
+    @property
+    def regressed_benchmarks(self):
+        return sorted(set(change.benchmark for change in self.regressions))
+
+    def to_dict(self):
+        return {
+            'compared': self.compared,
+            'regressions': [change.to_dict() for change in self.regressions],
+            'improvements': [change.to_dict()
+                             for change in self.improvements],
+            'first_bad_commit': self.first_bad_commit,
+            'confirmation': self.confirmation,
+        }
+
+
+def flatten_results(results):
+    """Yield (benchmark, params, value) for every value in an asv results
+       dict. Parametrized benchmarks store {'params': [...], 'result': [...]}
+       with one result per combination of parameters; failed or skipped
+       benchmarks store None."""
+    for benchmark, value in sorted(results.items()):
+        if isinstance(value, dict):
+            params = value.get('params') or []
+            values = value.get('result')
+            if values is None:
+                continue
+            if not params:
+                yield benchmark, (), values
+                continue
+            combinations = itertools.product(*params)
+            for combination, item in zip(combinations, values):
+                yield benchmark, tuple(str(p) for p in combination), item
+        elif isinstance(value, list):
+            for i, item in enumerate(value):
+                yield benchmark, (str(i),), item
+        else:
+            yield benchmark, (), value
+
+
+def compare(base_results, tip_results, thresholds=None):
+    """Compare every benchmark, parameter combination and configuration
+       present in both base_results and tip_results, which map a
+       configuration name to an asv results dict. thresholds maps
+       benchmark name patterns to the relative slowdown that counts as a
+       regression; the 'default' entry applies to everything else."""
+    thresholds = dict(thresholds or {})
+    default = thresholds.pop('default', DEFAULT_THRESHOLD)
+
+    keys = []
+    base_values = []
+    tip_values = []
+    for configuration in sorted(tip_results):
+        if configuration not in base_results:
+            continue
+        base = dict(((benchmark, params), value) for benchmark, params, value
+                    in flatten_results(base_results[configuration]))
+        for benchmark, params, value in flatten_results(
+                tip_results[configuration]):
+            if (benchmark, params) not in base:
+                continue
+            keys.append((configuration, benchmark, params))
+            base_values.append(base[(benchmark, params)])
+            tip_values.append(value)
+
+    base_array = _to_array(base_values)
+    tip_array = _to_array(tip_values)
+    threshold_array = np.array(
+        [_threshold_for(benchmark, thresholds, default)
+         for _, benchmark, _ in keys], dtype=float)
+
+    valid = np.isfinite(base_array) & np.isfinite(tip_array) & \
+        (base_array > 0)
+    ratios = np.full(len(keys), np.nan)
+    np.divide(tip_array, base_array, out=ratios, where=valid)
+
+    regressed = valid & (ratios > 1 + threshold_array)
+    improved = valid & (ratios < 1 / (1 + threshold_array))
+
+    def changes(mask):
+        return [Change(keys[i][0], keys[i][1], keys[i][2],
+                       float(base_array[i]), float(tip_array[i]),
+                       float(threshold_array[i]))
+                for i in np.flatnonzero(mask)]
+
+    return ComparisonReport(changes(regressed), changes(improved),
+                            int(valid.sum()))
+
+
+def _to_array(values):
+    return np.array([value if _is_number(value) else np.nan
+                     for value in values], dtype=float)
+
+
+def _is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def _threshold_for(benchmark, thresholds, default):
+    for pattern in sorted(thresholds, key=len, reverse=True):
+        if fnmatchcase(benchmark, pattern):
+            return thresholds[pattern]
+    return default
@@ -0,0 +1,120 @@
+import glob
+import json
+import logging
+import os
+
+from .util import FileLock, atomic_copy, atomic_write
+
+
+logger = logging.getLogger(__name__)
+
+
+class BaselineService(object):
+    """Makes sure master's results include a pull request's base commit on
+       the machine comparing against it.
+
+       The base of a pull request is often not a commit master's runs have
+       benchmarked, because it is older or because master moved on before
+       its run. The base is then benchmarked on demand and its results are
+       added to master's, where every later branch finds them. Runs for the
+       same commit and machine are single-flight: one benchmarks it while
+       the others wait for its results."""
+
+    def __init__(self, master_results_dir, locks_dir):
+        self._master_results_dir = master_results_dir
+        self._locks_dir = locks_dir
+        if not os.path.exists(locks_dir):
+            os.makedirs(locks_dir)
+
+    def has_results(self, commit_hash, machine, benchmarks=None):
+        """Whether master has results for commit_hash on machine covering
+           the benchmark modules in benchmarks, or every benchmark in
+           master's benchmarks.json if it's None"""
+        results = self._results(commit_hash, machine)
+        if not results:
+            return False
+        if benchmarks is None:
+            # a full run of an older suite can't cover benchmarks added to
+            # master since, so it only runs once
+            if os.path.exists(self._complete_path(commit_hash, machine)):
+                return True
+            names = self._benchmark_names()
+            return names is not None and names <= set(results)
+        return all(any(name.startswith(module + '.') for name in results)
+                   for module in benchmarks)
+
+    def ensure(self, commit_hash, machine, benchmarks, run_baseline):
+        """Call run_baseline unless master already has results for
+           commit_hash on machine. run_baseline benchmarks the commit and
+           returns the paths of its result files, which are added to
+           master's results. Returns whether run_baseline was called."""
+        lock_path = os.path.join(self._locks_dir,
+                                 '%s-%s.lock' % (commit_hash, machine))
+        with FileLock(lock_path):
+            if self.has_results(commit_hash, machine, benchmarks):
+                return False
+            logger.info('Benchmarking baseline %s on %s', commit_hash,
+                        machine)
+            self._store(machine, run_baseline())
+            if benchmarks is None:
+                open(self._complete_path(commit_hash, machine), 'w').close()
+            return True
+
+    def _store(self, machine, result_paths):
+        machine_dir = os.path.join(self._master_results_dir, machine)
+        if not os.path.exists(machine_dir):
+            os.makedirs(machine_dir)
+        for path in result_paths:
+            dest = os.path.join(machine_dir, os.path.basename(path))
+            self._merge(path, dest)
+            # master needs a machine.json if it has never run on machine
+            source = os.path.join(os.path.dirname(path), 'machine.json')
+            dest = os.path.join(machine_dir, 'machine.json')
+            if os.path.exists(source) and not os.path.exists(dest):
+                atomic_copy(source, dest)
+
+    def _merge(self, source, dest):
+        """Add the benchmarks in the result file source to those already
+           in dest, so that baselines for different benchmarks of a commit
+           add up"""
+        with open(source) as result_fp:
+            data = json.load(result_fp)
+        try:
+            with open(dest) as result_fp:
+                merged = json.load(result_fp)
+        except FileNotFoundError:
+            merged = {}
+        for key, value in data.items():
+            # results, dates, versions and the like are keyed by benchmark
+            if isinstance(value, dict) and isinstance(merged.get(key), dict):
+                merged[key].update(value)
+            else:
+                merged[key] = value
+        # dest may be hard linked into branches' results
+        with atomic_write(dest) as result_fp:
+            json.dump(merged, result_fp)
+
+    def _complete_path(self, commit_hash, machine):
+        return os.path.join(self._locks_dir,
+                            '%s-%s.complete' % (commit_hash, machine))
+
+    def _benchmark_names(self):
+        path = os.path.join(self._master_results_dir, 'benchmarks.json')
+        try:
+            with open(path) as benchmarks_fp:
+                benchmarks = json.load(benchmarks_fp)
+        except FileNotFoundError:
+            return None
+        return set(name for name in benchmarks if name != 'version')
+
+    def _results(self, commit_hash, machine):
+        pattern = os.path.join(glob.escape(self._master_results_dir),
+                               glob.escape(machine),
+                               '%s-*.json' % commit_hash[:8])
+        results = {}
+        for path in glob.glob(pattern):
+            with open(path) as result_fp:
+                data = json.load(result_fp)
+            if data.get('commit_hash') == commit_hash:
+                results.update(data.get('results', {}))
+        return results
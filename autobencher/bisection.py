@@ -0,0 +1,44 @@
+import re
+
+from subprocess import check_output
+
+
+def commits_between(source_repo, base, tip):
+    """Commits after base up to and including tip along the first-parent
+       chain, oldest first"""
+    output = check_output(['git', '-C', source_repo, 'rev-list', '--reverse',
+                           '--first-parent', '%s..%s' % (base, tip)])
+    return output.decode('utf-8').split()
+
+
+def benchmark_regex(benchmarks):
+    """asv --bench pattern selecting exactly the named benchmarks"""
+    escaped = [re.escape(benchmark) for benchmark in sorted(benchmarks)]
+    return '^(%s)$' % '|'.join(escaped)
+
+
+class RegressionBisector(object):
+    """Binary search for the commit that introduced a regression.
+
+       commits run from oldest to newest after a base that isn't regressed,
+       and the newest is. is_regressed(commit) benchmarks a commit and says
+       whether it has the regression, and is called for about log2(n) of
+       the n commits."""
+
+    def __init__(self, is_regressed):
+        self._is_regressed = is_regressed
+
+    def bisect(self, commits):
+        """Return the first regressed commit and the commits that were
+           tested to find it"""
+        good = -1
+        bad = len(commits) - 1
+        tested = []
+        while bad - good > 1:
+            middle = (good + bad) // 2
+            tested.append(commits[middle])
+            if self._is_regressed(commits[middle]):
+                bad = middle
+            else:
+                good = middle
+        return commits[bad], tested
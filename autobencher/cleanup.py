@@ -0,0 +1,191 @@
+import logging
+import os
+import shutil
+import threading
+import time
+
+from .util import FileLock, list_dir
+
+
+logger = logging.getLogger(__name__)
+
+CLOSED_MARKER = '.closed'
+
+# entries that only appear in a run directory, which tell it apart from the
+# directories of branch names containing slashes
+_RUN_DIR_ENTRIES = ('request.json', 'source_repo', 'results')
+
+
+def run_lock(runs_dir, key):
+    """Lock held while a job uses the run directory for key, so that it is
+       never collected from under the job"""
+    path = os.path.join(runs_dir, key)
+    if not os.path.exists(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+    return FileLock(path + '.lock')
+
+
+def mark_used(runs_dir, key):
+    """Record that the run directory for key was just used, which also
+       reopens it if its pull request was closed"""
+    path = os.path.join(runs_dir, key)
+    if not os.path.isdir(path):
+        return
+    try:
+        os.remove(os.path.join(path, CLOSED_MARKER))
+    except FileNotFoundError:
+        pass
+    now = time.time()
+    os.utime(path, (now, now))
+
+
+def disk_usage(path):
+    """Bytes used by the files under path, counting hard linked files once"""
+    seen = set()
+    total = 0
+    for root, dirs, files in os.walk(path):
+        for filename in files:
+            try:
+                stat = os.lstat(os.path.join(root, filename))
+            except FileNotFoundError:
+                continue
+            if stat.st_nlink > 1:
+                if (stat.st_dev, stat.st_ino) in seen:
+                    continue
+                seen.add((stat.st_dev, stat.st_ino))
+            total += stat.st_size
+    return total
+
+
+def reclaimable_bytes(path):
+    """Bytes removing path would free. Files hard linked from elsewhere,
+       such as results shared with master, stay on disk."""
+    total = 0
+    for root, dirs, files in os.walk(path):
+        for filename in files:
+            try:
+                stat = os.lstat(os.path.join(root, filename))
+            except FileNotFoundError:
+                continue
+            if stat.st_nlink == 1:
+                total += stat.st_size
+    return total
+
+
+class RunsCollector(object):
+    """Keeps the runs/ tree within max_bytes by removing pull request run
+       directories, those of closed pull requests first and then the least
+       recently used. master's directory, directories with queued or
+       running jobs and directories locked by a job are never removed.
+
+       Sweeps run on a background thread every interval seconds and
+       whenever trigger is called, such as when a pull request closes."""
+
+    def __init__(self, runs_dir, max_bytes, active_keys=None, interval=3600):
+        self._runs_dir = runs_dir
+        self._max_bytes = max_bytes
+        self._active_keys = active_keys or set
+        self._interval = interval
+        self._wakeup = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+        self._reclaimed = 0
+        self._last_sweep = None
+
+    @classmethod
+    def from_environ(cls, directory, active_keys=None):
+        """The collector for RUNS_MAX_BYTES, or None if it isn't set"""
+        max_bytes = os.environ.get('RUNS_MAX_BYTES')
+        if max_bytes is None:
+            return None
+        return cls(os.path.join(directory, 'runs'), int(max_bytes),
+                   active_keys,
+                   int(os.environ.get('RUNS_GC_INTERVAL', 3600)))
+
+    def start(self):
+        self._wakeup.set()
+        self._thread = threading.Thread(target=self._work,
+                                        name='autobencher-gc')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def trigger(self):
+        self._wakeup.set()
+
+    def mark_closed(self, key):
+        """Make the run directory for key the first to go, and sweep"""
+        path = os.path.join(self._runs_dir, key)
+        if os.path.isdir(path):
+            open(os.path.join(path, CLOSED_MARKER), 'w').close()
+            self.trigger()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'max_bytes': self._max_bytes,
+                'reclaimed_bytes': self._reclaimed,
+                'last_sweep': self._last_sweep,
+            }
+
+    def sweep(self):
+        """Remove run directories until runs/ fits in max_bytes. Returns the
+           number of bytes reclaimed."""
+        used = disk_usage(self._runs_dir)
+        active = self._active_keys()
+        reclaimed = 0
+        removed = []
+        for _, _, key in sorted(self._run_dirs()):
+            if used - reclaimed <= self._max_bytes:
+                break
+            if key in active:
+                continue
+            path = os.path.join(self._runs_dir, key)
+            lock = FileLock(path + '.lock')
+            if not lock.acquire(blocking=False):
+                continue
+            try:
+                size = reclaimable_bytes(path)
+                logger.info('Removing run directory %s', path)
+                shutil.rmtree(path)
+                reclaimed += size
+                removed.append(key)
+            finally:
+                lock.release()
+
+        if removed:
+            logger.info('Reclaimed %d bytes from %d run directories',
+                        reclaimed, len(removed))
+        with self._lock:
+            self._reclaimed += reclaimed
+            self._last_sweep = {'time': time.time(), 'used_bytes': used,
+                                'reclaimed_bytes': reclaimed,
+                                'removed': removed}
+        return reclaimed
+
+    def _work(self):
+        while True:
+            self._wakeup.wait(self._interval)
+            self._wakeup.clear()
+            try:
+                self.sweep()
+            except Exception:
+                logger.exception('Sweeping %s failed', self._runs_dir)
+
+    def _run_dirs(self):
+        """(open, last used, key) of every pull request run directory, so
+           that closed ones sort first"""
+        run_dirs = []
+        pending = [name for name in list_dir(self._runs_dir)
+                   if name != 'master']
+        while pending:
+            key = pending.pop()
+            path = os.path.join(self._runs_dir, key)
+            if not os.path.isdir(path):
+                continue
+            names = list_dir(path)
+            if any(name in names for name in _RUN_DIR_ENTRIES):
+                closed = CLOSED_MARKER in names
+                run_dirs.append((not closed, os.stat(path).st_mtime, key))
+            else:
+                pending.extend(os.path.join(key, name) for name in names)
+        return run_dirs
@@ -0,0 +1,139 @@
+import gzip
+import io
+import mimetypes
+import os
+import re
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+from .util import atomic_write
+
+
+# text artifacts worth compressing, which asv's html is mostly made of
+COMPRESSIBLE = ('.html', '.js', '.css', '.json', '.svg', '.txt', '.xml',
+                '.csv', '.map')
+MIN_SIZE = 256
+
+# Content-Encoding of each variant by suffix, in order of preference
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+
+IMMUTABLE = 'public, max-age=31536000, immutable'
+REVALIDATE = 'no-cache'
+
+# a content hash in a file name, such as app.3f2a9c1e.js
+_HASHED = re.compile(r'[.-][0-9a-f]{8,}\.[^/]+$')
+
+
+def _compress(data, encoding):
+    if encoding == 'gzip':
+        # no timestamp, so that unchanged files compress to the same bytes
+        out = io.BytesIO()
+        with gzip.GzipFile(fileobj=out, mode='wb', compresslevel=9,
+                           mtime=0) as gzip_fp:
+            gzip_fp.write(data)
+        return out.getvalue()
+    return brotli.compress(data)
+
+
+def available_encodings():
+    return [(encoding, suffix) for encoding, suffix in ENCODINGS
+            if encoding != 'br' or brotli is not None]
+
+
+def variant_of(path):
+    """(encoding, source path) if path is a compressed variant of a text
+       artifact, otherwise None"""
+    for encoding, suffix in ENCODINGS:
+        if path.endswith(suffix) and \
+                path[:-len(suffix)].endswith(COMPRESSIBLE):
+            return encoding, path[:-len(suffix)]
+    return None
+
+
+def precompress(directory):
+    """Write gzip, and brotli when it is installed, variants next to every
+       text artifact under directory that is worth compressing, and remove
+       variants that are out of date. Returns the number of variants
+       written."""
+    written = 0
+    for root, dirs, files in os.walk(directory):
+        names = set(files)
+        for filename in files:
+            path = os.path.join(root, filename)
+            variant = variant_of(filename)
+            if variant is not None:
+                if variant[1] not in names:
+                    os.remove(path)
+                continue
+            if not filename.endswith(COMPRESSIBLE):
+                continue
+            stat = os.stat(path)
+            data = None
+            for encoding, suffix in available_encodings():
+                variant_path = path + suffix
+                if filename + suffix in names and \
+                        os.stat(variant_path).st_mtime >= stat.st_mtime:
+                    continue
+                if data is None:
+                    with open(path, 'rb') as source_fp:
+                        data = source_fp.read()
+                compressed = _compress(data, encoding) \
+                    if len(data) >= MIN_SIZE else None
+                if compressed is None or len(compressed) >= len(data):
+                    if filename + suffix in names:
+                        os.remove(variant_path)
+                    continue
+                with atomic_write(variant_path, 'wb') as variant_fp:
+                    variant_fp.write(compressed)
+                written += 1
+    return written
+
+
+def accepted_encodings(accept_encoding):
+    """Content codings an Accept-Encoding header allows"""
+    accepted = set()
+    for item in (accept_encoding or '').split(','):
+        parts = [part.strip() for part in item.split(';')]
+        quality = 1.0
+        for parameter in parts[1:]:
+            if parameter.startswith('q='):
+                try:
+                    quality = float(parameter[2:])
+                except ValueError:
+                    quality = 0.0
+        if parts[0] and quality > 0:
+            accepted.add(parts[0].lower())
+    return accepted
+
+
+def is_hashed(path):
+    """Whether the file name carries a hash of its content, so that it can
+       be cached forever"""
+    return _HASHED.search(os.path.basename(path)) is not None
+
+
+def cache_control(path):
+    return IMMUTABLE if is_hashed(path) else REVALIDATE
+
+
+def content_type(path):
+    mime_type = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+    if mime_type.startswith('text/') or mime_type in (
+            'application/javascript', 'application/json', 'image/svg+xml'):
+        mime_type += '; charset=utf-8'
+    return mime_type
+
+
+def artifact_headers(path):
+    """HTTP headers to store a published file, or one of its variants,
+       with"""
+    variant = variant_of(path)
+    if variant is not None:
+        headers = artifact_headers(variant[1])
+        headers['Content-Encoding'] = variant[0]
+        return headers
+    return {'Content-Type': content_type(path),
+            'Cache-Control': cache_control(path)}
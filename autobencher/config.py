@@ -0,0 +1,15 @@
+import json
+import os
+
+
+REPO_CONFIG_FILE = 'autobencher.json'
+
+
+def load_repo_config(source_repo):
+    """Load the optional autobencher.json from the root of a benchmarked
+       repository"""
+    path = os.path.join(source_repo, REPO_CONFIG_FILE)
+    if not os.path.exists(path):
+        return {}
+    with open(path) as config_fp:
+        return json.load(config_fp)
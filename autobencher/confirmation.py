@@ -0,0 +1,113 @@
+import logging
+
+from .analysis import ComparisonReport
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CONFIDENCE = 0.95
+DEFAULT_MAX_ROUNDS = 8
+DEFAULT_FIRST_PASS_REPEAT = 1
+
+
+def sign_test(successes, trials):
+    """One-sided sign test p-value of at least successes out of trials
+       when each trial is a coin flip"""
+    tail = 0
+    # trials choose k, kept up to date as k goes up
+    ways = 1
+    for k in range(trials + 1):
+        if k >= successes:
+            tail += ways
+        ways = ways * (trials - k) // (k + 1)
+    return tail / 2.0 ** trials
+
+
+class ConfirmationSettings(object):
+    """How suspected regressions are confirmed, from the "confirmation"
+       entry of a repository's autobencher.json. The first pass runs every
+       benchmark with first_pass_repeat repeats, and each regression it
+       finds is then rerun for up to max_rounds rounds until the sign test
+       reaches confidence either way."""
+
+    def __init__(self, first_pass_repeat=DEFAULT_FIRST_PASS_REPEAT,
+                 confidence=DEFAULT_CONFIDENCE, max_rounds=DEFAULT_MAX_ROUNDS):
+        if not 0 < confidence < 1:
+            raise ValueError('confidence must be between 0 and 1')
+        if sign_test(max_rounds, max_rounds) > 1 - confidence:
+            raise ValueError('%d rounds can never reach a confidence of %g' %
+                             (max_rounds, confidence))
+        self.first_pass_repeat = first_pass_repeat
+        self.confidence = confidence
+        self.max_rounds = max_rounds
+
+    @classmethod
+    def from_config(cls, repo_config):
+        """The settings in repo_config, or None if confirmation is off"""
+        config = repo_config.get('confirmation')
+        if config is None:
+            return None
+        return cls(**config)
+
+
+class RegressionConfirmer(object):
+    """Reruns the benchmarks a first pass flagged until each regression is
+       confirmed or cleared.
+
+       run_round(benchmarks, tip_first) benchmarks the base and the tip
+       back to back for the named benchmarks and returns the
+       ComparisonReport of that round. The order flips every round so
+       that drift over the session affects both sides alike. Each round
+       is one trial of a sign test per regression, and a regression
+       stops being rerun as soon as the test is decided."""
+
+    def __init__(self, run_round, settings):
+        self._run_round = run_round
+        self._settings = settings
+
+    def confirm(self, report):
+        """report with only the confirmed regressions. Its confirmation
+           attribute has the trials for every suspected regression."""
+        alpha = 1 - self._settings.confidence
+        max_rounds = self._settings.max_rounds
+        trials = dict((self._key(change), [0, 0])
+                      for change in report.regressions)
+        decided = {}
+
+        for round_number in range(max_rounds):
+            pending = [key for key in trials if key not in decided]
+            if not pending:
+                break
+            benchmarks = sorted(set(key[1] for key in pending))
+            round_report = self._run_round(benchmarks, round_number % 2 == 1)
+            regressed = set(self._key(change)
+                            for change in round_report.regressions)
+            for key in pending:
+                counts = trials[key]
+                counts[0] += key in regressed
+                counts[1] += 1
+                regressions, rounds = counts
+                remaining = max_rounds - rounds
+                if sign_test(regressions, rounds) <= alpha:
+                    decided[key] = True
+                elif sign_test(rounds - regressions, rounds) <= alpha or \
+                        sign_test(regressions + remaining,
+                                  max_rounds) > alpha:
+                    decided[key] = False
+
+        confirmed = [change for change in report.regressions
+                     if decided.get(self._key(change), False)]
+        logger.info('Confirmed %d of %d suspected regressions',
+                    len(confirmed), len(report.regressions))
+        confirmed_report = ComparisonReport(confirmed, report.improvements,
+                                            report.compared)
+        confirmed_report.confirmation = dict(
+            ('%s [%s]' % (change.name, change.configuration), {
+                'regressed_rounds': trials[self._key(change)][0],
+                'rounds': trials[self._key(change)][1],
+                'confirmed': decided.get(self._key(change), False),
+            }) for change in report.regressions)
+        return confirmed_report
+
+    def _key(self, change):
+        return (change.configuration, change.benchmark, change.params)
@@ -0,0 +1,91 @@
+import sqlite3
+import threading
+import time
+
+from collections import OrderedDict
+
+
+class DeliveryCache(object):
+    """Remembers which webhook deliveries have already been queued so that
+       GitHub redeliveries don't start duplicate runs. Entries are kept in a
+       bounded in-memory LRU and persisted to SQLite, and expire after ttl
+       seconds."""
+
+    def __init__(self, path, max_entries=10000, ttl=7 * 24 * 60 * 60):
+        self._max_entries = max_entries
+        self._ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._conn:
+            self._conn.execute(
+                'CREATE TABLE IF NOT EXISTS deliveries ('
+                'key TEXT PRIMARY KEY, job_id TEXT NOT NULL, '
+                'seen REAL NOT NULL)')
+        self._load()
+
+    def get(self, keys):
+        """Return the job id recorded for the first known key, if any"""
+        now = time.time()
+        with self._lock:
+            for key in keys:
+                entry = self._entries.get(key)
+                if entry is None:
+                    continue
+                job_id, seen = entry
+                if now - seen > self._ttl:
+                    del self._entries[key]
+                    continue
+                self._entries.move_to_end(key)
+                return job_id
+        return None
+
+    def add(self, keys, job_id):
+        now = time.time()
+        with self._lock:
+            for key in keys:
+                self._entries[key] = (job_id, now)
+                self._entries.move_to_end(key)
+            evicted = []
+            while len(self._entries) > self._max_entries:
+                evicted.append(self._entries.popitem(last=False)[0])
+
+            with self._conn:
+                self._conn.executemany(
+                    'INSERT OR REPLACE INTO deliveries VALUES (?, ?, ?)',
+                    [(key, job_id, now) for key in keys])
+                self._conn.executemany(
+                    'DELETE FROM deliveries WHERE key = ?',
+                    [(key,) for key in evicted])
+                self._conn.execute('DELETE FROM deliveries WHERE seen < ?',
+                                   (now - self._ttl,))
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _load(self):
+        cutoff = time.time() - self._ttl
+        rows = self._conn.execute(
+            'SELECT key, job_id, seen FROM deliveries WHERE seen >= ? '
+            'ORDER BY seen DESC LIMIT ?', (cutoff, self._max_entries))
+        for key, job_id, seen in reversed(rows.fetchall()):
+            self._entries[key] = (job_id, seen)
+
+
+def delivery_keys(event, delivery_id=None):
+    """Keys identifying a webhook delivery: GitHub's delivery id and the
+       (repository, head sha, action) it describes."""
+    keys = []
+    if delivery_id:
+        keys.append('delivery:' + delivery_id)
+
+    pull_request = event.get('pull_request', {})
+    head_sha = pull_request.get('head', {}).get('sha')
+    repository = event.get('repository', {}).get('full_name')
+    if repository is None:
+        repository = pull_request.get('base', {}).get('repo', {}).get(
+            'full_name')
+    if head_sha is not None:
+        keys.append('event:%s:%s:%s' % (repository, head_sha,
+                                        event.get('action')))
+    return keys
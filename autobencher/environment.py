@@ -0,0 +1,115 @@
+import hashlib
+import json
+import logging
+import os
+import shutil
+import time
+
+from .util import FileLock, directory_size, list_dir
+
+
+logger = logging.getLogger(__name__)
+
+# asv.conf.json settings that decide what gets installed into an environment
+ENVIRONMENT_KEYS = ('environment_type', 'pythons', 'matrix', 'exclude',
+                    'include', 'conda_channels', 'build_command',
+                    'install_command', 'uninstall_command')
+
+
+class EnvironmentPool(object):
+    """Cache of asv environment directories shared by every branch. Runs
+       whose asv configuration installs the same environments get a warm
+       env_dir instead of asv building a new one. Each env_dir is leased to
+       one run at a time, and the least recently used ones are evicted once
+       the pool grows past max_bytes."""
+
+    def __init__(self, pool_dir, max_bytes=None):
+        self._pool_dir = pool_dir
+        self._max_bytes = max_bytes
+
+    @classmethod
+    def from_environ(cls, directory):
+        max_bytes = os.environ.get('ENV_CACHE_MAX_BYTES')
+        if max_bytes is not None:
+            max_bytes = int(max_bytes)
+        return cls(os.path.join(directory, 'envs'), max_bytes)
+
+    def key_for(self, asv_config):
+        settings = dict((key, asv_config.get(key))
+                        for key in ENVIRONMENT_KEYS)
+        encoded = json.dumps(settings, sort_keys=True).encode('utf-8')
+        return hashlib.sha1(encoded).hexdigest()[:16]
+
+    def acquire(self, asv_config):
+        """Lease an env_dir for asv_config. The lease holds a lock that is
+           also held by processes forked while it is open."""
+        key_dir = os.path.join(self._pool_dir, self.key_for(asv_config))
+        if not os.path.exists(key_dir):
+            os.makedirs(key_dir)
+
+        slot = 0
+        while True:
+            env_dir = os.path.join(key_dir, str(slot))
+            lock = FileLock(env_dir + '.lock')
+            if lock.acquire(blocking=False):
+                break
+            slot += 1
+
+        if not os.path.exists(env_dir):
+            os.makedirs(env_dir)
+        self._touch(env_dir)
+        lease = EnvironmentLease(env_dir, lock)
+
+        if self._max_bytes is not None:
+            self.evict(self._max_bytes)
+        return lease
+
+    def evict(self, max_bytes):
+        """Remove the least recently used env_dirs that aren't leased until
+           the pool fits in max_bytes. Returns the number of bytes freed."""
+        env_dirs = []
+        for key in list_dir(self._pool_dir):
+            key_dir = os.path.join(self._pool_dir, key)
+            for slot in list_dir(key_dir):
+                env_dir = os.path.join(key_dir, slot)
+                if os.path.isdir(env_dir):
+                    env_dirs.append((self._last_used(env_dir), env_dir,
+                                     directory_size(env_dir)))
+
+        total = sum(size for _, _, size in env_dirs)
+        freed = 0
+        for _, env_dir, size in sorted(env_dirs):
+            if total - freed <= max_bytes:
+                break
+            lock = FileLock(env_dir + '.lock')
+            if not lock.acquire(blocking=False):
+                continue
+            try:
+                logger.info('Evicting environment %s', env_dir)
+                shutil.rmtree(env_dir)
+                freed += size
+            finally:
+                lock.release()
+        return freed
+
+    def _touch(self, env_dir):
+        now = time.time()
+        os.utime(env_dir, (now, now))
+
+    def _last_used(self, env_dir):
+        return os.stat(env_dir).st_mtime
+
+
+class EnvironmentLease(object):
+    def __init__(self, env_dir, lock):
+        self._env_dir = env_dir
+        self._lock = lock
+
+    @property
+    def env_dir(self):
+        return self._env_dir
+
+    def release(self):
+        if self._lock is not None:
+            self._lock.release()
+            self._lock = None
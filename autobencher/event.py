@@ -6,6 +6,7 @@ class EventData(object):
         self.reporter_data = ReporterData()
         self.runner_data = RunnerData()
         self.is_master_update = False
+        self.closed_run_key = None
 
     @property
     def valid(self):
@@ -23,6 +24,24 @@ class EventData(object):
     def is_master_update(self, value):
         self._is_master_update = value
 
+    @property
+    def closed_run_key(self):
+        """Run key of the pull request a closed event closes, merged or
+           not"""
+        return self._closed_run_key
+
+    @closed_run_key.setter
+    def closed_run_key(self, value):
+        self._closed_run_key = value
+
+    @property
+    def run_key(self):
+        """Identifies the run directory an event benchmarks into"""
+        if self._is_master_update:
+            return 'master'
+        return '/'.join([self.runner_data.branch_owner,
+                         self.runner_data.branch])
+
 
 class RunnerData(object):
     @property
@@ -57,18 +76,38 @@ class RunnerData(object):
     def branch_owner(self, value):
         self._branch_owner = value
 
+    @property
+    def head_sha(self):
+        return self._head_sha
+
+    @head_sha.setter
+    def head_sha(self, value):
+        self._head_sha = value
+
+    @property
+    def upstream_uri(self):
+        return self._upstream_uri
+
+    @upstream_uri.setter
+    def upstream_uri(self, value):
+        self._upstream_uri = value
+
     def __init__(self, repository_uri=None, repository_base=None, branch=None,
-                 branch_owner=None):
+                 branch_owner=None, head_sha=None, upstream_uri=None):
         self._repository_uri = repository_uri
         self._repository_base = repository_base
         self._branch = branch
         self._branch_owner = branch_owner
+        self._head_sha = head_sha
+        self._upstream_uri = upstream_uri
 
     def __eq__(self, other):
         return (self._repository_uri == other._repository_uri and
                 self._repository_base == other._repository_base and
                 self._branch == other._branch and
-                self._branch_owner == other._branch_owner)
+                self._branch_owner == other._branch_owner and
+                self._head_sha == other._head_sha and
+                self._upstream_uri == other._upstream_uri)
 
 
 class ReporterData(object):
@@ -133,21 +172,34 @@ class GitHubWebhooksParser(EventParser):
         self._event_data = EventData()
         self._event_data.valid = self._event_is_valid(event)
 
+        if 'pull_request' in event and event.get('action') == 'closed':
+            head = event['pull_request']['head']
+            # repo is null when the fork has been deleted
+            if head.get('repo') is not None:
+                self._event_data.closed_run_key = '/'.join(
+                    [head['repo']['owner']['login'], head['ref']])
+
         if self._event_data.valid:
             self._event_data.is_master_update = self._is_valid_merge(event)
             branch = event['pull_request']['head']['ref']
-            branch_owner = \
-                event['pull_request']['head']['repo']['owner']['login']
+            # merges of pull requests from deleted forks still update master
+            head_repo = event['pull_request']['head'].get('repo') or \
+                event['pull_request']['base']['repo']
+            branch_owner = head_repo['owner']['login']
 
             self._event_data.reporter_data.branch = branch
             self._event_data.reporter_data.branch_owner = branch_owner
 
             self._event_data.runner_data.repository_uri = \
-                event['pull_request']['head']['repo']['clone_url']
+                head_repo['clone_url']
             self._event_data.runner_data.repository_base = \
                 event['pull_request']['base']['sha']
             self._event_data.runner_data.branch = branch
             self._event_data.runner_data.branch_owner = branch_owner
+            self._event_data.runner_data.head_sha = \
+                event['pull_request']['head'].get('sha')
+            self._event_data.runner_data.upstream_uri = \
+                event['pull_request']['base'].get('repo', {}).get('clone_url')
 
     def get_event_data(self):
         return self._event_data
@@ -0,0 +1,202 @@
+import asyncio
+import codecs
+import logging
+import os
+import shlex
+import signal
+import threading
+import time
+
+from subprocess import CalledProcessError, PIPE
+
+
+logger = logging.getLogger(__name__)
+
+
+class CommandCancelled(Exception):
+    """Raised for commands of a cancelled CommandGroup"""
+
+
+class CommandResult(object):
+    def __init__(self, args, returncode, duration, stdout, stderr):
+        self.args = args
+        self.returncode = returncode
+        self.duration = duration
+        self.stdout = stdout
+        self.stderr = stderr
+
+    def to_dict(self):
+        return {'args': self.args, 'returncode': self.returncode,
+                'duration': self.duration}
+
+
+class CommandGroup(object):
+    """The commands run for one job. Cancelling the group kills its running
+       commands, along with everything they started, and stops any more
+       from starting. on_output is called with the stream name and each
+       chunk of output as it arrives, and with the 'command' stream and the
+       command line as each command starts. Commands still running
+       kill_grace seconds after being asked to stop are killed outright."""
+
+    def __init__(self, on_output=None, kill_grace=5):
+        self._on_output = on_output
+        self._kill_grace = kill_grace
+        self._lock = threading.Lock()
+        self._processes = set()
+        self._cancelled = False
+        self._results = []
+
+    @property
+    def cancelled(self):
+        return self._cancelled
+
+    @property
+    def pids(self):
+        """Process ids of the running commands, which are also the ids of
+           their sessions"""
+        with self._lock:
+            return [process.pid for process in self._processes]
+
+    @property
+    def results(self):
+        with self._lock:
+            return list(self._results)
+
+    def cancel(self):
+        with self._lock:
+            self._cancelled = True
+            processes = list(self._processes)
+        for process in processes:
+            self._kill(process)
+
+    def _started(self, process):
+        with self._lock:
+            self._processes.add(process)
+            cancelled = self._cancelled
+        if cancelled:
+            self._kill(process)
+
+    def _finished(self, process, result):
+        with self._lock:
+            self._processes.discard(process)
+            self._results.append(result)
+
+    def _output(self, stream_name, text):
+        if self._on_output is not None:
+            self._on_output(stream_name, text)
+
+    def _kill(self, process):
+        # every command leads its own session, so this reaches the
+        # processes it started too
+        self._signal(process, signal.SIGTERM)
+        timer = threading.Timer(self._kill_grace, self._signal,
+                                (process, signal.SIGKILL))
+        timer.daemon = True
+        timer.start()
+
+    def _signal(self, process, signum):
+        try:
+            os.killpg(process.pid, signum)
+        except ProcessLookupError:
+            pass
+
+
+class ExecutionEngine(object):
+    """Runs commands as asyncio subprocesses on one event loop thread, so
+       that any number of runs can be supervised from this process without
+       forking it. Commands always get an explicit working directory. The
+       blocking methods are meant to be called from other threads, such as
+       the scheduler's slots."""
+
+    _CHUNK_SIZE = 65536
+    # characters of output kept for error messages when it isn't captured
+    _TAIL_SIZE = 4096
+
+    def __init__(self):
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever,
+                                        name='autobencher-engine')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def run(self, args, cwd, group=None, env=None, capture=False):
+        """Run args in cwd and return its CommandResult. Output is streamed
+           to the group, and the result only holds all of it when capture is
+           set, otherwise just its tail, so that chatty commands run in
+           bounded memory."""
+        if group is None:
+            group = CommandGroup()
+        future = asyncio.run_coroutine_threadsafe(
+            self._run(list(args), cwd, group, env, capture), self._loop)
+        return future.result()
+
+    def check_call(self, args, cwd, group=None, env=None, capture=False):
+        result = self.run(args, cwd, group, env, capture)
+        if result.returncode != 0:
+            raise CalledProcessError(result.returncode, args, result.stdout,
+                                     result.stderr)
+        return result
+
+    def check_output(self, args, cwd, group=None, env=None):
+        return self.check_call(args, cwd, group, env, capture=True).stdout
+
+    async def _run(self, args, cwd, group, env, capture):
+        if group.cancelled:
+            raise CommandCancelled(args)
+
+        group._output('command', '$ %s\n' % ' '.join(
+            shlex.quote(arg) for arg in args))
+        start = time.time()
+        process = await asyncio.create_subprocess_exec(
+            *args, cwd=cwd, env=env, stdin=asyncio.subprocess.DEVNULL,
+            stdout=PIPE, stderr=PIPE, start_new_session=True)
+        group._started(process)
+        try:
+            stdout, stderr = await asyncio.gather(
+                self._read(process.stdout, 'stdout', group, capture),
+                self._read(process.stderr, 'stderr', group, capture))
+            returncode = await process.wait()
+        except BaseException:
+            group._kill(process)
+            raise
+        finally:
+            result = CommandResult(args, process.returncode,
+                                   time.time() - start, '', '')
+            group._finished(process, result)
+        result.stdout = stdout
+        result.stderr = stderr
+
+        logger.debug('%s exited with %d after %.1fs', args[0], returncode,
+                     result.duration)
+        if group.cancelled:
+            raise CommandCancelled(args)
+        return result
+
+    async def _read(self, stream, stream_name, group, capture):
+        decoder = codecs.getincrementaldecoder('utf-8')('replace')
+        chunks = []
+        tail = ''
+        while True:
+            data = await stream.read(self._CHUNK_SIZE)
+            text = decoder.decode(data, final=not data)
+            if text:
+                if capture:
+                    chunks.append(text)
+                else:
+                    tail = (tail + text)[-self._TAIL_SIZE:]
+                group._output(stream_name, text)
+            if not data:
+                return ''.join(chunks) if capture else tail
+
+
+_engine = None
+_engine_lock = threading.Lock()
+
+
+def get_engine():
+    """The engine shared by everything in this process"""
+    global _engine
+    with _engine_lock:
+        if _engine is None:
+            _engine = ExecutionEngine()
+        return _engine
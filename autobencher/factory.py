@@ -3,7 +3,7 @@ from abc import ABCMeta, abstractmethod
 from .runner import ASVBenchmarkRunner, ASVMasterBenchmarkRunner
 from .reporter import ASVRemoteBenchmarkReporter
 from .event import ASVEventParser
-from .publisher import ASVPublisher
+from .publisher import ASVPublisher, get_publish_queue
 
 
 class BenchmarkerFactory(metaclass=ABCMeta):
@@ -42,13 +42,14 @@ class ASVBenchmarkerFactory(BenchmarkerFactory):
     @classmethod
     def make_master_runner(cls, directory, data, publisher):
         return ASVMasterBenchmarkRunner(directory, data.repository_uri,
-                                        publisher)
+                                        publisher, data.upstream_uri)
 
     @classmethod
     def makeRunner(cls, directory, data, reporter, publisher):
         return ASVBenchmarkRunner(directory, data.repository_uri,
                                   data.repository_base, data.branch,
-                                  data.branch_owner, reporter, publisher)
+                                  data.branch_owner, reporter, publisher,
+                                  data.upstream_uri, data.head_sha)
 
     @classmethod
     def makeReporter(cls, data, report_auth, result_address):
@@ -62,4 +63,4 @@ class ASVBenchmarkerFactory(BenchmarkerFactory):
 
     @classmethod
     def make_publisher(cls, url):
-        return ASVPublisher(url)
+        return ASVPublisher(url, queue=get_publish_queue())
@@ -0,0 +1,192 @@
+import logging
+import random
+import re
+import threading
+import time
+
+from collections import Counter
+from urllib.parse import urlparse
+
+import requests
+
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import ConnectTimeoutError
+
+
+logger = logging.getLogger(__name__)
+
+RETRY_STATUSES = (500, 502, 503, 504)
+
+# methods that are safe to repeat when an attempt may have reached GitHub
+IDEMPOTENT_METHODS = ('GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE')
+
+_SHA = re.compile(r'/[0-9a-f]{40}(?=/|$)')
+_NUMBER = re.compile(r'/[0-9]+(?=/|$)')
+
+
+def endpoint(method, url):
+    """method and path of url, with commit hashes and ids replaced, so that
+       calls to the same endpoint are counted together"""
+    path = _NUMBER.sub('/{id}', _SHA.sub('/{sha}', urlparse(url).path))
+    return '%s %s' % (method.upper(), path)
+
+
+def _never_sent(error):
+    """Whether a connection error happened before the request reached the
+       server, such as a refused connection or a connect timeout"""
+    if isinstance(error, requests.ConnectTimeout):
+        return True
+    reason = getattr(error.args[0], 'reason', None) if error.args else None
+    # urllib3's NewConnectionError is a ConnectTimeoutError too
+    return isinstance(reason, ConnectTimeoutError)
+
+
+class GitHubClient(object):
+    """Client for the GitHub API shared by every reporter.
+
+       Requests go through one keep-alive session with a connection pool
+       and default timeouts. 5xx responses, connection errors and secondary
+       rate limits are retried up to retries times with jittered
+       exponential backoff, honouring Retry-After. Connection errors of
+       requests that aren't idempotent, such as posting a comment, are
+       only retried when the request never got sent, so that they don't
+       happen twice. The client follows
+       X-RateLimit-Remaining and spreads its calls over the rest of the
+       window once fewer than min_remaining are left, so it slows down
+       ahead of the limit instead of running into it. It never waits longer
+       than max_wait at a time, and responses that are still errors raise
+       requests.HTTPError."""
+
+    def __init__(self, timeout=(5, 30), retries=4, backoff=1.0,
+                 max_backoff=60, min_remaining=100, max_wait=900,
+                 pool_size=10, sleep=time.sleep):
+        self._timeout = timeout
+        self._retries = retries
+        self._backoff = backoff
+        self._max_backoff = max_backoff
+        self._min_remaining = min_remaining
+        self._max_wait = max_wait
+        self._sleep = sleep
+        self._session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size,
+                              pool_maxsize=pool_size)
+        self._session.mount('https://', adapter)
+        self._session.mount('http://', adapter)
+        self._lock = threading.Lock()
+        self._calls = Counter()
+        self._retried = Counter()
+        self._remaining = None
+        self._reset = None
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request('POST', url, **kwargs)
+
+    def delete(self, url, **kwargs):
+        return self.request('DELETE', url, **kwargs)
+
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault('timeout', self._timeout)
+        name = endpoint(method, url)
+        attempt = 0
+        while True:
+            self._throttle()
+            with self._lock:
+                self._calls[name] += 1
+            try:
+                response = self._session.request(method, url, **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                if attempt >= self._retries or not (
+                        method.upper() in IDEMPOTENT_METHODS or
+                        _never_sent(e)):
+                    raise
+                delay = self._backoff_delay(attempt)
+                logger.warning('%s failed, retrying in %.1fs', name, delay)
+            else:
+                self._track_rate_limit(response)
+                delay = self._retry_delay(response, attempt)
+                if delay is None or delay > self._max_wait or \
+                        attempt >= self._retries:
+                    response.raise_for_status()
+                    return response
+                logger.warning('%s returned %d, retrying in %.1fs', name,
+                               response.status_code, delay)
+            with self._lock:
+                self._retried[name] += 1
+            self._sleep(delay)
+            attempt += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                'calls': dict(self._calls),
+                'retries': dict(self._retried),
+                'rate_limit_remaining': self._remaining,
+                'rate_limit_reset': self._reset,
+            }
+
+    def _backoff_delay(self, attempt):
+        return random.uniform(0, min(self._max_backoff,
+                                     self._backoff * 2 ** attempt))
+
+    def _retry_delay(self, response, attempt):
+        """Seconds to wait before retrying response, or None if it isn't
+           worth retrying"""
+        if response.status_code in RETRY_STATUSES:
+            return self._backoff_delay(attempt)
+        if response.status_code not in (403, 429):
+            return None
+        retry_after = response.headers.get('Retry-After')
+        if retry_after is not None:
+            try:
+                return float(retry_after)
+            except ValueError:
+                return self._backoff_delay(attempt)
+        if response.headers.get('X-RateLimit-Remaining') == '0':
+            return max(0, self._reset - time.time()) \
+                if self._reset is not None else self._backoff_delay(attempt)
+        if 'rate limit' in response.text.lower():
+            # secondary rate limits without a Retry-After want at least a
+            # minute
+            return max(60, self._backoff_delay(attempt))
+        return None
+
+    def _track_rate_limit(self, response):
+        remaining = response.headers.get('X-RateLimit-Remaining')
+        reset = response.headers.get('X-RateLimit-Reset')
+        if remaining is None or reset is None:
+            return
+        with self._lock:
+            self._remaining = int(remaining)
+            self._reset = float(reset)
+
+    def _throttle(self):
+        with self._lock:
+            remaining = self._remaining
+            reset = self._reset
+            if remaining is None or remaining >= self._min_remaining:
+                return
+            # count this call against the window already
+            self._remaining = max(0, remaining - 1)
+        wait = reset - time.time()
+        if wait <= 0 or wait > self._max_wait:
+            return
+        delay = wait if remaining == 0 else wait / remaining
+        logger.info('%d GitHub API calls left, waiting %.1fs', remaining,
+                    delay)
+        self._sleep(delay)
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_github_client():
+    """The client shared by everything in this process"""
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = GitHubClient()
+        return _client
@@ -0,0 +1,213 @@
+import ast
+import logging
+import os
+import re
+
+from fnmatch import fnmatchcase
+from subprocess import CalledProcessError, check_output
+
+
+logger = logging.getLogger(__name__)
+
+# changes to these paths can't affect benchmark results. Only prose .txt
+# files are listed, since requirements files and package data can.
+DEFAULT_IGNORE_PATHS = ('*.md', '*.rst', 'README*.txt', 'CHANGES*.txt',
+                        'doc/*', 'docs/*', '.github/*', '.travis.yml',
+                        'appveyor.yml', '.gitignore', '.gitattributes',
+                        '.coveragerc', 'LICENSE*', 'AUTHORS*', 'CHANGELOG*')
+
+SOURCE_PREFIXES = ('src', 'lib')
+
+
+def changed_files(source_repo, base, head='HEAD'):
+    """Paths changed between the merge-base of base and head, and head, or
+       None if git can't tell"""
+    try:
+        output = check_output(['git', '-C', source_repo, 'diff',
+                               '--name-only', '%s...%s' % (base, head)])
+    except CalledProcessError:
+        return None
+    return [line for line in output.decode('utf-8').splitlines() if line]
+
+
+def bench_regex(modules):
+    """asv --bench pattern selecting every benchmark in modules"""
+    escaped = [re.escape(module) for module in sorted(modules)]
+    return '^(%s)\\.' % '|'.join(escaped)
+
+
+class ImpactAnalyzer(object):
+    """Works out which benchmark modules a set of changed paths can affect.
+
+       Changed Python modules are followed through the import graph of the
+       source tree to the benchmark modules that import them, directly or
+       not. mapping adds explicit path pattern -> benchmark module entries
+       for dependencies import analysis can't see. Changes to anything else
+       that isn't ignored, such as extension sources or build files, affect
+       every benchmark."""
+
+    def __init__(self, source_repo, benchmark_dir='benchmarks', mapping=None,
+                 ignore_paths=DEFAULT_IGNORE_PATHS):
+        self._source_repo = source_repo
+        self._benchmark_dir = benchmark_dir.strip('/')
+        self._mapping = mapping or {}
+        self._ignore_paths = tuple(ignore_paths)
+
+    def affected_benchmarks(self, paths):
+        """Return the set of affected benchmark modules, which is empty if
+           nothing benchmark-relevant changed, or None if every benchmark is
+           affected"""
+        if paths is None:
+            return None
+
+        benchmarks = set()
+        changed_modules = set()
+        changed_benchmarks = set()
+        for path in paths:
+            if self._is_ignored(path):
+                continue
+
+            mapped = self._mapped_benchmarks(path)
+            if mapped:
+                benchmarks.update(mapped)
+                continue
+
+            if path.startswith(self._benchmark_dir + '/'):
+                relative = path[len(self._benchmark_dir) + 1:]
+                # a package __init__ can change every benchmark under it
+                if not relative.endswith('.py') or \
+                        os.path.basename(relative) == '__init__.py':
+                    return None
+                changed_benchmarks.add(self._module_name(relative))
+                continue
+
+            if not path.endswith('.py') or path == 'setup.py':
+                logger.info('%s changed, running all benchmarks', path)
+                return None
+            changed_modules.update(self._module_names(path))
+
+        if changed_modules or changed_benchmarks:
+            benchmarks.update(self._importing_benchmarks(changed_modules,
+                                                         changed_benchmarks))
+        return benchmarks
+
+    def _is_ignored(self, path):
+        return any(fnmatchcase(path, pattern)
+                   for pattern in self._ignore_paths)
+
+    def _mapped_benchmarks(self, path):
+        mapped = set()
+        for pattern, modules in self._mapping.items():
+            if fnmatchcase(path, pattern):
+                mapped.update(modules)
+        return mapped
+
+    def _importing_benchmarks(self, changed_modules, changed_benchmarks):
+        """Benchmark modules that import changed_modules of the source tree
+           or changed_benchmarks of the benchmark directory, directly or
+           not"""
+        benchmark_root = os.path.join(self._source_repo, self._benchmark_dir)
+        benchmark_graph = self._import_graph(benchmark_root)
+
+        changed = set(changed_benchmarks)
+        if changed_modules:
+            graph = self._import_graph(self._source_repo,
+                                       exclude=self._benchmark_dir)
+            affected = self._importers(graph, changed_modules)
+            changed.update(module for module, imports
+                           in benchmark_graph.items() if imports & affected)
+
+        # helpers imported by benchmark modules hold no benchmarks of their
+        # own
+        helpers = set().union(*benchmark_graph.values())
+        return set(module for module
+                   in self._importers(benchmark_graph, changed)
+                   if module not in helpers)
+
+    def _importers(self, graph, modules):
+        """Modules in graph that import any of modules, transitively, plus
+           modules themselves"""
+        importers = {}
+        for module, imports in graph.items():
+            for imported in imports:
+                importers.setdefault(imported, set()).add(module)
+
+        affected = set(modules)
+        pending = list(modules)
+        while pending:
+            changed = pending.pop()
+            for module in importers.get(changed, ()):
+                if module not in affected:
+                    affected.add(module)
+                    pending.append(module)
+        return affected
+
+    def _import_graph(self, root, exclude=None):
+        graph = {}
+        for directory, dirs, files in os.walk(root):
+            dirs[:] = [d for d in dirs if not d.startswith('.')]
+            relative_dir = os.path.relpath(directory, root)
+            if relative_dir == '.':
+                relative_dir = ''
+            if exclude is not None and relative_dir == exclude:
+                dirs[:] = []
+                continue
+            for filename in files:
+                if not filename.endswith('.py'):
+                    continue
+                relative = os.path.join(relative_dir, filename)
+                imports = self._imports(os.path.join(directory, filename),
+                                        relative)
+                for module in self._module_names(relative):
+                    graph[module] = imports
+        return graph
+
+    def _imports(self, path, relative):
+        try:
+            with open(path, 'rb') as source_fp:
+                tree = ast.parse(source_fp.read(), path)
+        except (SyntaxError, ValueError):
+            return set()
+
+        package = self._module_name(relative).split('.')
+        if not relative.endswith('__init__.py'):
+            package = package[:-1]
+
+        imports = set()
+        for node in ast.walk(tree):
+            if isinstance(node, ast.Import):
+                for alias in node.names:
+                    imports.update(self._with_parents(alias.name))
+            elif isinstance(node, ast.ImportFrom):
+                if node.level:
+                    base = package[:len(package) - node.level + 1]
+                    if node.module:
+                        base = base + node.module.split('.')
+                    module = '.'.join(base)
+                else:
+                    module = node.module
+                if not module:
+                    continue
+                imports.update(self._with_parents(module))
+                # "from package import name" may import a submodule
+                for alias in node.names:
+                    imports.add(module + '.' + alias.name)
+        return imports
+
+    def _with_parents(self, module):
+        parts = module.split('.')
+        return set('.'.join(parts[:i]) for i in range(1, len(parts) + 1))
+
+    def _module_names(self, path):
+        name = self._module_name(path)
+        names = set([name])
+        first, _, rest = name.partition('.')
+        if first in SOURCE_PREFIXES and rest:
+            names.add(rest)
+        return names
+
+    def _module_name(self, path):
+        parts = path[:-len('.py')].split('/')
+        if parts[-1] == '__init__':
+            parts = parts[:-1]
+        return '.'.join(parts)
@@ -0,0 +1,223 @@
+import json
+import sqlite3
+import threading
+import time
+import uuid
+
+
+class Job(object):
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    SUCCEEDED = 'succeeded'
+    FAILED = 'failed'
+    SUPERSEDED = 'superseded'
+    ABORTED = 'aborted'
+
+    def __init__(self, event, job_id=None, state=QUEUED, enqueued=None,
+                 started=None, finished=None, error=None, key=None,
+                 head_sha=None, metadata=None, machine=None):
+        self._event = event
+        self._job_id = job_id if job_id is not None else uuid.uuid4().hex
+        self.state = state
+        self.enqueued = enqueued if enqueued is not None else time.time()
+        self.started = started
+        self.finished = finished
+        self.error = error
+        self.key = key
+        self.head_sha = head_sha
+        self.metadata = metadata if metadata is not None else {}
+        # the machine the job has to run on, None for any
+        self.machine = machine
+
+        self._cancel_lock = threading.Lock()
+        self._cancelled = False
+        self._cancel_callbacks = []
+
+    @property
+    def job_id(self):
+        return self._job_id
+
+    @property
+    def event(self):
+        return self._event
+
+    @property
+    def done(self):
+        return self.state in (Job.SUCCEEDED, Job.FAILED, Job.SUPERSEDED,
+                              Job.ABORTED)
+
+    @property
+    def cancelled(self):
+        return self._cancelled
+
+    def on_cancel(self, callback):
+        """Register a callback that stops the work done for this job. It is
+           called right away if the job was already cancelled."""
+        with self._cancel_lock:
+            if not self._cancelled:
+                self._cancel_callbacks.append(callback)
+                return
+        callback()
+
+    def cancel(self):
+        with self._cancel_lock:
+            self._cancelled = True
+            callbacks, self._cancel_callbacks = self._cancel_callbacks, []
+        for callback in callbacks:
+            callback()
+
+    @property
+    def wait_time(self):
+        started = self.started if self.started is not None else time.time()
+        return started - self.enqueued
+
+    def to_dict(self):
+        return {
+            'id': self._job_id,
+            'state': self.state,
+            'enqueued': self.enqueued,
+            'started': self.started,
+            'finished': self.finished,
+            'wait_time': self.wait_time,
+            'error': self.error,
+            'key': self.key,
+            'head_sha': self.head_sha,
+            'metadata': self.metadata,
+            'machine': self.machine,
+        }
+
+
+class JobStore(object):
+    """Durable job queue backed by SQLite so that queued jobs survive a
+       server restart."""
+
+    _COLUMNS = ('id', 'event', 'state', 'enqueued', 'started', 'finished',
+                'error', 'key', 'head_sha', 'metadata', 'machine')
+
+    def __init__(self, path):
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute(
+                'CREATE TABLE IF NOT EXISTS jobs ('
+                'id TEXT PRIMARY KEY, event TEXT NOT NULL, '
+                'state TEXT NOT NULL, enqueued REAL NOT NULL, '
+                'started REAL, finished REAL, error TEXT, key TEXT, '
+                'head_sha TEXT, metadata TEXT, machine TEXT)')
+            self._conn.execute(
+                'CREATE INDEX IF NOT EXISTS jobs_state '
+                'ON jobs (state, enqueued)')
+
+    def add(self, job):
+        with self._lock, self._conn:
+            self._conn.execute(
+                'INSERT INTO jobs (%s) VALUES (%s)' %
+                (', '.join(self._COLUMNS),
+                 ', '.join('?' * len(self._COLUMNS))),
+                self._to_row(job))
+
+    def update(self, job):
+        row = self._to_row(job)
+        with self._lock, self._conn:
+            self._conn.execute(
+                'UPDATE jobs SET %s WHERE id = ?' %
+                ', '.join('%s = ?' % column for column in self._COLUMNS[1:]),
+                row[1:] + row[:1])
+
+    def get(self, job_id):
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT %s FROM jobs WHERE id = ?' % ', '.join(self._COLUMNS),
+                (job_id,)).fetchone()
+        return self._from_row(row) if row is not None else None
+
+    def claim_next(self, machine=None):
+        """Mark the oldest queued job that can run on machine as running and
+           return it"""
+        query = 'SELECT %s FROM jobs WHERE state = ?' % \
+            ', '.join(self._COLUMNS)
+        args = (Job.QUEUED,)
+        if machine is not None:
+            query += ' AND (machine IS NULL OR machine = ?)'
+            args += (machine,)
+        with self._lock, self._conn:
+            row = self._conn.execute(
+                query + ' ORDER BY enqueued LIMIT 1', args).fetchone()
+            if row is None:
+                return None
+            job = self._from_row(row)
+            job.state = Job.RUNNING
+            job.started = time.time()
+            self._conn.execute(
+                'UPDATE jobs SET state = ?, started = ? WHERE id = ?',
+                (job.state, job.started, job.job_id))
+        return job
+
+    def requeue_running(self):
+        """Put jobs interrupted by a restart back on the queue"""
+        with self._lock, self._conn:
+            cursor = self._conn.execute(
+                'UPDATE jobs SET state = ?, started = NULL WHERE state = ?',
+                (Job.QUEUED, Job.RUNNING))
+        return cursor.rowcount
+
+    def requeue(self, job):
+        """Put a running job back on the queue"""
+        job.state = Job.QUEUED
+        job.started = None
+        self.update(job)
+
+    def supersede_queued(self, key, machine=None):
+        """Mark every queued job for key and machine as superseded"""
+        with self._lock, self._conn:
+            cursor = self._conn.execute(
+                'UPDATE jobs SET state = ?, finished = ? '
+                'WHERE state = ? AND key = ? AND machine IS ?',
+                (Job.SUPERSEDED, time.time(), Job.QUEUED, key, machine))
+        return cursor.rowcount
+
+    def expire_queued(self, machines, before, error):
+        """Fail the jobs queued before before that are pinned to a machine
+           other than machines"""
+        machines = sorted(machines)
+        with self._lock, self._conn:
+            cursor = self._conn.execute(
+                'UPDATE jobs SET state = ?, finished = ?, error = ? '
+                'WHERE state = ? AND enqueued < ? AND machine IS NOT NULL '
+                'AND machine NOT IN (%s)' % ', '.join('?' * len(machines)),
+                (Job.FAILED, time.time(), error, Job.QUEUED, before) +
+                tuple(machines))
+        return cursor.rowcount
+
+    def active_keys(self):
+        """Keys of the queued and running jobs"""
+        with self._lock:
+            rows = self._conn.execute(
+                'SELECT DISTINCT key FROM jobs '
+                'WHERE state IN (?, ?) AND key IS NOT NULL',
+                (Job.QUEUED, Job.RUNNING)).fetchall()
+        return set(row[0] for row in rows)
+
+    def count(self, state):
+        with self._lock:
+            return self._conn.execute(
+                'SELECT COUNT(*) FROM jobs WHERE state = ?',
+                (state,)).fetchone()[0]
+
+    def position(self, job):
+        with self._lock:
+            return self._conn.execute(
+                'SELECT COUNT(*) FROM jobs WHERE state = ? AND enqueued < ?',
+                (Job.QUEUED, job.enqueued)).fetchone()[0]
+
+    def _to_row(self, job):
+        return (job.job_id, json.dumps(job.event), job.state, job.enqueued,
+                job.started, job.finished, job.error, job.key, job.head_sha,
+                json.dumps(job.metadata), job.machine)
+
+    def _from_row(self, row):
+        (job_id, event, state, enqueued, started, finished, error, key,
+         head_sha, metadata, machine) = row
+        return Job(json.loads(event), job_id, state, enqueued, started,
+                   finished, error, key, head_sha,
+                   json.loads(metadata) if metadata else {}, machine)
@@ -0,0 +1,201 @@
+import asyncio
+import glob
+import os
+import threading
+
+
+DEFAULT_CAPACITY = 256 * 1024
+DEFAULT_MAX_FILE_BYTES = 8 * 1024 * 1024
+
+
+def decode_complete(data, final=False):
+    """Decode UTF-8 data, leaving out a character that is cut off at the
+       end unless final. Returns the text and the number of bytes used."""
+    if not final:
+        # a UTF-8 character is at most 4 bytes, so look at the last 3
+        for cut in range(1, min(len(data), 3) + 1):
+            byte = data[-cut]
+            if byte & 0xc0 == 0x80:
+                continue
+            if byte & 0x80 and cut < _sequence_length(byte):
+                data = data[:-cut]
+            break
+    return data.decode('utf-8', 'replace'), len(data)
+
+
+def _sequence_length(lead_byte):
+    if lead_byte >= 0xf0:
+        return 4
+    if lead_byte >= 0xe0:
+        return 3
+    return 2
+
+
+class JobLog(object):
+    """Output of one job, addressed by byte offset from its start.
+
+       The most recent capacity bytes are kept in memory for live readers,
+       and everything is appended to log files on disk that are rotated
+       every max_file_bytes, keeping the last backups of them. Readers
+       asking for output that is gone from both are moved on to the oldest
+       output that is left."""
+
+    def __init__(self, log_dir, job_id, capacity=DEFAULT_CAPACITY,
+                 max_file_bytes=DEFAULT_MAX_FILE_BYTES, backups=2,
+                 closed=False):
+        self._prefix = os.path.join(log_dir, job_id)
+        self._capacity = capacity
+        self._max_file_bytes = max_file_bytes
+        self._backups = backups
+        self._lock = threading.Lock()
+        self._file = None
+        self._file_bytes = 0
+        self._waiters = []
+        self._closed = closed
+
+        if not os.path.exists(log_dir):
+            os.makedirs(log_dir)
+        # a requeued job carries on after the output of its earlier attempt
+        self._end = 0
+        files = self._files()
+        if files:
+            start, path = files[-1]
+            self._end = start + os.path.getsize(path)
+        self._ring = bytearray()
+        self._ring_start = self._end
+
+    @property
+    def end(self):
+        return self._end
+
+    @property
+    def closed(self):
+        return self._closed
+
+    def write(self, text):
+        data = text.encode('utf-8')
+        with self._lock:
+            if self._closed:
+                return
+            self._append_file(data)
+            self._ring += data
+            self._end += len(data)
+            excess = len(self._ring) - self._capacity
+            if excess > 0:
+                del self._ring[:excess]
+                self._ring_start += excess
+            waiters, self._waiters = self._waiters, []
+        self._wake(waiters)
+
+    def close(self):
+        with self._lock:
+            self._closed = True
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+            waiters, self._waiters = self._waiters, []
+        self._wake(waiters)
+
+    def read(self, offset, limit=65536):
+        """Return up to limit bytes from offset, and the offset they
+           actually start at"""
+        with self._lock:
+            offset = max(0, min(offset, self._end))
+            if offset >= self._ring_start:
+                start = offset - self._ring_start
+                return offset, bytes(self._ring[start:start + limit])
+            ring_start = self._ring_start
+
+        for start, path in self._files():
+            try:
+                with open(path, 'rb') as log_fp:
+                    size = os.fstat(log_fp.fileno()).st_size
+                    if offset >= start + size:
+                        continue
+                    offset = max(offset, start)
+                    log_fp.seek(offset - start)
+                    return offset, log_fp.read(min(limit, ring_start - offset))
+            except FileNotFoundError:
+                # rotated away while reading
+                continue
+        return self.read(ring_start, limit)
+
+    def wait(self, offset):
+        """Future that is done once there is output past offset or the log
+           is closed"""
+        loop = asyncio.get_event_loop()
+        future = loop.create_future()
+        with self._lock:
+            if self._end > offset or self._closed:
+                future.set_result(None)
+            else:
+                self._waiters.append((loop, future))
+        return future
+
+    def _append_file(self, data):
+        if self._file is None or \
+                self._file_bytes + len(data) > self._max_file_bytes:
+            self._rotate()
+        self._file.write(data)
+        self._file.flush()
+        self._file_bytes += len(data)
+
+    def _rotate(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        self._file = open('%s.%d.log' % (self._prefix, self._end), 'ab')
+        self._file_bytes = 0
+        for start, path in self._files()[:-(self._backups + 1)]:
+            os.remove(path)
+
+    def _files(self):
+        files = []
+        for path in glob.glob(glob.escape(self._prefix) + '.*.log'):
+            start = path[len(self._prefix) + 1:-len('.log')]
+            if start.isdigit():
+                files.append((int(start), path))
+        return sorted(files)
+
+    def _wake(self, waiters):
+        for loop, future in waiters:
+            loop.call_soon_threadsafe(_resolve, future)
+
+
+def _resolve(future):
+    if not future.done():
+        future.set_result(None)
+
+
+class JobLogs(object):
+    """The logs of every job, open ones in memory and finished ones read
+       back from log_dir"""
+
+    def __init__(self, log_dir, **log_options):
+        self._log_dir = log_dir
+        self._log_options = log_options
+        self._lock = threading.Lock()
+        self._open = {}
+
+    def open(self, job_id):
+        log = JobLog(self._log_dir, job_id, **self._log_options)
+        with self._lock:
+            self._open[job_id] = log
+        return log
+
+    def close(self, job_id):
+        with self._lock:
+            log = self._open.pop(job_id, None)
+        if log is not None:
+            log.close()
+
+    def get(self, job_id):
+        with self._lock:
+            log = self._open.get(job_id)
+        if log is not None:
+            return log
+        if not glob.glob(os.path.join(glob.escape(self._log_dir),
+                                      job_id + '.*.log')):
+            return None
+        return JobLog(self._log_dir, job_id, closed=True,
+                      **self._log_options)
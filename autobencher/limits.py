@@ -0,0 +1,268 @@
+import json
+import logging
+import os
+import signal
+import sys
+import threading
+import time
+import uuid
+
+from .util import directory_size
+
+
+logger = logging.getLogger(__name__)
+
+LIMITS_FILE = 'limits.json'
+
+# applies rlimits, joins a cgroup and then replaces itself with the command
+_EXEC_LIMITED = (
+    'import json, os, resource, sys; '
+    'spec = json.loads(sys.argv[1]); '
+    'cgroup = spec.get("cgroup"); '
+    'cgroup and open(os.path.join(cgroup, "cgroup.procs"), "w")'
+    '.write(str(os.getpid())); '
+    '[resource.setrlimit(getattr(resource, name), (value, value)) '
+    'for name, value in spec["rlimits"].items()]; '
+    'os.execvp(sys.argv[2], sys.argv[2:])')
+
+
+class RunAborted(Exception):
+    """Raised when a run is stopped for going over one of its limits"""
+
+
+class RunLimits(object):
+    """Wall time, CPU time, memory and disk limits for one run. They are
+       read from limits.json in the server's directory, where "default"
+       applies to every repository and entries keyed by repository URL
+       override it, so a pull request can't change its own limits."""
+
+    KEYS = ('wall_seconds', 'cpu_seconds', 'rss_bytes', 'disk_bytes')
+
+    def __init__(self, wall_seconds=None, cpu_seconds=None, rss_bytes=None,
+                 disk_bytes=None):
+        self.wall_seconds = wall_seconds
+        self.cpu_seconds = cpu_seconds
+        self.rss_bytes = rss_bytes
+        self.disk_bytes = disk_bytes
+
+    @classmethod
+    def load(cls, directory, repository_url):
+        path = os.path.join(directory, LIMITS_FILE)
+        if not os.path.exists(path):
+            return cls()
+        with open(path) as limits_fp:
+            config = json.load(limits_fp)
+        settings = dict(config.get('default', {}))
+        settings.update(config.get(repository_url, {}))
+        unknown = set(settings) - set(cls.KEYS)
+        if unknown:
+            raise ValueError('Unknown limits in %s: %s' %
+                             (path, ', '.join(sorted(unknown))))
+        return cls(**settings)
+
+    def to_dict(self):
+        return dict((key, getattr(self, key)) for key in self.KEYS)
+
+    def command(self, args, cgroup=None):
+        """args wrapped so that each process of the command is held to the
+           per-process rlimits matching these limits, and is started in
+           cgroup if there is one. The limits on the whole process tree are
+           enforced by LimitMonitor."""
+        rlimits = {}
+        if self.cpu_seconds is not None:
+            rlimits['RLIMIT_CPU'] = int(self.cpu_seconds)
+        if self.disk_bytes is not None:
+            rlimits['RLIMIT_FSIZE'] = int(self.disk_bytes)
+        if not rlimits and cgroup is None:
+            return list(args)
+        spec = json.dumps({'rlimits': rlimits, 'cgroup': cgroup})
+        return [sys.executable, '-c', _EXEC_LIMITED, spec] + list(args)
+
+
+class RunCgroup(object):
+    """cgroup v2 group that holds one run's commands, so that the kernel
+       enforces the memory limit on all of them together. It is created
+       under the delegated cgroup CGROUP_ROOT names, if that is set."""
+
+    def __init__(self, path):
+        self._path = path
+
+    @classmethod
+    def create(cls, rss_bytes):
+        root = os.environ.get('CGROUP_ROOT')
+        if root is None or rss_bytes is None:
+            return None
+        path = os.path.join(root, 'autobencher-%s' % uuid.uuid4().hex)
+        try:
+            os.mkdir(path)
+            with open(os.path.join(path, 'memory.max'), 'w') as max_fp:
+                max_fp.write(str(int(rss_bytes)))
+        except OSError:
+            logger.exception('Could not create a cgroup under %s', root)
+            return None
+        return cls(path)
+
+    @property
+    def path(self):
+        return self._path
+
+    def oom_killed(self):
+        try:
+            with open(os.path.join(self._path, 'memory.events')) as events_fp:
+                events = dict(line.split() for line in events_fp)
+        except OSError:
+            return False
+        return int(events.get('oom_kill', 0)) > 0
+
+    def remove(self):
+        try:
+            os.rmdir(self._path)
+        except OSError:
+            logger.warning('Could not remove cgroup %s', self._path)
+
+
+def session_usage(session_ids):
+    """Resident memory in bytes and CPU seconds, including reaped children,
+       of the processes in each of session_ids. Nothing is found where
+       /proc isn't available."""
+    page_size = os.sysconf('SC_PAGE_SIZE')
+    ticks = float(os.sysconf('SC_CLK_TCK'))
+    usage = dict((session_id, (0, 0.0)) for session_id in session_ids)
+    try:
+        pids = [name for name in os.listdir('/proc') if name.isdigit()]
+    except FileNotFoundError:
+        return usage
+    for pid in pids:
+        try:
+            with open('/proc/%s/stat' % pid) as stat_fp:
+                stat = stat_fp.read()
+        except OSError:
+            continue
+        # the command name may contain spaces, so split after it
+        fields = stat[stat.rindex(')') + 2:].split()
+        session_id = int(fields[3])
+        if session_id not in usage:
+            continue
+        rss, cpu = usage[session_id]
+        usage[session_id] = (
+            rss + int(fields[21]) * page_size,
+            cpu + sum(int(value) for value in fields[11:15]) / ticks)
+    return usage
+
+
+class LimitMonitor(object):
+    """Watches a run and cancels its CommandGroup as soon as it goes over
+       one of its limits. breach says which one it was."""
+
+    def __init__(self, limits, group, directory, cgroup=None, interval=1,
+                 disk_interval=10):
+        self._limits = limits
+        self._group = group
+        self._directory = directory
+        self._cgroup = cgroup
+        self._interval = interval
+        self._disk_interval = disk_interval
+        self._stopped = threading.Event()
+        self._thread = None
+        self._breach = None
+        self._started = time.time()
+        self._disk_checked = 0
+        # CPU seconds by session, so commands that have finished still count
+        self._cpu = {}
+
+    @property
+    def breach(self):
+        return self._breach
+
+    def start(self):
+        self._started = time.time()
+        if not any(self._limits.to_dict().values()):
+            return
+        self._thread = threading.Thread(target=self._watch,
+                                        name='autobencher-limits')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def finish(self):
+        """Stop watching and return the breach, looking once more for one
+           since the last check, such as a cgroup OOM kill"""
+        self.stop()
+        if self._breach is None and any(self._limits.to_dict().values()):
+            # the disk is checked less often, so always check it here
+            self._disk_checked = 0
+            self._breach = self.check()
+        return self._breach
+
+    def command_exited(self, returncode):
+        """Record the breach, if any, for a command that the kernel killed
+           for one of the limits RunLimits.command and RunCgroup set, and
+           cancel the rest of the run"""
+        if self._breach is None:
+            self._breach = self._exit_breach(returncode)
+            if self._breach is not None:
+                self._abort()
+        return self._breach
+
+    def _exit_breach(self, returncode):
+        limits = self._limits
+        memory = ('memory limit of %.15g bytes exceeded' % limits.rss_bytes
+                  if limits.rss_bytes is not None else None)
+        if returncode == -signal.SIGXCPU and limits.cpu_seconds is not None:
+            return 'CPU time limit of %gs exceeded' % limits.cpu_seconds
+        if returncode == -signal.SIGXFSZ and limits.disk_bytes is not None:
+            return 'disk limit of %.15g bytes exceeded' % limits.disk_bytes
+        if returncode != -signal.SIGKILL:
+            return None
+        if memory is not None and self._cgroup is not None and \
+                self._cgroup.oom_killed():
+            return memory
+        # the soft and hard RLIMIT_CPU are equal, so the kernel uses SIGKILL
+        if limits.cpu_seconds is not None:
+            return 'CPU time limit of %gs exceeded' % limits.cpu_seconds
+        return memory
+
+    def _abort(self):
+        logger.warning('Aborting run in %s: %s', self._directory,
+                       self._breach)
+        self._group.cancel()
+
+    def _watch(self):
+        while not self._stopped.wait(self._interval):
+            breach = self.check()
+            if breach is not None:
+                self._breach = breach
+                self._abort()
+                return
+
+    def check(self):
+        limits = self._limits
+        now = time.time()
+        if limits.wall_seconds is not None and \
+                now - self._started > limits.wall_seconds:
+            return 'wall time limit of %gs exceeded' % limits.wall_seconds
+
+        rss = 0
+        for session_id, (session_rss, session_cpu) in \
+                session_usage(self._group.pids).items():
+            rss += session_rss
+            self._cpu[session_id] = max(self._cpu.get(session_id, 0),
+                                        session_cpu)
+        if limits.cpu_seconds is not None and \
+                sum(self._cpu.values()) > limits.cpu_seconds:
+            return 'CPU time limit of %gs exceeded' % limits.cpu_seconds
+        if limits.rss_bytes is not None and (
+                rss > limits.rss_bytes or
+                (self._cgroup is not None and self._cgroup.oom_killed())):
+            return 'memory limit of %.15g bytes exceeded' % limits.rss_bytes
+
+        if limits.disk_bytes is not None and \
+                now - self._disk_checked >= self._disk_interval:
+            self._disk_checked = now
+            if directory_size(self._directory) > limits.disk_bytes:
+                return 'disk limit of %.15g bytes exceeded' % limits.disk_bytes
+        return None
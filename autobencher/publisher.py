@@ -1,22 +1,241 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+
 from abc import ABCMeta, abstractmethod
-from subprocess import check_call
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+from .compression import artifact_headers, precompress
+from .execution import get_engine
+from .storage import storage_for
+from .util import FileLock, atomic_write
+
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_FILE = 'publish_manifest.json'
+
+
+def file_digest(path):
+    digest = hashlib.sha1()
+    with open(path, 'rb') as file_fp:
+        for block in iter(lambda: file_fp.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def tree_digests(directory):
+    """Content hash of every file under directory by '/' separated path"""
+    digests = {}
+    for root, dirs, files in os.walk(directory):
+        for filename in files:
+            path = os.path.join(root, filename)
+            key = os.path.relpath(path, directory).replace(os.sep, '/')
+            digests[key] = file_digest(path)
+    return digests
+
+
+class PublishQueue(object):
+    """Runs publishes on threads of its own, off the benchmark slots.
+
+       A publish for a target waits delay seconds, and is merged with any
+       further ones for the target that arrive meanwhile, up to max_delay
+       after the first. Publishes to the same target never run at the same
+       time, and each holds the lock jobs hold on the run directory it
+       publishes, so it never reads one that a job is writing to."""
+
+    def __init__(self, delay=30, max_delay=300, workers=2):
+        self._delay = delay
+        self._max_delay = max_delay
+        self._condition = threading.Condition()
+        # target -> [directory, publish, due time, latest due time]
+        self._pending = {}
+        self._active = set()
+        self._workers = []
+        for i in range(workers):
+            worker = threading.Thread(target=self._work,
+                                      name='autobencher-publish-%d' % i)
+            worker.daemon = True
+            worker.start()
+            self._workers.append(worker)
+
+    @classmethod
+    def from_environ(cls):
+        return cls(float(os.environ.get('PUBLISH_DELAY', 30)),
+                   float(os.environ.get('PUBLISH_MAX_DELAY', 300)))
+
+    def submit(self, target, directory, publish):
+        """Call publish(directory) for target once things settle down"""
+        now = time.time()
+        with self._condition:
+            pending = self._pending.get(target)
+            if pending is None:
+                self._pending[target] = [directory, publish, now + self._delay,
+                                         now + self._max_delay]
+            else:
+                logger.info('Merging publishes for %s', target)
+                pending[:3] = [directory, publish,
+                               min(now + self._delay, pending[3])]
+            self._condition.notify_all()
+
+    def join(self, timeout=None):
+        """Wait until nothing is pending or publishing"""
+        deadline = None if timeout is None else time.time() + timeout
+        with self._condition:
+            while self._pending or self._active:
+                remaining = None if deadline is None else \
+                    deadline - time.time()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._condition.wait(remaining)
+        return True
+
+    def _work(self):
+        while True:
+            target, directory, publish = self._next()
+            try:
+                with FileLock(directory + '.lock'):
+                    publish(directory)
+            except Exception:
+                logger.exception('Publishing %s failed', target)
+            finally:
+                with self._condition:
+                    self._active.discard(target)
+                    self._condition.notify_all()
+
+    def _next(self):
+        with self._condition:
+            while True:
+                ready = [(pending[2], target) for target, pending
+                         in self._pending.items()
+                         if target not in self._active]
+                now = time.time()
+                if ready:
+                    due, target = min(ready)
+                    if due <= now:
+                        directory, publish = self._pending.pop(target)[:2]
+                        self._active.add(target)
+                        return target, directory, publish
+                    self._condition.wait(due - now)
+                else:
+                    self._condition.wait()
+
+
+_queue = None
+_queue_lock = threading.Lock()
+
+
+def get_publish_queue():
+    """The queue shared by everything in this process"""
+    global _queue
+    with _queue_lock:
+        if _queue is None:
+            _queue = PublishQueue.from_environ()
+        return _queue
 
 
 class Publisher(metaclass=ABCMeta):
 
     @abstractmethod
-    def publish(self, dest):
-        """Abstract method"""
+    def publish(self, dest, directory):
+        """Abstract method for publishing the asv project in directory"""
 
 
 class ASVPublisher(Publisher):
-    def __init__(self, publish_uri):
+    """Builds the asv html for a directory and uploads it under dest.
+
+       A manifest of the content hashes that were uploaded is kept next to
+       the html, so each publish only uploads the files that changed since
+       the last one and deletes the ones that are gone, without listing the
+       remote. Uploads run in parallel on workers threads. Text artifacts
+       get gzip and brotli variants, and every file is stored with its
+       content type, encoding and cache headers.
+
+       With a PublishQueue, publish returns right away and the queue does
+       the publishing."""
+
+    def __init__(self, publish_uri, storage=None, workers=8, queue=None):
         self._publish_uri = publish_uri
+        self._storage = storage
+        self._workers = workers
+        self._queue = queue
+
+    def publish(self, dest, directory):
+        if self._queue is None:
+            self.publish_now(dest, directory)
+            return
+        self._queue.submit('/'.join([self._publish_uri, dest]), directory,
+                           partial(self.publish_now, dest))
 
-    def publish(self, dest):
+    def publish_now(self, dest, directory):
+        engine = get_engine()
         asv_publish_command = ['asv', 'publish']
-        check_call(asv_publish_command)
+        engine.check_call(asv_publish_command, directory)
+        precompress(os.path.join(directory, 'html'))
+        self.upload(dest, directory)
+
+    def upload(self, dest, directory):
+        """Bring dest up to date with directory's html. Returns the number
+           of files uploaded and deleted."""
+        if self._storage is None:
+            self._storage = storage_for(self._publish_uri, self._workers)
+
+        manifest_path = os.path.join(directory, MANIFEST_FILE)
+        published = self._load_manifest(manifest_path, dest)
+        current = tree_digests(os.path.join(directory, 'html'))
+        changed = sorted(name for name, digest in current.items()
+                         if published.get(name) != digest)
+        stale = sorted(name for name in published if name not in current)
+
+        with ThreadPoolExecutor(self._workers) as executor:
+            uploads = dict((name, executor.submit(
+                self._storage.put, '/'.join([dest, name]),
+                os.path.join(directory, 'html', *name.split('/')),
+                artifact_headers(name)))
+                for name in changed)
+            deletes = dict((name, executor.submit(
+                self._storage.delete, '/'.join([dest, name])))
+                for name in stale)
+
+        # only what made it is recorded, so a failed publish is retried
+        error = None
+        for name, future in uploads.items():
+            if future.exception() is None:
+                published[name] = current[name]
+            else:
+                error = error or future.exception()
+        for name, future in deletes.items():
+            if future.exception() is None:
+                del published[name]
+            else:
+                error = error or future.exception()
+        self._save_manifest(manifest_path, dest, published)
+        if error is not None:
+            raise error
+
+        logger.info('Published %s: %d uploaded, %d deleted, %d unchanged',
+                    dest, len(changed), len(stale),
+                    len(current) - len(changed))
+        return len(changed), len(stale)
+
+    def _load_manifest(self, path, dest):
+        try:
+            with open(path) as manifest_fp:
+                manifest = json.load(manifest_fp)
+        except FileNotFoundError:
+            return {}
+        # the directory may have been published somewhere else before
+        if manifest.get('uri') != self._publish_uri or \
+                manifest.get('dest') != dest:
+            return {}
+        return manifest['files']
 
-        uri = '/'.join([self._publish_uri, dest])
-        upload_to_s3_command = ['aws', 's3', 'sync', 'html', uri, '--delete']
-        check_call(upload_to_s3_command)
+    def _save_manifest(self, path, dest, files):
+        with atomic_write(path) as manifest_fp:
+            json.dump({'uri': self._publish_uri, 'dest': dest,
+                       'files': files}, manifest_fp, indent=4,
+                      sort_keys=True)
@@ -1,9 +1,10 @@
 import json
-import requests
 
 from subprocess import check_call
 from abc import ABCMeta, abstractmethod
 
+from .github import get_github_client
+
 
 class BenchmarkReporter(metaclass=ABCMeta):
     @abstractmethod
@@ -50,6 +51,11 @@ class GitHubReporter(BenchmarkReporter):
     def report_started(self):
         """Abstract method for reporting benchmarking started"""
 
+    def _post(self, params):
+        get_github_client().post(
+            self._report_uri, data=json.dumps(params),
+            auth=(self._report_username, self._report_password))
+
 
 class GitHubStatusReporter(GitHubReporter):
     def __init__(self, result_uri, report_uri, branch, branch_owner,
@@ -61,8 +67,7 @@ class GitHubStatusReporter(GitHubReporter):
     def report(self):
         params = self._build_params('success')
 
-        requests.post(self._report_uri, data=json.dumps(params),
-                      auth=(self._report_username, self._report_password))
+        self._post(params)
 
     def report_started(self):
         """Abstract method for reporting benchmarking started"""
@@ -72,8 +77,7 @@ class GitHubStatusReporter(GitHubReporter):
             'context': "ASV Benchmarks"
         }
 
-        requests.post(self._report_uri, data=json.dumps(params),
-                      auth=(self._report_username, self._report_password))
+        self._post(params)
 
     def _build_params(self, success_string):
         return {
@@ -99,16 +103,14 @@ class GitHubCommentReporter(GitHubReporter):
                         "completed successfully. Results available [here]"
                         "(%s)") % (self._result_link)
         params = {'body': comment_body}
-        requests.post(self._report_uri, data=json.dumps(params),
-                      auth=(self._report_username, self._report_password))
+        self._post(params)
 
     def report_started(self):
         self._delete_old_report_comments()
 
         comment_body = "## Automated report\nBenchmark run started"
         params = {'body': comment_body}
-        requests.post(self._report_uri, data=json.dumps(params),
-                      auth=(self._report_username, self._report_password))
+        self._post(params)
 
     def _delete_old_report_comments(self):
         comments = self._get_comments()
@@ -118,27 +120,56 @@ class GitHubCommentReporter(GitHubReporter):
                 self._delete_comment(comment['url'])
 
     def _get_comments(self):
-        response = requests.get(self._report_uri)
+        response = get_github_client().get(
+            self._report_uri,
+            auth=(self._report_username, self._report_password))
         return response.json()
 
     def _delete_comment(self, comment_url):
-        requests.delete(comment_url,
-                        auth=(self._report_username, self._report_password))
+        get_github_client().delete(
+            comment_url, auth=(self._report_username, self._report_password))
 
 
 class ASVBenchmarkReporter(GitHubStatusReporter):
-    def report_success(self):
-        super(ASVBenchmarkReporter, self).report()
+    def report_success(self, reused=False):
+        params = self._build_params('success')
+        if reused:
+            params['description'] = ("ASV benchmark run completed "
+                                     "successfully (results reused)")
+        self._post(params)
+
+    def report_skipped(self):
+        # the status API has no neutral state, so a skipped run succeeds
+        params = {
+            'state': 'success',
+            'description': ("No benchmark-relevant changes, "
+                            "ASV benchmarks skipped"),
+            'context': "ASV Benchmarks"
+        }
+        self._post(params)
+
+    def report_aborted(self, reason):
+        params = {
+            'state': 'error',
+            'target_url': self._result_link,
+            'description': "ASV benchmark run aborted: %s" % reason,
+            'context': "ASV Benchmarks"
+        }
+        self._post(params)
 
-    def report_failure(self):
+    def report_failure(self, reused=False, first_bad_commit=None):
         params = {
             'state': 'failure',
             'target_url': self._result_link,
             'description': "ASV benchmark run detected a regression",
             'context': "ASV Benchmarks"
         }
-        requests.post(self._report_uri, data=json.dumps(params),
-                      auth=(self._report_username, self._report_password))
+        if first_bad_commit is not None:
+            params['description'] += " first seen in %s" % \
+                first_bad_commit[:7]
+        if reused:
+            params['description'] += " (results reused)"
+        self._post(params)
 
     def report(self):
         self._publish()
@@ -1,27 +1,180 @@
+import hashlib
 import os
+import shutil
+import time
 
-from subprocess import check_call
+from subprocess import call, check_call, check_output, DEVNULL
 from abc import ABCMeta, abstractmethod
 
+from .util import FileLock
+
 
 class SourceRepository(metaclass=ABCMeta):
     @classmethod
-    def makeRepository(cls, url, branch, directory):
-        return GitRepository(url, branch, directory)
+    def makeRepository(cls, url, branch, directory, mirrors_dir,
+                       upstream_url=None, sha=None):
+        mirror = GitMirror(upstream_url or url, mirrors_dir)
+        return GitRepository(url, branch, directory, mirror, sha)
 
     @abstractmethod
     def __init__(self):
         """Abstract constructor"""
 
+    @property
+    @abstractmethod
+    def asv_repo(self):
+        """Abstract property for the repository asv should benchmark"""
+
+    @property
+    @abstractmethod
+    def asv_branch(self):
+        """Abstract property for the branch asv should benchmark"""
+
+    @property
+    @abstractmethod
+    def fetch_stats(self):
+        """Abstract property for how long fetching took and how much it
+           downloaded"""
+
+
+class GitMirror(object):
+    """Bare repository holding the objects of an upstream project and the
+       fork branches fetched into it, shared by every run of the project.
+       Fetches are serialized with a lock file since several jobs may
+       prepare runs of the same project at once.
+
+       The mirror is a full clone of upstream. It can't be a blobless
+       partial clone, since asv builds commits from a clone --shared of it,
+       which has no promisor remote to fetch missing blobs from. Fork
+       fetches negotiate against the upstream history already in the
+       mirror, so they only transfer the commits after the merge-base."""
+
+    def __init__(self, url, mirrors_dir):
+        self._url = url
+        url_hash = hashlib.sha1(url.encode('utf-8')).hexdigest()[:12]
+        name = os.path.basename(url.rstrip('/'))
+        if name.endswith('.git'):
+            name = name[:-len('.git')]
+        self._path = os.path.join(mirrors_dir,
+                                  '%s-%s.git' % (name, url_hash))
+        self._lock_path = self._path + '.lock'
+        self._fetch_seconds = 0.0
+        self._fetch_bytes = 0
+
+        if not os.path.exists(mirrors_dir):
+            os.makedirs(mirrors_dir)
+
+    @property
+    def path(self):
+        return self._path
+
+    @property
+    def url(self):
+        return self._url
+
+    @property
+    def fetch_stats(self):
+        """Time spent fetching and bytes added to the mirror by this
+           object"""
+        return {'fetch_seconds': self._fetch_seconds,
+                'fetch_bytes': self._fetch_bytes}
+
+    def update(self):
+        with FileLock(self._lock_path):
+            if not os.path.exists(self._path):
+                self._timed(check_call, ['git', 'clone', '--bare',
+                                         self._url, self._path])
+            elif self._is_partial():
+                # blobless mirror from before, fetch everything it lacks
+                self._git('config', '--unset', 'remote.origin.promisor')
+                self._git('config', '--unset',
+                          'remote.origin.partialclonefilter')
+                self._timed(self._git, 'fetch', '--refetch', 'origin',
+                            '+refs/heads/*:refs/heads/*')
+            else:
+                self._timed(self._git, 'fetch', 'origin',
+                            '+refs/heads/*:refs/heads/*')
+
+    def fetch_branch(self, url, branch, sha=None):
+        """Fetch branch from url into the mirror and return the name of the
+           mirror branch that holds it. If sha is given the mirror branch is
+           pinned to that commit, even if the branch has moved on since."""
+        if url == self._url and sha is None:
+            return branch
+
+        url_hash = hashlib.sha1(url.encode('utf-8')).hexdigest()[:8]
+        local_branch = '/'.join(['forks', url_hash, branch])
+        local_ref = 'refs/heads/' + local_branch
+        with FileLock(self._lock_path):
+            self._timed(self._git, 'fetch', url,
+                        '+refs/heads/%s:%s' % (branch, local_ref))
+            if sha is not None:
+                if not self._has_commit(sha):
+                    # the branch was force-pushed past the webhook's commit
+                    self._timed(self._git, 'fetch', url, sha)
+                self._git('update-ref', local_ref, sha)
+        return local_branch
+
+    def checkout(self, directory, branch):
+        """Check out branch into a worktree at directory, reusing it if it
+           exists"""
+        git_path = os.path.join(directory, '.git')
+        if os.path.isdir(git_path):
+            # full clone from before runs shared a mirror
+            shutil.rmtree(directory)
+
+        with FileLock(self._lock_path):
+            if os.path.exists(git_path):
+                check_call(['git', '-C', directory, 'checkout', '--force',
+                            '--detach', 'refs/heads/' + branch])
+            else:
+                self._git('worktree', 'prune')
+                self._git('worktree', 'add', '--force', '--detach',
+                          directory, 'refs/heads/' + branch)
+
+    def _is_partial(self):
+        return call(['git', '--git-dir', self._path, 'config', '--get',
+                     'remote.origin.promisor'], stdout=DEVNULL) == 0
+
+    def _has_commit(self, sha):
+        return call(['git', '--git-dir', self._path, 'cat-file', '-e',
+                     sha + '^{commit}'], stderr=DEVNULL) == 0
+
+    def _timed(self, function, *args):
+        size_before = self._size()
+        start = time.time()
+        function(*args)
+        self._fetch_seconds += time.time() - start
+        self._fetch_bytes += max(self._size() - size_before, 0)
+
+    def _size(self):
+        if not os.path.exists(self._path):
+            return 0
+        output = check_output(['git', '--git-dir', self._path,
+                               'count-objects', '-v'])
+        sizes = dict(line.split(': ') for line in
+                     output.decode('utf-8').splitlines())
+        return (int(sizes['size']) + int(sizes['size-pack'])) * 1024
+
+    def _git(self, *args):
+        check_call(['git', '--git-dir', self._path] + list(args))
+
 
 class GitRepository(SourceRepository):
-    def __init__(self, url, branch, directory):
-        if os.path.exists(directory):
-            cur_dir = os.getcwd()
-            os.chdir(directory)
-            pull_command = ['git', 'pull']
-            check_call(pull_command)
-            os.chdir(cur_dir)
-        else:
-            clone_command = ['git', 'clone', '-b', branch, url, directory]
-            check_call(clone_command)
+    def __init__(self, url, branch, directory, mirror, sha=None):
+        self._mirror = mirror
+        self._mirror.update()
+        self._branch = self._mirror.fetch_branch(url, branch, sha)
+        self._mirror.checkout(directory, self._branch)
+
+    @property
+    def asv_repo(self):
+        return self._mirror.path
+
+    @property
+    def asv_branch(self):
+        return self._branch
+
+    @property
+    def fetch_stats(self):
+        return self._mirror.fetch_stats
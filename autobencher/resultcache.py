@@ -0,0 +1,77 @@
+import hashlib
+import json
+import os
+
+from fnmatch import fnmatchcase
+from subprocess import check_output
+
+from .util import atomic_copy
+
+
+def tree_key(source_repo, commit, ignore_paths=()):
+    """Hash of the files in commit that can affect benchmark results.
+       Commits with identical code, e.g. a rebase or a change that only
+       touches CI files, get the same key."""
+    output = check_output(['git', '-C', source_repo, 'ls-tree', '-r',
+                           '--full-tree', commit])
+    entries = []
+    for line in output.decode('utf-8').splitlines():
+        path = line.split('\t', 1)[1]
+        if not any(fnmatchcase(path, pattern) for pattern in ignore_paths):
+            entries.append(line)
+    return hashlib.sha1('\n'.join(entries).encode('utf-8')).hexdigest()
+
+
+def commit_date(source_repo, commit):
+    """Commit date in milliseconds, as asv records it"""
+    output = check_output(['git', '-C', source_repo, 'log', '-1',
+                           '--format=%ct', commit])
+    return int(output.decode('utf-8').strip()) * 1000
+
+
+class ResultCache(object):
+    """Content-addressed store of asv result files, keyed by tree_key,
+       machine and environment"""
+
+    def __init__(self, cache_dir):
+        self._cache_dir = cache_dir
+
+    def has(self, key, machine):
+        return len(self._cached_files(key, machine)) > 0
+
+    def store(self, key, machine, result_paths):
+        machine_dir = os.path.join(self._cache_dir, key, machine)
+        if not os.path.exists(machine_dir):
+            os.makedirs(machine_dir)
+        for path in result_paths:
+            with open(path) as result_fp:
+                env_name = json.load(result_fp)['env_name']
+            cached_path = os.path.join(machine_dir, env_name + '.json')
+            atomic_copy(path, cached_path)
+
+    def restore(self, key, machine, commit_hash, date, results_dir):
+        """Write the cached results for key into results_dir as results for
+           commit_hash and return how many files were restored"""
+        restored = 0
+        if not os.path.exists(results_dir):
+            os.makedirs(results_dir)
+        for cached_path in self._cached_files(key, machine):
+            with open(cached_path) as cached_fp:
+                results = json.load(cached_fp)
+            results['commit_hash'] = commit_hash
+            results['date'] = date
+            filename = '%s-%s.json' % (commit_hash[:8], results['env_name'])
+            with open(os.path.join(results_dir, filename), 'w') as result_fp:
+                json.dump(results, result_fp, indent=4, sort_keys=True)
+            restored += 1
+        return restored
+
+    def _cached_files(self, key, machine):
+        machine_dir = os.path.join(self._cache_dir, key, machine)
+        try:
+            filenames = os.listdir(machine_dir)
+        except FileNotFoundError:
+            return []
+        return [os.path.join(machine_dir, filename)
+                for filename in sorted(filenames)
+                if filename.endswith('.json')]
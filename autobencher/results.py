@@ -0,0 +1,134 @@
+import json
+import os
+import sqlite3
+
+
+class ResultsIndex(object):
+    """SQLite index over an asv results directory, keyed by (machine, env,
+       commit). refresh() only re-parses result files whose mtime or size
+       changed since the last refresh.
+
+       With a base index, such as master's, files that are hard links to
+       the file at the same path in the base's directory are looked up in
+       the base index, so only the directory's own files are parsed."""
+
+    _SKIP_FILES = set(['machine.json', 'benchmarks.json'])
+
+    def __init__(self, results_dir, index_path, base=None):
+        self._results_dir = results_dir
+        self._base = base
+        # the base index may be refreshed by several runs at once
+        self._conn = sqlite3.connect(index_path, timeout=60)
+        with self._conn:
+            self._conn.execute(
+                'CREATE TABLE IF NOT EXISTS results ('
+                'path TEXT PRIMARY KEY, mtime REAL NOT NULL, '
+                'size INTEGER NOT NULL, machine TEXT, env_name TEXT, '
+                'commit_hash TEXT, date INTEGER, results TEXT)')
+            self._conn.execute(
+                'CREATE INDEX IF NOT EXISTS results_key '
+                'ON results (commit_hash, machine, env_name)')
+            self._conn.execute(
+                'CREATE INDEX IF NOT EXISTS results_date ON results (date)')
+
+    def refresh(self):
+        """Bring the index up to date and return the number of files that
+           were parsed"""
+        known = dict(((path, (mtime, size)) for path, mtime, size in
+                      self._conn.execute(
+                          'SELECT path, mtime, size FROM results')))
+        if self._base is not None:
+            self._base.refresh()
+        parsed = 0
+        seen = set()
+        with self._conn:
+            for path, stat in self._iter_result_files(self._results_dir):
+                if self._is_shared(path, stat):
+                    continue
+                seen.add(path)
+                if known.get(path) == (stat.st_mtime, stat.st_size):
+                    continue
+                self._conn.execute(
+                    'INSERT OR REPLACE INTO results VALUES '
+                    '(?, ?, ?, ?, ?, ?, ?, ?)',
+                    (path, stat.st_mtime, stat.st_size) +
+                    self._parse(path))
+                parsed += 1
+            self._conn.executemany(
+                'DELETE FROM results WHERE path = ?',
+                [(path,) for path in known if path not in seen])
+        return parsed
+
+    def latest_commit(self):
+        row = self._conn.execute(
+            'SELECT commit_hash FROM results '
+            'ORDER BY date DESC LIMIT 1').fetchone()
+        return row[0] if row is not None else None
+
+    def get_results(self, commit_hash, machine=None):
+        return [{'machine': machine, 'env_name': env_name,
+                 'commit_hash': commit_hash, 'date': date,
+                 'results': json.loads(results)}
+                for path, machine, env_name, commit_hash, date, results
+                in self._rows(commit_hash, machine)]
+
+    def get_result_paths(self, commit_hash, machine=None):
+        return [row[0] for row in self._rows(commit_hash, machine)]
+
+    def close(self):
+        self._conn.close()
+        if self._base is not None:
+            self._base.close()
+
+    def _rows(self, commit_hash, machine):
+        query = ('SELECT path, machine, env_name, commit_hash, date, results '
+                 'FROM results WHERE commit_hash = ?')
+        args = (commit_hash,)
+        if machine is not None:
+            query += ' AND machine = ?'
+            args += (machine,)
+        rows = self._conn.execute(query, args).fetchall()
+        if self._base is not None:
+            own = set(row[0] for row in rows)
+            for row in self._base._rows(commit_hash, machine):
+                path = os.path.join(
+                    self._results_dir,
+                    os.path.relpath(row[0], self._base._results_dir))
+                if path not in own and self._is_shared(path):
+                    rows.append((path,) + tuple(row[1:]))
+        return sorted(rows)
+
+    def _is_shared(self, path, stat=None):
+        """Whether path is a hard link to the same file in the base"""
+        if self._base is None:
+            return False
+        base_path = os.path.join(
+            self._base._results_dir,
+            os.path.relpath(path, self._results_dir))
+        try:
+            return os.path.samestat(stat or os.stat(path),
+                                    os.stat(base_path))
+        except FileNotFoundError:
+            return False
+
+    # the file filter was adapted from asv's codebase, in the results.py file
+    def _iter_result_files(self, directory):
+        try:
+            entries = list(os.scandir(directory))
+        except FileNotFoundError:
+            return
+        for entry in entries:
+            if entry.is_dir():
+                yield from self._iter_result_files(entry.path)
+            elif (entry.name not in self._SKIP_FILES and
+                  entry.name.endswith('.json')):
+                yield entry.path, entry.stat()
+
+    def _parse(self, path):
+        with open(path) as json_file:
+            data = json.load(json_file)
+        machine = data.get('params', {}).get('machine')
+        if machine is None:
+            machine = os.path.basename(os.path.dirname(path))
+        return (machine, data.get('env_name'), data.get('commit_hash'),
+                data.get('date'), json.dumps(data.get('results', {})))
@@ -1,13 +1,30 @@
 import json
+import logging
 import os
 import shutil
 import socket
 
-from multiprocessing import Process
-from subprocess import call, check_call
+from subprocess import check_output
 from abc import ABCMeta, abstractmethod
 
 from .repository import SourceRepository
+from .results import ResultsIndex
+from .analysis import compare
+from .config import load_repo_config
+from .util import atomic_copy, atomic_write, link_tree
+from .environment import EnvironmentPool
+from .impact import (ImpactAnalyzer, DEFAULT_IGNORE_PATHS, bench_regex,
+                     changed_files)
+from .resultcache import ResultCache, commit_date, tree_key
+from .affinity import pinned_command
+from .execution import CommandCancelled, CommandGroup, get_engine
+from .limits import LimitMonitor, RunAborted, RunCgroup, RunLimits
+from .baseline import BaselineService
+from .bisection import RegressionBisector, benchmark_regex, commits_between
+from .confirmation import ConfirmationSettings, RegressionConfirmer
+
+
+logger = logging.getLogger(__name__)
 
 
 class BenchmarkRunner(metaclass=ABCMeta):
@@ -15,45 +32,103 @@ class BenchmarkRunner(metaclass=ABCMeta):
     def run(self):
         """Abstract method for running"""
 
+    @abstractmethod
+    def cancel(self):
+        """Abstract method for stopping a run and everything it started"""
+
     @abstractmethod
     def get_run_location(self):
         """Abstract method for getting the location where the runner is
            working"""
 
+    @abstractmethod
+    def get_metadata(self):
+        """Abstract method for getting details about the run to record with
+           its job"""
 
-class ASVMasterBenchmarkRunner(BenchmarkRunner):
-    def __init__(self, directory, repo_uri, publisher):
-        self._asv_proc = ASVMasterProcess(directory, repo_uri, publisher)
+    @abstractmethod
+    def pin_cores(self, cores):
+        """Abstract method for restricting the benchmarks to a set of
+           cores"""
+
+    @abstractmethod
+    def stream_output(self, callback):
+        """Abstract method for passing the run's output to callback as it
+           is produced"""
+
+
+class ASVProcessRunner(BenchmarkRunner):
+    def __init__(self, asv_proc):
+        self._asv_proc = asv_proc
 
     def run(self):
-        self._asv_proc.start()
+        # run() blocks until the run finishes so that the scheduler's slots
+        # bound concurrency.
+        try:
+            self._asv_proc.run()
+        finally:
+            self._asv_proc.release_environment()
+
+    def cancel(self):
+        self._asv_proc.cancel()
+
+    def get_metadata(self):
+        return self._asv_proc.get_metadata()
+
+    def pin_cores(self, cores):
+        self._asv_proc.set_cores(cores)
+
+    def stream_output(self, callback):
+        self._asv_proc.set_output(callback)
+
+
+class ASVMasterBenchmarkRunner(ASVProcessRunner):
+    def __init__(self, directory, repo_uri, publisher, upstream_uri=None):
+        super(ASVMasterBenchmarkRunner, self).__init__(
+            ASVMasterProcess(directory, repo_uri, publisher, upstream_uri))
 
     def get_run_location(self):
         return ''
 
+    def publish(self):
+        """Publish the master results already in the directory without
+           benchmarking"""
+        try:
+            self._asv_proc.publish()
+        finally:
+            self._asv_proc.release_environment()
 
-class ASVBenchmarkRunner(BenchmarkRunner):
-    def __init__(self, directory, repo_uri, repo_base, branch, branch_owner,
-                 reporter, publisher):
-        # Start a new process. This is necessary since we need to change
-        # the working directory for ASV to work, but we also need to be able
-        # to handle concurrent ASV runs.
-        self._asv_proc = ASVProcess(directory, repo_uri, repo_base, branch,
-                                    branch_owner, reporter, publisher)
 
-    def run(self):
-        self._asv_proc.start()
+class ASVBenchmarkRunner(ASVProcessRunner):
+    def __init__(self, directory, repo_uri, repo_base, branch, branch_owner,
+                 reporter, publisher, upstream_uri=None, head_sha=None):
+        super(ASVBenchmarkRunner, self).__init__(
+            ASVProcess(directory, repo_uri, repo_base, branch, branch_owner,
+                       reporter, publisher, upstream_uri, head_sha))
 
     def get_run_location(self):
         return self._asv_proc.get_branch_directory()
 
 
-class RunnerProcess(Process):
-    def __init__(self, directory, repo_uri):
+class RunnerProcess(metaclass=ABCMeta):
+    """One benchmark run. Its commands run on the shared ExecutionEngine
+       with the branch directory as their working directory, and are
+       killed together when the run is cancelled."""
+
+    def __init__(self, directory, repo_uri, upstream_uri=None,
+                 head_sha=None):
 
         self._dir = directory
+        # asv names machines after the host by default
+        self._machine = socket.gethostname()
+        self._cores = None
+        self._output = None
+        self._commands = CommandGroup(self._forward_output)
         self._run_dir = os.path.join(self._dir, 'runs')
+        self._mirrors_dir = os.path.join(self._dir, 'mirrors')
         self._clone_url = repo_uri
+        self._upstream_url = upstream_uri
+        self._head_sha = head_sha
 
         self._set_branch_dir()
 
@@ -63,13 +138,27 @@ class RunnerProcess(Process):
         self._source_repo = os.path.join(self._branch_dir, 'source_repo')
         self._repo = SourceRepository.makeRepository(self._clone_url,
                                                      self._branch_ref,
-                                                     self._source_repo)
+                                                     self._source_repo,
+                                                     self._mirrors_dir,
+                                                     self._upstream_url,
+                                                     self._head_sha)
+
+        self._repo_config = load_repo_config(self._source_repo)
+        self._limits = RunLimits.load(self._dir,
+                                      self._upstream_url or self._clone_url)
+        self._cgroup = None
+        self._monitor = None
 
         source_config = os.path.join(self._source_repo, 'asv.conf.json')
         with open(source_config) as asv_fp:
             asv_config = json.load(asv_fp)
-        asv_config['repo'] = self._clone_url
-        asv_config['branches'] = [self._branch_ref]
+        # point asv at the local mirror so it doesn't clone the project again
+        asv_config['repo'] = self._repo.asv_repo
+        asv_config['branches'] = [self._repo.asv_branch]
+        # and at a warm environment shared with other branches
+        self._env_lease = EnvironmentPool.from_environ(self._dir).acquire(
+            asv_config)
+        asv_config['env_dir'] = self._env_lease.env_dir
         dest_config = os.path.join(self._branch_dir, 'asv.conf.json')
         with open(dest_config, 'w') as asv_fp:
             json.dump(asv_config, asv_fp, indent=4, sort_keys=True)
@@ -80,7 +169,116 @@ class RunnerProcess(Process):
         benchmark_source = os.path.join(self._source_repo, 'benchmarks')
         shutil.copytree(benchmark_source, benchmark_dest)
 
-        super(RunnerProcess, self).__init__()
+    def run(self):
+        self._cgroup = RunCgroup.create(self._limits.rss_bytes)
+        monitor = LimitMonitor(self._limits, self._commands, self._branch_dir,
+                               self._cgroup)
+        self._monitor = monitor
+        monitor.start()
+        try:
+            try:
+                self._run_asv()
+            except CommandCancelled:
+                if monitor.breach is None:
+                    raise
+            breach = monitor.finish()
+            if breach is not None:
+                self._report_aborted(breach)
+                raise RunAborted(breach)
+        finally:
+            monitor.stop()
+            self._monitor = None
+            if self._cgroup is not None:
+                self._cgroup.remove()
+
+    def cancel(self):
+        self._commands.cancel()
+
+    def get_metadata(self):
+        metadata = {'head_sha': self._head_sha,
+                    'env_dir': self._env_lease.env_dir,
+                    'limits': self._limits.to_dict(),
+                    'commands': [result.to_dict()
+                                 for result in self._commands.results]}
+        metadata.update(self._repo.fetch_stats)
+        return metadata
+
+    def release_environment(self):
+        self._env_lease.release()
+
+    def set_cores(self, cores):
+        """Pin asv, and the benchmark processes it starts, to cores. The
+           rest of the run stays on the cores it was started on."""
+        self._cores = cores
+
+    def set_output(self, callback):
+        self._output = callback
+
+    def _forward_output(self, stream_name, text):
+        if self._output is not None:
+            self._output(text)
+
+    def _call_asv(self, asv_command):
+        cgroup_path = self._cgroup.path if self._cgroup is not None else None
+        command = self._limits.command(asv_command, cgroup_path)
+        result = get_engine().run(pinned_command(command, self._cores),
+                                  self._branch_dir, self._commands)
+        if self._monitor is not None and \
+                self._monitor.command_exited(result.returncode) is not None:
+            raise CommandCancelled(asv_command)
+        return result
+
+    def _report_aborted(self, reason):
+        pass
+
+    def _head_commit(self):
+        if self._head_sha is not None:
+            return self._head_sha
+        output = check_output(['git', '-C', self._source_repo, 'rev-parse',
+                               'HEAD'])
+        return output.decode('utf-8').strip()
+
+    def _ignore_paths(self):
+        return DEFAULT_IGNORE_PATHS + tuple(
+            self._repo_config.get('ignore_paths', ()))
+
+    def _open_results_index(self):
+        index = ResultsIndex(self._results_dir,
+                             os.path.join(self._branch_dir,
+                                          'results_index.sqlite'))
+        index.refresh()
+        return index
+
+    def _result_cache(self):
+        return ResultCache(os.path.join(self._dir, 'cache', 'results'))
+
+    def _cache_results(self, commit):
+        """Store the results for commit under the hash of its source tree so
+           later commits with identical code can reuse them"""
+        key = tree_key(self._source_repo, commit, self._ignore_paths())
+        cache = self._result_cache()
+        index = self._open_results_index()
+        machines = set(results['machine']
+                       for results in index.get_results(commit))
+        for machine in machines:
+            cache.store(key, machine,
+                        index.get_result_paths(commit, machine))
+        index.close()
+
+    def _restore_cached_results(self, commit, machine):
+        """Copy in cached results for a source tree identical to commit's.
+           Returns whether any were found."""
+        key = tree_key(self._source_repo, commit, self._ignore_paths())
+        cache = self._result_cache()
+        if not cache.has(key, machine):
+            return False
+        date = commit_date(self._source_repo, commit)
+        cache.restore(key, machine, commit, date, self._results_dir)
+        return True
+
+    @abstractmethod
+    def _run_asv(self):
+        pass
 
     @abstractmethod
     def _set_branch_dir(self):
@@ -88,26 +286,32 @@ class RunnerProcess(Process):
 
 
 class ASVMasterProcess(RunnerProcess):
-    def __init__(self, directory, repo_uri, publisher):
+    def __init__(self, directory, repo_uri, publisher, upstream_uri=None):
 
         self._branch_ref = 'master'
         self._publisher = publisher
 
-        super(ASVMasterProcess, self).__init__(directory, repo_uri)
+        # master lives in the upstream repository, not the merged PR's fork
+        if upstream_uri is not None:
+            repo_uri = upstream_uri
+        super(ASVMasterProcess, self).__init__(directory, repo_uri,
+                                               upstream_uri)
 
-    def run(self):
-        self._run_asv()
-
-    def _run_asv(self):
+        self._results_dir = os.path.join(self._branch_dir, 'results')
 
-        os.chdir(self._branch_dir)
+    def publish(self):
+        self._publisher.publish('master', self._branch_dir)
 
+    def _run_asv(self):
         asv_command = ['asv', 'run', 'NEW']
-        call(asv_command)
+        self._call_asv(asv_command)
 
-        self._publisher.publish('master')
+        self._cache_results(self._head_commit())
 
-        os.chdir(self._dir)
+        # agents leave publishing to the server, which has every machine's
+        # results
+        if self._publisher is not None:
+            self.publish()
 
     def _set_branch_dir(self):
         self._branch_dir = os.path.join(self._run_dir, self._branch_ref)
@@ -115,124 +319,239 @@ class ASVMasterProcess(RunnerProcess):
 
 class ASVProcess(RunnerProcess):
     def __init__(self, directory, repo_uri, repo_base, branch,
-                 branch_owner, reporter, publisher):
+                 branch_owner, reporter, publisher, upstream_uri=None,
+                 head_sha=None):
 
         self._owner = branch_owner
         self._branch_ref = branch
 
-        super(ASVProcess, self).__init__(directory, repo_uri)
+        super(ASVProcess, self).__init__(directory, repo_uri, upstream_uri,
+                                         head_sha)
 
         self._base_commit = repo_base
-        self._results_dir = os.path.join(self._branch_dir, 'results')
+        self._results_dir = os.path.join(self._branch_dir, 'results',
+                                         self._machine)
 
         self._reporter = reporter
         self._publisher = publisher
 
-    def run(self):
-        self._run_asv()
-
     def get_branch_directory(self):
         return self._branch_dir
 
+    def _report_aborted(self, reason):
+        self._report(self._reporter.report_aborted, reason)
+
     def _run_asv(self):
-        self._reporter.report_started()
+        self._report(self._reporter.report_started)
 
-        os.chdir(self._branch_dir)
+        benchmarks = self._select_benchmarks()
+        if benchmarks is not None and not benchmarks:
+            self._report(self._reporter.report_skipped)
+            return
 
+        self._ensure_baseline(benchmarks)
         self._copy_master_results()
 
-        # run for commits after master
-        asv_command = ['asv', 'run', 'NEW']
-        call(asv_command)
-
-        if not self._has_regressions():
-            self._reporter.report_success()
+        confirmation = ConfirmationSettings.from_config(self._repo_config)
+        tip_commit_hash = self._head_commit()
+        reused = self._restore_cached_results(tip_commit_hash,
+                                              self._machine)
+        if not reused:
+            # run for commits after master
+            asv_command = ['asv', 'run', 'NEW']
+            if benchmarks is not None:
+                asv_command += ['--bench', bench_regex(benchmarks)]
+            if confirmation is not None:
+                asv_command += ['--attribute', 'repeat=%d' %
+                                confirmation.first_pass_repeat]
+            self._call_asv(asv_command)
+
+            # partial or fast first pass results would be reused for a full
+            # run later
+            if benchmarks is None and confirmation is None:
+                self._cache_results(tip_commit_hash)
+
+        report = self._compare_results(tip_commit_hash)
+        if report.has_regressions and confirmation is not None:
+            report = self._confirm_regressions(report, tip_commit_hash,
+                                               confirmation)
+        if not report.has_regressions:
+            self._report(self._reporter.report_success, reused=reused)
         else:
-            self._reporter.report_failure()
+            if self._repo_config.get('bisect', True):
+                report.first_bad_commit = self._bisect(report,
+                                                       tip_commit_hash)
+                self._write_comparison(report)
+            self._report(self._reporter.report_failure, reused=reused,
+                         first_bad_commit=report.first_bad_commit)
 
         publish_dest = '/'.join(['pull_requests', self._owner,
                                  self._branch_ref])
-        self._publisher.publish(publish_dest)
-
-        os.chdir(self._dir)
-
-    def _has_regressions(self):
-        path = self._results_dir
-
-        results_list = list(self._iter_results(path))
-
-        regression = False
-        if len(results_list) > 0:
-
-            # first commit chronologically should be master; last should be the
-            # tip of the branch
-            results_list = sorted(results_list,
-                                  key=lambda result: result['date'])
-            master_commit_hash = self._base_commit
-            tip_commit_hash = results_list[-1]['commit_hash']
-
-            master_results = {}
-            tip_results = {}
-
-            for results in self._iter_results(path):
-                for key, val in results['params'].items():
-                    configuration = \
-                        self._generate_unique_configuration_string(results)
-
-                    if results['commit_hash'] == master_commit_hash:
-                        if configuration not in master_results:
-                            master_results[configuration] = results['results']
-                    elif results['commit_hash'] == tip_commit_hash:
-                        if configuration not in tip_results:
-                            tip_results[configuration] = results['results']
-
-            for configuration in tip_results:
-                for benchmark, value in tip_results[configuration].items():
-                    # if this benchmark exists on master
-                    if benchmark in master_results[configuration]:
-                        master_val = master_results[configuration][benchmark]
-                        tip_val = value
-                        regression = self._is_regression(master_val, tip_val)
-
-                        if regression:
-                            break
-                if regression:
-                    break
-
-        return regression
-
-    # this method was adapted from asv's codebase, in the results.py file
-    def _iter_results(self, results_dir):
-        skip_files = set([
-            'machine.json', 'benchmarks.json'
-        ])
-        for root, dirs, files in os.walk(results_dir):
-            for filename in files:
-                if filename not in skip_files and filename.endswith('.json'):
-                    path = os.path.join(root, filename)
-                    with open(path) as json_file:
-                        data = json.load(json_file)
-                        yield data
+        self._publisher.publish(publish_dest, self._branch_dir)
+
+    def _report(self, report, *args, **kwargs):
+        """Report to GitHub without letting it fail the run, so that an
+           outage doesn't lose the benchmarks or skip publishing"""
+        try:
+            report(*args, **kwargs)
+        except Exception:
+            logger.exception('Reporting %s for %s failed', report.__name__,
+                             self._branch_dir)
+
+    def _select_benchmarks(self):
+        """Benchmark modules affected by the PR, or None to run them all"""
+        analyzer = ImpactAnalyzer(
+            self._source_repo,
+            mapping=self._repo_config.get('benchmark_mapping'),
+            ignore_paths=self._ignore_paths())
+        changed = changed_files(self._source_repo, self._base_commit)
+        return analyzer.affected_benchmarks(changed)
+
+    def _ensure_baseline(self, benchmarks):
+        """Benchmark the base commit into master's results if they don't
+           have it for this machine yet"""
+        def run_baseline():
+            asv_command = ['asv', 'run', '%s^!' % self._base_commit]
+            if benchmarks is not None:
+                asv_command += ['--bench', bench_regex(benchmarks)]
+            self._call_asv(asv_command)
+            index = self._open_results_index()
+            paths = index.get_result_paths(self._base_commit, self._machine)
+            index.close()
+            return paths
+
+        service = BaselineService(
+            os.path.join(self._run_dir, 'master', 'results'),
+            os.path.join(self._dir, 'baselines'))
+        service.ensure(self._base_commit, self._machine, benchmarks,
+                       run_baseline)
+
+    def _compare_results(self, tip_commit_hash):
+        report = self._comparison(tip_commit_hash)
+        self._write_comparison(report)
+        return report
+
+    def _comparison(self, tip_commit_hash):
+        # results from other machines aren't comparable
+        index = self._open_results_index()
+        master_results = self._results_by_configuration(
+            index.get_results(self._base_commit, self._machine))
+        tip_results = self._results_by_configuration(
+            index.get_results(tip_commit_hash, self._machine))
+        index.close()
+
+        return compare(master_results, tip_results,
+                       self._repo_config.get('regression_thresholds'))
+
+    def _confirm_regressions(self, report, tip_commit_hash, settings):
+        """Rerun the regressed benchmarks on the base and the tip until the
+           regressions are confirmed or cleared"""
+        self._unshare_results(self._base_commit)
+
+        def run_round(benchmarks, tip_first):
+            commits = [self._base_commit, tip_commit_hash]
+            if tip_first:
+                commits.reverse()
+            for commit in commits:
+                self._call_asv(['asv', 'run', '%s^!' % commit, '--bench',
+                                benchmark_regex(benchmarks)])
+            return self._comparison(tip_commit_hash)
+
+        report = RegressionConfirmer(run_round, settings).confirm(report)
+        self._write_comparison(report)
+        return report
+
+    def _unshare_results(self, commit_hash):
+        """Give the branch its own copies of commit_hash's result files, so
+           that rerunning it doesn't rewrite master's through hard links"""
+        index = self._open_results_index()
+        paths = index.get_result_paths(commit_hash, self._machine)
+        index.close()
+        for path in paths:
+            if os.stat(path).st_nlink > 1:
+                atomic_copy(path, path)
+
+    def _write_comparison(self, report):
+        report_path = os.path.join(self._branch_dir, 'comparison.json')
+        with atomic_write(report_path) as report_fp:
+            json.dump(report.to_dict(), report_fp, indent=4, sort_keys=True)
+
+    def _bisect(self, report, tip_commit_hash):
+        """Find the first commit of the pull request with the regressions in
+           report, benchmarking only the regressed benchmarks on the
+           commits the search needs"""
+        commits = commits_between(self._source_repo, self._base_commit,
+                                  tip_commit_hash)
+        if len(commits) < 2:
+            return tip_commit_hash
+
+        regressed = set(report.regressed_benchmarks)
+        thresholds = self._repo_config.get('regression_thresholds')
+        index = self._open_results_index()
+        base_results = self._results_by_configuration(
+            index.get_results(self._base_commit, self._machine))
+        index.close()
+
+        def commit_results(commit):
+            index = self._open_results_index()
+            results = index.get_results(commit, self._machine)
+            index.close()
+            return self._results_by_configuration(results)
+
+        def is_regressed(commit):
+            results = commit_results(commit)
+            measured = set(name for configuration in results.values()
+                           for name in configuration)
+            if not regressed <= measured:
+                self._call_asv(['asv', 'run', '%s^!' % commit, '--bench',
+                                benchmark_regex(regressed)])
+                results = commit_results(commit)
+            commit_report = compare(base_results, results, thresholds)
+            return bool(regressed &
+                        set(commit_report.regressed_benchmarks))
+
+        first_bad, tested = RegressionBisector(is_regressed).bisect(commits)
+        logger.info('Bisected %s to %s, testing %d of %d commits',
+                    self._branch_dir, first_bad, len(tested), len(commits))
+        return first_bad
+
+    def _results_by_configuration(self, results_list):
+        by_configuration = {}
+        for results in results_list:
+            configuration = \
+                self._generate_unique_configuration_string(results)
+            if configuration not in by_configuration:
+                by_configuration[configuration] = results['results']
+        return by_configuration
 
     def _generate_unique_configuration_string(self, results):
         return results['env_name']
 
-    def _is_regression(self, master_val, tip_val):
-        # Detect if more than 1/3 slower
-        return ((tip_val - master_val) / master_val) > .3333
+    def _open_results_index(self):
+        # most of the branch's results are hard linked from master's, which
+        # are indexed once for every branch
+        results_dir = os.path.join(self._branch_dir, 'results')
+        index_path = os.path.join(self._branch_dir, 'results_index.sqlite')
+        master_dir = os.path.join(self._run_dir, 'master')
+        master_index = None
+        if os.path.isdir(master_dir):
+            master_index = ResultsIndex(
+                os.path.join(master_dir, 'results'),
+                os.path.join(master_dir, 'results_index.sqlite'))
+        index = ResultsIndex(results_dir, index_path, master_index)
+        index.refresh()
+        return index
 
     def _copy_master_results(self):
-        master_results_dir = os.path.join(self._run_dir, 'master',
-                                          'results' + os.path.sep)
-        hostname = socket.gethostname()
-        self._results_dir = os.path.join(self._branch_dir, 'results',
-                                         hostname)
+        master_results_dir = os.path.join(self._run_dir, 'master', 'results')
+        branch_results_dir = os.path.join(self._branch_dir, 'results')
         if not os.path.exists(self._results_dir):
             os.makedirs(self._results_dir)
 
-        copy_command = ['rsync', '-av', master_results_dir,
-                        self._results_dir]
-        check_call(copy_command)
+        # asv rewrites machine.json and benchmarks.json in place, so only
+        # the per-commit result files can share storage with master
+        link_tree(master_results_dir, branch_results_dir,
+                  copy_names=('machine.json', 'benchmarks.json'))
 
     def _set_branch_dir(self):
         self._branch_dir = os.path.join(self._run_dir, self._owner,
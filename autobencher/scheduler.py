@@ -0,0 +1,263 @@
+import logging
+import socket
+import threading
+import time
+
+from .job import Job
+from .limits import RunAborted
+
+
+logger = logging.getLogger(__name__)
+
+
+class JobScheduler(object):
+    """Runs queued jobs on a fixed number of benchmark slots so that webhook
+       requests never wait on repository or filesystem work and bursts of
+       events don't run concurrently without limit.
+
+       Jobs can also be claimed by remote agents, which report back with
+       heartbeats. An agent's job is requeued when its heartbeats stop for
+       longer than agent_timeout, and queued jobs pinned to an agent that
+       hasn't been heard from for that long fail. The local slots act as an
+       agent for machine.
+
+       With a CoreAllocator, each slot records the cores its jobs are
+       pinned to in their metadata."""
+
+    def __init__(self, handler, store, slots=1, machine=None,
+                 agent_timeout=300, allocator=None):
+        self._handler = handler
+        self._store = store
+        self._slots = slots
+        self._allocator = allocator
+        self._machine = machine if machine is not None else \
+            socket.gethostname()
+        self._agent_timeout = agent_timeout
+        self._started = time.time()
+        self._wakeup = threading.Condition()
+        self._workers = []
+        self._running = {}
+        self._running_lock = threading.Lock()
+        # machine -> time last heard from, for remote agents
+        self._agents = {}
+        # job id -> time of the last heartbeat, for jobs run by agents
+        self._heartbeats = {}
+
+    @property
+    def slots(self):
+        return self._slots
+
+    @property
+    def machine(self):
+        return self._machine
+
+    def start(self):
+        requeued = self._store.requeue_running()
+        if requeued:
+            logger.info('Requeued %d interrupted jobs', requeued)
+
+        for i in range(self._slots):
+            worker = threading.Thread(target=self._work, args=(i,),
+                                      name='autobencher-slot-%d' % i)
+            worker.daemon = True
+            worker.start()
+            self._workers.append(worker)
+
+    def submit(self, event, key=None, head_sha=None, machine=None):
+        """Queue an event. Jobs that share a key benchmark into the same
+           directory, so queued jobs for the key are dropped and a running
+           one for a different head commit is cancelled. A job with a
+           machine only runs there."""
+        job = Job(event, key=key, head_sha=head_sha, machine=machine)
+        if key is not None:
+            superseded = self._store.supersede_queued(key, machine)
+            if superseded:
+                logger.info('Superseded %d queued jobs for %s', superseded,
+                            key)
+            self._cancel_stale(key, head_sha)
+
+        self._store.add(job)
+        with self._wakeup:
+            self._wakeup.notify()
+        return job
+
+    def get_job(self, job_id):
+        # running jobs are returned live so their metadata is current
+        with self._running_lock:
+            job = self._running.get(job_id)
+        if job is not None:
+            return job
+        return self._store.get(job_id)
+
+    def get_position(self, job):
+        return self._store.position(job)
+
+    def stats(self):
+        return {
+            'slots': self._slots,
+            'queued': self._store.count(Job.QUEUED),
+            'running': self._store.count(Job.RUNNING),
+            'agents': sorted(self.machines()),
+        }
+
+    def active_keys(self):
+        """Keys of the jobs that are queued or running anywhere"""
+        return self._store.active_keys()
+
+    def machines(self):
+        """Machines that are available to run jobs"""
+        self._requeue_lost()
+        with self._running_lock:
+            machines = set(self._agents)
+        if self._slots:
+            machines.add(self._machine)
+        return machines
+
+    def register_agent(self, machine):
+        with self._running_lock:
+            known = machine in self._agents
+            self._agents[machine] = time.time()
+        if not known:
+            logger.info('Agent %s registered', machine)
+
+    def claim(self, machine):
+        """Claim the next job for the agent on machine, or return None"""
+        self.register_agent(machine)
+        self._requeue_lost()
+        job = self._claim_next(machine, heartbeat=True)
+        if job is None:
+            return None
+        logger.info('Agent %s starting job %s after waiting %.1fs', machine,
+                    job.job_id, job.wait_time)
+        return job
+
+    def heartbeat(self, machine, job_id):
+        """Record that the agent on machine is still running job_id. Returns
+           the job, or None if it is no longer the agent's."""
+        self.register_agent(machine)
+        with self._running_lock:
+            job = self._running.get(job_id)
+            if job is None or job_id not in self._heartbeats or \
+                    job.metadata.get('machine') != machine:
+                return None
+            self._heartbeats[job_id] = time.time()
+        return job
+
+    def finish(self, machine, job_id, error=None, metadata=None,
+               aborted=False):
+        """Record the outcome of a job run by the agent on machine. Returns
+           the job, or None if it is no longer the agent's."""
+        job = self.heartbeat(machine, job_id)
+        if job is None:
+            return None
+        with self._running_lock:
+            del self._running[job_id]
+            del self._heartbeats[job_id]
+        if metadata:
+            job.metadata.update(metadata)
+        job.error = error
+        if aborted:
+            job.state = Job.ABORTED
+        elif error is not None:
+            job.state = Job.FAILED
+        else:
+            job.state = Job.SUCCEEDED
+        self._finish(job)
+        return job
+
+    def _cancel_stale(self, key, head_sha):
+        if head_sha is None:
+            return
+        with self._running_lock:
+            stale = [job for job in self._running.values()
+                     if job.key == key and job.head_sha is not None and
+                     job.head_sha != head_sha]
+        for job in stale:
+            logger.info('Cancelling job %s for %s at %s', job.job_id, key,
+                        job.head_sha)
+            job.cancel()
+
+    def _requeue_lost(self):
+        deadline = time.time() - self._agent_timeout
+        with self._running_lock:
+            lost = [self._running.pop(job_id)
+                    for job_id, heartbeat in list(self._heartbeats.items())
+                    if heartbeat < deadline]
+            for job in lost:
+                del self._heartbeats[job.job_id]
+            for machine, last_seen in list(self._agents.items()):
+                if last_seen < deadline:
+                    del self._agents[machine]
+            machines = set(self._agents)
+        for job in lost:
+            logger.warning('Agent %s stopped responding, requeueing job %s',
+                           job.metadata.get('machine'), job.job_id)
+            self._store.requeue(job)
+        if lost:
+            with self._wakeup:
+                self._wakeup.notify_all()
+
+        # agents known before a restart get agent_timeout to check back in
+        if self._started < deadline:
+            if self._slots:
+                machines.add(self._machine)
+            expired = self._store.expire_queued(machines, deadline,
+                                                'machine went away')
+            if expired:
+                logger.warning('Failed %d queued jobs for machines that '
+                               'went away', expired)
+
+    def _claim_next(self, machine, heartbeat=False):
+        """Claim the next job for machine and register it as running in one
+           step, so a submit for its key always sees it to cancel it"""
+        with self._running_lock:
+            job = self._store.claim_next(machine)
+            if job is None:
+                return None
+            job.metadata['machine'] = machine
+            self._running[job.job_id] = job
+            if heartbeat:
+                self._heartbeats[job.job_id] = time.time()
+        return job
+
+    def _work(self, slot):
+        cores = None
+        if self._allocator is not None:
+            cores = self._allocator.slot_cores(slot)
+        while True:
+            with self._wakeup:
+                job = self._claim_next(self._machine)
+                while job is None:
+                    self._wakeup.wait()
+                    job = self._claim_next(self._machine)
+            if cores:
+                job.metadata['cores'] = cores
+            self._run_job(job)
+
+    def _run_job(self, job):
+        logger.info('Starting job %s after waiting %.1fs', job.job_id,
+                    job.wait_time)
+        try:
+            self._handler(job)
+        except RunAborted as e:
+            logger.warning('Job %s aborted: %s', job.job_id, e)
+            job.error = str(e)
+            job.state = Job.ABORTED
+        except Exception as e:
+            if not job.cancelled:
+                logger.exception('Job %s failed', job.job_id)
+                job.error = str(e)
+            job.state = Job.FAILED
+        else:
+            job.state = Job.SUCCEEDED
+        finally:
+            with self._running_lock:
+                del self._running[job.job_id]
+
+        self._finish(job)
+
+    def _finish(self, job):
+        if job.cancelled:
+            job.state = Job.SUPERSEDED
+        job.finished = time.time()
+        self._store.update(job)
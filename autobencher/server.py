@@ -1,55 +1,399 @@
+import asyncio
+import hmac
 import json
+import logging
 import os
 
-from tornado.web import RequestHandler, StaticFileHandler, Application, url
+from functools import lru_cache, partial
 
-from autobencher.util import Authorization
+from tornado.ioloop import IOLoop
+from tornado.iostream import StreamClosedError
+from tornado.web import (RequestHandler, StaticFileHandler, Application, url,
+                         HTTPError)
+
+from autobencher.util import Authorization, atomic_write
 from autobencher.factory import BenchmarkerFactory
+from autobencher.scheduler import JobScheduler
+from autobencher.job import Job, JobStore
+from autobencher.dedup import DeliveryCache, delivery_keys
+from autobencher.joblog import JobLogs, decode_complete
+from autobencher.cleanup import RunsCollector, mark_used, run_lock
+from autobencher.compression import (COMPRESSIBLE, ENCODINGS,
+                                     accepted_encodings, cache_control,
+                                     content_type)
+from autobencher.publisher import file_digest
+from autobencher.github import get_github_client
+
+
+logger = logging.getLogger(__name__)
 
+# states of an earlier job for the same event that make a delivery redundant
+DUPLICATE_STATES = (Job.QUEUED, Job.RUNNING, Job.SUCCEEDED)
 
-def process_post(factory, request):
+
+def process_post(factory, scheduler, request, deliveries=None,
+                 collector=None):
+    """Queue a webhook event. Returns the job and whether it is a duplicate
+       of an earlier delivery, or (None, False) for events that aren't
+       benchmarked."""
     event = json.loads(request.body.decode('utf-8'))
 
-    log_event(event, os.getcwd())
+    parser = factory.makeEventParser(event)
+    event_data = parser.get_event_data()
+
+    if collector is not None and event_data.closed_run_key is not None:
+        collector.mark_closed(event_data.closed_run_key)
+
+    if not event_data.valid:
+        return None, False
+
+    keys = delivery_keys(event, request.headers.get('X-GitHub-Delivery'))
+    if deliveries is not None:
+        for key in keys:
+            job_id = deliveries.get([key])
+            if job_id is None:
+                continue
+            job = scheduler.get_job(job_id)
+            # the same head and action only repeat a job that still stands,
+            # as a branch can be pushed back to a commit it was moved off
+            if key.startswith('delivery:') or (
+                    job is not None and job.state in DUPLICATE_STATES):
+                return job, True
+
+    if event_data.is_master_update:
+        # every machine needs its own master results to compare against
+        machines = sorted(scheduler.machines()) or [None]
+        jobs = [scheduler.submit(event, event_data.run_key, machine=machine)
+                for machine in machines]
+        job = jobs[0]
+    else:
+        job = scheduler.submit(event, event_data.run_key,
+                               event_data.runner_data.head_sha)
+
+    if deliveries is not None:
+        deliveries.add(keys, job.job_id)
+
+    return job, False
+
+
+def process_event(factory, directory, event, job=None, log=None,
+                  publish_master=True):
+    log_event(event, directory)
 
     parser = factory.makeEventParser(event)
     event_data = parser.get_event_data()
 
-    if event_data.valid:
+    publish_uri = os.environ['PUBLISH_URI']
+    publisher = factory.make_publisher(publish_uri)
+
+    if event_data.is_master_update:
+        runner = factory.make_master_runner(
+            directory, event_data.runner_data,
+            publisher if publish_master else None)
+        run_location = runner.get_run_location()
+        log_event(event, run_location)
+
+        _run(runner, job, log)
+    else:
+        report_username = os.environ['REPORT_USERNAME']
+        report_password = os.environ['REPORT_PASSWORD']
 
-        publish_uri = os.environ['PUBLISH_URI']
-        publisher = factory.make_publisher(publish_uri)
+        report_auth = Authorization(report_username, report_password)
+        reporter = factory.makeReporter(event_data.reporter_data,
+                                        report_auth, publish_uri)
+        runner = factory.makeRunner(directory, event_data.runner_data,
+                                    reporter, publisher)
+        run_location = runner.get_run_location()
+        log_event(event, run_location)
 
-        if event_data.is_master_update:
-            runner = factory.make_master_runner(os.getcwd(),
-                                                event_data.runner_data,
-                                                publisher)
-            run_location = runner.get_run_location()
-            log_event(event, run_location)
+        _run(runner, job, log)
 
-            runner.run()
-        else:
-            report_username = os.environ['REPORT_USERNAME']
-            report_password = os.environ['REPORT_PASSWORD']
 
-            report_auth = Authorization(report_username, report_password)
-            reporter = factory.makeReporter(event_data.reporter_data,
-                                            report_auth, publish_uri)
-            runner = factory.makeRunner(os.getcwd(), event_data.runner_data,
-                                        reporter, publisher)
-            run_location = runner.get_run_location()
-            log_event(event, run_location)
+def _run(runner, job, log=None):
+    if log is not None:
+        runner.stream_output(log.write)
+    if job is None:
+        runner.run()
+        return
 
-            runner.run()
+    cores = job.metadata.get('cores')
+    if cores:
+        runner.pin_cores(cores)
+    job.metadata.update(runner.get_metadata())
+    job.on_cancel(runner.cancel)
+    try:
+        runner.run()
+    finally:
+        # with the exit codes and durations of the commands that ran
+        job.metadata.update(runner.get_metadata())
 
 
 class EventHandler(RequestHandler):
 
-    def initialize(self):
+    def initialize(self, scheduler, deliveries=None, collector=None):
         self._factory = BenchmarkerFactory.makeFactory()
+        self._scheduler = scheduler
+        self._deliveries = deliveries
+        self._collector = collector
 
     def post(self):
-        process_post(self._factory, self.request)
+        job, duplicate = process_post(self._factory, self._scheduler,
+                                      self.request, self._deliveries,
+                                      self._collector)
+        if duplicate:
+            self.write({'job': job.job_id if job is not None else None,
+                        'duplicate': True})
+        elif job is not None:
+            self.set_status(202)
+            self.write({'job': job.job_id})
+
+
+class JobHandler(RequestHandler):
+
+    def initialize(self, scheduler):
+        self._scheduler = scheduler
+
+    def get(self, job_id):
+        job = self._scheduler.get_job(job_id)
+        if job is None:
+            raise HTTPError(404)
+        job_dict = job.to_dict()
+        if job.state == Job.QUEUED:
+            job_dict['position'] = self._scheduler.get_position(job)
+        self.write(job_dict)
+
+
+class QueueHandler(RequestHandler):
+
+    def initialize(self, scheduler):
+        self._scheduler = scheduler
+
+    def get(self):
+        self.write(self._scheduler.stats())
+
+
+class CollectorHandler(RequestHandler):
+
+    def initialize(self, collector):
+        self._collector = collector
+
+    def get(self):
+        if self._collector is None:
+            raise HTTPError(404)
+        self.write(self._collector.stats())
+
+
+class GitHubStatsHandler(RequestHandler):
+
+    def get(self):
+        self.write(get_github_client().stats())
+
+
+class JobLogHandler(RequestHandler):
+    """Streams a job's output as server-sent events. Each event carries a
+       chunk of output and the offset just past it, which clients resume
+       from with Last-Event-ID or an offset argument."""
+
+    KEEPALIVE_SECONDS = 15
+
+    def initialize(self, logs):
+        self._logs = logs
+
+    async def get(self, job_id):
+        log = self._logs.get(job_id) if self._logs is not None else None
+        if log is None:
+            raise HTTPError(404)
+
+        offset = int(self.get_argument(
+            'offset', self.request.headers.get('Last-Event-ID', 0)))
+        self.set_header('Content-Type', 'text/event-stream')
+        self.set_header('Cache-Control', 'no-cache')
+        try:
+            while True:
+                start, data = log.read(offset)
+                closed = log.closed
+                if data:
+                    text, used = decode_complete(
+                        data, final=closed and start + len(data) == log.end)
+                    if used:
+                        offset = start + used
+                        self.write('id: %d\ndata: %s\n\n' % (
+                            offset, json.dumps({'offset': start,
+                                                'text': text})))
+                        await self.flush()
+                        continue
+                if closed:
+                    self.write('event: end\ndata: {}\n\n')
+                    return
+                try:
+                    await asyncio.wait_for(log.wait(offset),
+                                           self.KEEPALIVE_SECONDS)
+                except asyncio.TimeoutError:
+                    self.write(': keepalive\n\n')
+                    await self.flush()
+        except StreamClosedError:
+            pass
+
+
+class PrecompressedStaticFileHandler(StaticFileHandler):
+    """Serves the precompressed variant of a file written by the publisher
+       when the client accepts its encoding. ETags are strong hashes of the
+       bytes sent, and files with a content hash in their name are cached
+       as immutable."""
+
+    def initialize(self, path, default_filename=None):
+        super(PrecompressedStaticFileHandler, self).initialize(
+            path, default_filename)
+        self._source_path = None
+        self._encoding = None
+
+    def validate_absolute_path(self, root, absolute_path):
+        absolute_path = super(PrecompressedStaticFileHandler,
+                              self).validate_absolute_path(root,
+                                                           absolute_path)
+        if absolute_path is None or not absolute_path.endswith(COMPRESSIBLE):
+            return absolute_path
+
+        self._source_path = absolute_path
+        self.set_header('Vary', 'Accept-Encoding')
+        accepted = accepted_encodings(
+            self.request.headers.get('Accept-Encoding'))
+        modified = os.stat(absolute_path).st_mtime
+        for encoding, suffix in ENCODINGS:
+            if encoding not in accepted:
+                continue
+            try:
+                variant_stat = os.stat(absolute_path + suffix)
+            except FileNotFoundError:
+                continue
+            if variant_stat.st_mtime >= modified:
+                self._encoding = encoding
+                # StaticFileHandler sizes the response from this
+                self._stat_result = variant_stat
+                return absolute_path + suffix
+        return absolute_path
+
+    def compute_etag(self):
+        stat = os.stat(self.absolute_path)
+        return '"%s"' % _file_hash(self.absolute_path, stat.st_mtime_ns,
+                                   stat.st_size)
+
+    def get_content_type(self):
+        return content_type(self._source_path or self.absolute_path)
+
+    def get_cache_time(self, path, modified, mime_type):
+        # set_extra_headers sets Cache-Control instead
+        return 0
+
+    def set_extra_headers(self, path):
+        self.set_header('Cache-Control', cache_control(path))
+        if self._encoding is not None:
+            self.set_header('Content-Encoding', self._encoding)
+
+
+@lru_cache(maxsize=4096)
+def _file_hash(path, mtime_ns, size):
+    # keyed by modification time and size, so changed files get new ETags
+    return file_digest(path)
+
+
+class AgentHandler(RequestHandler):
+    """Base for the endpoints remote agents use. Agents have to send
+       AGENT_TOKEN in an X-Agent-Token header, and are refused when it
+       isn't set."""
+
+    def initialize(self, scheduler, directory):
+        self._scheduler = scheduler
+        self._directory = directory
+
+    def prepare(self):
+        token = os.environ.get('AGENT_TOKEN')
+        sent = self.request.headers.get('X-Agent-Token', '')
+        if not token or not hmac.compare_digest(sent, token):
+            raise HTTPError(403)
+
+
+class AgentRegisterHandler(AgentHandler):
+
+    def post(self, machine):
+        self._scheduler.register_agent(machine)
+        self.write({'machine': machine})
+
+
+class AgentClaimHandler(AgentHandler):
+
+    def post(self, machine):
+        job = self._scheduler.claim(machine)
+        if job is None:
+            self.set_status(204)
+            return
+        self.write({'id': job.job_id, 'event': job.event, 'key': job.key,
+                    'head_sha': job.head_sha})
+
+
+class AgentHeartbeatHandler(AgentHandler):
+
+    def post(self, machine, job_id):
+        job = self._scheduler.heartbeat(machine, job_id)
+        if job is None:
+            raise HTTPError(404)
+        self.write({'cancelled': job.cancelled})
+
+
+class AgentResultHandler(AgentHandler):
+
+    def post(self, machine, job_id):
+        body = json.loads(self.request.body.decode('utf-8'))
+        job = self._scheduler.finish(machine, job_id, body.get('error'),
+                                     body.get('metadata'),
+                                     body.get('aborted', False))
+        if job is None:
+            raise HTTPError(404)
+        if job.key is not None:
+            results = body.get('results', {})
+            store_results(self._directory, job.key, machine, results,
+                          body.get('benchmarks'))
+            if job.key == 'master' and results:
+                IOLoop.current().run_in_executor(
+                    None, publish_master, BenchmarkerFactory.makeFactory(),
+                    self._directory, job.event)
+        self.write({'job': job.job_id})
+
+
+def store_results(directory, key, machine, results, benchmarks=None):
+    """Write result files from machine into the per-machine results
+       directory for the run key, and the benchmark list next to it"""
+    results_dir = os.path.join(directory, 'runs', key, 'results', machine)
+    if not os.path.exists(results_dir):
+        os.makedirs(results_dir)
+    if benchmarks is not None:
+        benchmarks_path = os.path.join(os.path.dirname(results_dir),
+                                       'benchmarks.json')
+        with atomic_write(benchmarks_path) as benchmarks_fp:
+            json.dump(benchmarks, benchmarks_fp, indent=4, sort_keys=True)
+    for filename, result in results.items():
+        if os.path.basename(filename) != filename or \
+                not filename.endswith('.json'):
+            logger.warning('Ignoring result file %r from %s', filename,
+                           machine)
+            continue
+        result_path = os.path.join(results_dir, filename)
+        with atomic_write(result_path) as result_fp:
+            json.dump(result, result_fp, indent=4, sort_keys=True)
+
+
+def publish_master(factory, directory, event):
+    """Publish master from the server's results tree, which holds the
+       results of every machine"""
+    try:
+        event_data = factory.makeEventParser(event).get_event_data()
+        publisher = factory.make_publisher(os.environ['PUBLISH_URI'])
+        with run_lock(os.path.join(directory, 'runs'), 'master'):
+            runner = factory.make_master_runner(
+                directory, event_data.runner_data, publisher)
+            runner.publish()
+    except Exception:
+        logger.exception('Publishing master failed')
 
 
 def log_event(event, directory):
@@ -58,7 +402,68 @@ def log_event(event, directory):
         json.dump(event, request_fp, indent=4,
                   sort_keys=True)
 
-app = Application([
-    url(r"/webhooks", EventHandler),
-    url(r"/runs/(.*)", StaticFileHandler, {'path': 'runs'}),
-    ])
+
+def make_scheduler(directory, slots=1, allocator=None, logs=None):
+    factory = BenchmarkerFactory.makeFactory()
+    handler = partial(_run_job, factory, directory, logs)
+    store = JobStore(os.path.join(directory, 'jobs.sqlite'))
+    return JobScheduler(handler, store, slots, allocator=allocator)
+
+
+def _run_job(factory, directory, logs, job):
+    if job.key is None:
+        _process_job(factory, directory, logs, job)
+        return
+    # keeps the collector away from the run directory
+    runs_dir = os.path.join(directory, 'runs')
+    with run_lock(runs_dir, job.key):
+        mark_used(runs_dir, job.key)
+        _process_job(factory, directory, logs, job)
+
+
+def _process_job(factory, directory, logs, job):
+    if logs is None:
+        process_event(factory, directory, job.event, job)
+        return
+    log = logs.open(job.job_id)
+    try:
+        process_event(factory, directory, job.event, job, log)
+    finally:
+        logs.close(job.job_id)
+
+
+def make_logs(directory):
+    return JobLogs(os.path.join(directory, 'logs'))
+
+
+def make_collector(directory, scheduler):
+    return RunsCollector.from_environ(directory, scheduler.active_keys)
+
+
+def make_deliveries(directory):
+    return DeliveryCache(os.path.join(directory, 'deliveries.sqlite'))
+
+
+def make_app(scheduler, deliveries=None, directory=None, logs=None,
+             collector=None):
+    if directory is None:
+        directory = os.getcwd()
+    agent_args = {'scheduler': scheduler, 'directory': directory}
+    return Application([
+        url(r"/webhooks", EventHandler, {'scheduler': scheduler,
+                                         'deliveries': deliveries,
+                                         'collector': collector}),
+        url(r"/jobs", QueueHandler, {'scheduler': scheduler}),
+        url(r"/jobs/(\w+)", JobHandler, {'scheduler': scheduler}),
+        url(r"/jobs/(\w+)/log", JobLogHandler, {'logs': logs}),
+        url(r"/gc", CollectorHandler, {'collector': collector}),
+        url(r"/github", GitHubStatsHandler),
+        url(r"/agents/(\w[\w.-]*)", AgentRegisterHandler, agent_args),
+        url(r"/agents/(\w[\w.-]*)/claim", AgentClaimHandler, agent_args),
+        url(r"/agents/(\w[\w.-]*)/jobs/(\w+)/heartbeat",
+            AgentHeartbeatHandler, agent_args),
+        url(r"/agents/(\w[\w.-]*)/jobs/(\w+)", AgentResultHandler,
+            agent_args),
+        url(r"/runs/(.*)", PrecompressedStaticFileHandler,
+            {'path': os.path.join(directory, 'runs')}),
+        ])
@@ -0,0 +1,99 @@
+import mimetypes
+import os
+
+from abc import ABCMeta, abstractmethod
+from urllib.parse import urlparse
+
+from .util import atomic_copy
+
+
+class Storage(metaclass=ABCMeta):
+    """Where published files go. Keys are '/' separated paths. put and
+       delete are called from several threads at once."""
+
+    @abstractmethod
+    def put(self, key, path, headers=None):
+        """Store the file at path under key, to be served with the HTTP
+           headers in headers"""
+
+    @abstractmethod
+    def delete(self, key):
+        """Remove key, if it is stored"""
+
+
+class LocalStorage(Storage):
+    """Stores files under a local directory, for testing and for serving
+       results from this host. Headers are left to whatever serves them."""
+
+    def __init__(self, root):
+        self._root = root
+
+    def put(self, key, path, headers=None):
+        dest = self._path(key)
+        if not os.path.exists(os.path.dirname(dest)):
+            os.makedirs(os.path.dirname(dest), exist_ok=True)
+        atomic_copy(path, dest)
+
+    def delete(self, key):
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+
+    def _path(self, key):
+        parts = key.split('/')
+        if any(part in ('', '.', '..') for part in parts):
+            raise ValueError('Invalid key %r' % key)
+        return os.path.join(self._root, *parts)
+
+
+class S3Storage(Storage):
+    """Stores files in an S3 bucket, or an S3 compatible service such as
+       MinIO when endpoint_url is given. Needs boto3. One client is shared
+       by every thread, with a connection pool sized for them."""
+
+    _EXTRA_ARGS = {'Content-Type': 'ContentType',
+                   'Content-Encoding': 'ContentEncoding',
+                   'Cache-Control': 'CacheControl'}
+
+    def __init__(self, bucket, prefix='', endpoint_url=None,
+                 max_connections=10):
+        import boto3
+        from botocore.config import Config
+
+        self._bucket = bucket
+        self._prefix = prefix.strip('/')
+        self._client = boto3.client(
+            's3', endpoint_url=endpoint_url,
+            config=Config(max_pool_connections=max_connections))
+
+    def put(self, key, path, headers=None):
+        headers = dict(headers or {})
+        headers.setdefault('Content-Type', mimetypes.guess_type(path)[0] or
+                           'application/octet-stream')
+        extra_args = dict((self._EXTRA_ARGS[name], value)
+                          for name, value in headers.items())
+        self._client.upload_file(path, self._bucket, self._key(key),
+                                 ExtraArgs=extra_args)
+
+    def delete(self, key):
+        self._client.delete_object(Bucket=self._bucket, Key=self._key(key))
+
+    def _key(self, key):
+        if self._prefix:
+            return '%s/%s' % (self._prefix, key)
+        return key
+
+
+def storage_for(uri, max_connections=10):
+    """Storage for an s3://bucket/prefix URI or a local path. S3_ENDPOINT_URL
+       points s3 URIs at another S3 compatible service."""
+    parsed = urlparse(uri)
+    if parsed.scheme == 's3':
+        return S3Storage(parsed.netloc, parsed.path,
+                         os.environ.get('S3_ENDPOINT_URL'), max_connections)
+    if parsed.scheme == 'file':
+        return LocalStorage(parsed.path)
+    if parsed.scheme:
+        raise ValueError('Unsupported publish URI %s' % uri)
+    return LocalStorage(uri)
@@ -0,0 +1,63 @@
+import os
+import sys
+import pytest
+import testing_import_hack
+
+from subprocess import check_output
+
+from autobencher.affinity import (CoreAllocator, available_cores, pin,
+                                  pinned_command)
+
+
+testing_import_hack.use_package_so_flake8_is_happy()
+
+
+class TestCoreAllocator:
+    def test_exclusive_slots(self):
+        allocator = CoreAllocator(range(8), 2, reserved=1)
+        assert allocator.slot_cores(0) == [1, 2, 3]
+        assert allocator.slot_cores(1) == [4, 5, 6]
+        assert allocator.housekeeping == [0, 7]
+
+    def test_too_few_cores(self):
+        allocator = CoreAllocator([0, 1], 2, reserved=1)
+        assert allocator.slot_cores(0) is None
+        assert allocator.slot_cores(1) is None
+        assert allocator.housekeeping == [0, 1]
+
+    def test_unsupported_platform(self):
+        allocator = CoreAllocator(None, 1)
+        assert allocator.slot_cores(0) is None
+        assert allocator.housekeeping is None
+
+    def test_no_slots(self):
+        allocator = CoreAllocator(range(4), 0)
+        assert allocator.housekeeping == [0, 1, 2, 3]
+
+
+@pytest.mark.skipif(not hasattr(os, 'sched_setaffinity'),
+                    reason='needs sched_setaffinity')
+def test_pin_child_process():
+    cores = available_cores()
+    read, write = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        pin(cores[:1])
+        os.write(write, str(sorted(os.sched_getaffinity(0))).encode())
+        os._exit(0)
+    os.waitpid(pid, 0)
+    assert os.read(read, 100).decode() == str(cores[:1])
+
+
+@pytest.mark.skipif(not hasattr(os, 'sched_setaffinity'),
+                    reason='needs sched_setaffinity')
+def test_pinned_command():
+    core = available_cores()[-1]
+    command = pinned_command(
+        [sys.executable, '-c',
+         'import os; print(sorted(os.sched_getaffinity(0)))'], [core])
+    assert check_output(command).decode().strip() == str([core])
+
+
+def test_unpinned_command():
+    assert pinned_command(['asv', 'run'], None) == ['asv', 'run']
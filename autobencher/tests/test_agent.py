@@ -0,0 +1,115 @@
+import json
+import os
+import threading
+import pytest
+import requests
+import testing_import_hack
+
+from testing_helpers import ServerThread
+from unittest.mock import patch
+
+from autobencher.agent import Agent
+from autobencher.job import Job, JobStore
+from autobencher.scheduler import JobScheduler
+from autobencher.server import make_app
+
+
+testing_import_hack.use_package_so_flake8_is_happy()
+
+
+class TestAgent:
+    def setup_method(self, test_method):
+        self.store = JobStore(':memory:')
+        self.scheduler = JobScheduler(lambda job: None, self.store, slots=0)
+        self.environ = patch.dict(os.environ, {'AGENT_TOKEN': 'secret'})
+        self.environ.start()
+
+    def start_server(self, tmpdir):
+        self.server = ServerThread(make_app(self.scheduler,
+                                            directory=str(tmpdir)))
+        self.server.start()
+        return 'http://127.0.0.1:%d' % self.server.port
+
+    def teardown_method(self, test_method):
+        self.server.stop()
+        self.environ.stop()
+
+    def test_no_jobs(self, tmpdir):
+        agent = Agent(self.start_server(tmpdir.mkdir('server')),
+                      str(tmpdir.mkdir('agent')), 'box', token='secret')
+        agent.register()
+        assert not agent.run_once()
+        assert self.scheduler.machines() == set(['box'])
+
+    def test_runs_job_and_uploads_results(self, tmpdir):
+        server_dir = tmpdir.mkdir('server')
+        agent_dir = tmpdir.mkdir('agent')
+        agent = Agent(self.start_server(server_dir), str(agent_dir), 'box',
+                      token='secret')
+        job = self.scheduler.submit({'action': 'opened'}, 'owner/branch')
+
+        def process_event(factory, directory, event, job, publish_master):
+            results_dir = os.path.join(directory, 'runs', 'owner', 'branch',
+                                       'results', 'box')
+            os.makedirs(results_dir)
+            with open(os.path.join(results_dir, 'abcd1234-py3.json'),
+                      'w') as result_fp:
+                json.dump({'commit_hash': 'abcd1234'}, result_fp)
+            job.metadata['env_dir'] = 'envs/1'
+
+        with patch('autobencher.agent.process_event', process_event):
+            assert agent.run_once()
+
+        finished = self.store.get(job.job_id)
+        assert finished.state == Job.SUCCEEDED
+        assert finished.metadata == {'machine': 'box', 'env_dir': 'envs/1'}
+        stored = server_dir.join('runs', 'owner', 'branch', 'results', 'box',
+                                 'abcd1234-py3.json')
+        assert json.loads(stored.read()) == {'commit_hash': 'abcd1234'}
+
+    def test_master_is_published_by_server(self, tmpdir):
+        server_dir = tmpdir.mkdir('server')
+        agent_dir = tmpdir.mkdir('agent')
+        agent = Agent(self.start_server(server_dir), str(agent_dir), 'box',
+                      token='secret')
+        self.scheduler.submit({'action': 'closed'}, 'master', machine='box')
+        published = threading.Event()
+
+        def process_event(factory, directory, event, job, publish_master):
+            assert not publish_master
+            results_dir = os.path.join(directory, 'runs', 'master',
+                                       'results')
+            os.makedirs(os.path.join(results_dir, 'box'))
+            with open(os.path.join(results_dir, 'box',
+                                   'abcd1234-py3.json'), 'w') as result_fp:
+                json.dump({'commit_hash': 'abcd1234'}, result_fp)
+            with open(os.path.join(results_dir, 'benchmarks.json'),
+                      'w') as benchmarks_fp:
+                json.dump({'bench_a.time_a': {}}, benchmarks_fp)
+
+        def publish_master(factory, directory, event):
+            assert event == {'action': 'closed'}
+            published.set()
+
+        with patch('autobencher.agent.process_event', process_event), \
+                patch('autobencher.server.publish_master', publish_master):
+            assert agent.run_once()
+            assert published.wait(5)
+
+        results_dir = server_dir.join('runs', 'master', 'results')
+        assert results_dir.join('box', 'abcd1234-py3.json').check()
+        assert json.loads(results_dir.join('benchmarks.json').read()) == \
+            {'bench_a.time_a': {}}
+
+    def test_requires_token(self, tmpdir):
+        uri = self.start_server(tmpdir.mkdir('server'))
+        agent = Agent(uri, str(tmpdir.mkdir('agent')), 'box', token='wrong')
+        with pytest.raises(requests.HTTPError):
+            agent.run_once()
+
+    def test_refused_without_server_token(self, tmpdir):
+        uri = self.start_server(tmpdir.mkdir('server'))
+        agent = Agent(uri, str(tmpdir.mkdir('agent')), 'box', token='')
+        with patch.dict(os.environ, {'AGENT_TOKEN': ''}):
+            with pytest.raises(requests.HTTPError):
+                agent.run_once()
@@ -1,11 +1,15 @@
 import os
 import json
+import requests
 import testing_import_hack
 
-from unittest.mock import patch
+from unittest.mock import Mock, patch
 from autobencher.event import EventData
-from autobencher.server import process_post
+from autobencher.job import Job
+from autobencher.dedup import DeliveryCache
+from autobencher.server import process_post, process_event
 from autobencher.factory import BenchmarkerFactory
+from autobencher.runner import ASVProcess
 from autobencher.util import Authorization
 from autobencher.reporter import (GitHubStatusReporter, GitHubCommentReporter,
                                   ASVBenchmarkReporter,
@@ -25,71 +29,188 @@ class TestAuth:
 
 
 class RequestDouble:
-    pass
+    def __init__(self, headers=None):
+        self.headers = headers if headers is not None else {}
 
 
-class TestAutobencherPost:
-    def setup_method(self, test_method):
-        pass
+class SchedulerDouble:
+    def __init__(self, machines=()):
+        self.submitted = []
+        self.submitted_machines = []
+        self._machines = set(machines)
+        self._jobs = {}
 
-    @patch('autobencher.server.Authorization', autospec=True)
-    @patch('autobencher.factory.ASVPublisher', autospec=True)
-    @patch('autobencher.factory.ASVRemoteBenchmarkReporter', autospec=True)
-    @patch('autobencher.factory.ASVBenchmarkRunner', autospec=True)
-    def test_post(self, MockASVBenchmarkRunner, MockASVBenchmarkReporter,
-                  MockASVPublisher, MockAuthorization):
-        repository_uri = 'dummy_clone_url'
-        login = 'dummy_login'
-        branch = 'branch'
-        repository_base = 'asdfasdf'
+    def submit(self, event, key=None, head_sha=None, machine=None):
+        self.submitted.append(event)
+        self.submitted_machines.append(machine)
+        self.key = key
+        self.head_sha = head_sha
+        for job in self._jobs.values():
+            if job.key == key and job.state == Job.QUEUED:
+                job.state = Job.SUPERSEDED
+        job = Job(event, key=key, head_sha=head_sha, machine=machine)
+        self._jobs[job.job_id] = job
+        return job
+
+    def machines(self):
+        return self._machines
+
+    def get_job(self, job_id):
+        return self._jobs.get(job_id)
 
-        publish_uri = 's3:somethin-somethin'
-        port = str(8000)
-        report_uri = 'dummy_comment_url'
-        report_username = 'dummy_comment_user'
-        report_password = 'dummy_comment_pass'
 
-        event = {
+class TestAutobencherPost:
+    def setup_method(self, test_method):
+        self.repository_uri = 'dummy_clone_url'
+        self.login = 'dummy_login'
+        self.branch = 'branch'
+        self.repository_base = 'asdfasdf'
+        self.report_uri = 'dummy_comment_url'
+        self.upstream_uri = 'dummy_upstream_url'
+        self.head_sha = 'dummy_head_sha'
+
+        self.event = {
             'action': 'opened',
             'pull_request': {
                 'head': {
                     'repo': {
-                        'clone_url': repository_uri,
+                        'clone_url': self.repository_uri,
                         'owner': {
-                            'login': login
+                            'login': self.login
                         }
                     },
-                    'ref': branch
+                    'ref': self.branch,
+                    'sha': self.head_sha
                 },
-                'statuses_url': report_uri,
+                'statuses_url': self.report_uri,
                 'base': {
-                    'sha': repository_base
+                    'sha': self.repository_base,
+                    'repo': {
+                        'clone_url': self.upstream_uri
+                    }
                 }
             }
         }
-        request = RequestDouble
-        request.body = json.dumps(event).encode()
+
+    def test_post_queues_valid_event(self):
+        request = RequestDouble()
+        request.body = json.dumps(self.event).encode()
+        scheduler = SchedulerDouble()
+
+        factory = BenchmarkerFactory.makeFactory()
+        job, duplicate = process_post(factory, scheduler, request)
+
+        assert scheduler.submitted == [self.event]
+        assert scheduler.key == 'dummy_login/branch'
+        assert job.event == self.event
+        assert not duplicate
+
+    def test_post_skips_redelivery(self):
+        request = RequestDouble({'X-GitHub-Delivery': 'delivery-1'})
+        request.body = json.dumps(self.event).encode()
+        scheduler = SchedulerDouble()
+        deliveries = DeliveryCache(':memory:')
+
+        factory = BenchmarkerFactory.makeFactory()
+        first, first_duplicate = process_post(factory, scheduler, request,
+                                              deliveries)
+        second, second_duplicate = process_post(factory, scheduler, request,
+                                                deliveries)
+
+        assert len(scheduler.submitted) == 1
+        assert not first_duplicate
+        assert second_duplicate
+        assert second.job_id == first.job_id
+
+    def test_post_reruns_superseded_head(self):
+        scheduler = SchedulerDouble()
+        deliveries = DeliveryCache(':memory:')
+        factory = BenchmarkerFactory.makeFactory()
+
+        results = []
+        for number, head_sha in enumerate(['x', 'y', 'x', 'y']):
+            self.event['action'] = 'synchronize'
+            self.event['pull_request']['head']['sha'] = head_sha
+            request = RequestDouble({'X-GitHub-Delivery': str(number)})
+            request.body = json.dumps(self.event).encode()
+            results.append(process_post(factory, scheduler, request,
+                                        deliveries))
+
+        assert len(scheduler.submitted) == 4
+        assert not any(duplicate for job, duplicate in results)
+
+        self.event['pull_request']['head']['sha'] = 'y'
+        request = RequestDouble({'X-GitHub-Delivery': '4'})
+        request.body = json.dumps(self.event).encode()
+        job, duplicate = process_post(factory, scheduler, request, deliveries)
+        assert duplicate
+        assert job.job_id == results[3][0].job_id
+
+    def test_master_update_runs_on_every_machine(self):
+        self.event['action'] = 'closed'
+        self.event['pull_request']['merged'] = True
+        request = RequestDouble()
+        request.body = json.dumps(self.event).encode()
+        scheduler = SchedulerDouble(['box-b', 'box-a'])
+
+        factory = BenchmarkerFactory.makeFactory()
+        job, duplicate = process_post(factory, scheduler, request)
+
+        assert scheduler.submitted_machines == ['box-a', 'box-b']
+        assert scheduler.key == 'master'
+        assert job.machine == 'box-a'
+
+    def test_post_ignores_invalid_event(self):
+        self.event['action'] = 'labeled'
+        request = RequestDouble()
+        request.body = json.dumps(self.event).encode()
+        scheduler = SchedulerDouble()
+
+        factory = BenchmarkerFactory.makeFactory()
+        job, duplicate = process_post(factory, scheduler, request)
+
+        assert scheduler.submitted == []
+        assert job is None
+
+    @patch('autobencher.server.Authorization', autospec=True)
+    @patch('autobencher.factory.ASVPublisher', autospec=True)
+    @patch('autobencher.factory.ASVRemoteBenchmarkReporter', autospec=True)
+    @patch('autobencher.factory.ASVBenchmarkRunner', autospec=True)
+    def test_process_event(self, MockASVBenchmarkRunner,
+                           MockASVBenchmarkReporter, MockASVPublisher,
+                           MockAuthorization, tmpdir):
+        publish_uri = 's3:somethin-somethin'
+        port = str(8000)
+        report_username = 'dummy_comment_user'
+        report_password = 'dummy_comment_pass'
+
         os.environ['PUBLISH_URI'] = publish_uri
         os.environ['PORT'] = port
         os.environ['REPORT_USERNAME'] = report_username
         os.environ['REPORT_PASSWORD'] = report_password
 
+        directory = str(tmpdir)
+        mock_runner = MockASVBenchmarkRunner.return_value
+        mock_runner.get_run_location.return_value = directory
+
         factory = BenchmarkerFactory.makeFactory()
-        process_post(factory, request)
+        process_event(factory, directory, self.event)
 
         mock_report_auth = MockAuthorization.return_value
         mock_reporter = MockASVBenchmarkReporter.return_value
         mock_publisher = MockASVPublisher.return_value
-        mock_runner = MockASVBenchmarkRunner.return_value
 
         MockASVBenchmarkRunner.assert_called_with(
-            os.getcwd(), repository_uri, repository_base, branch, login,
-            mock_reporter, mock_publisher)
+            directory, self.repository_uri, self.repository_base,
+            self.branch, self.login, mock_reporter, mock_publisher,
+            self.upstream_uri, self.head_sha)
         assert mock_runner.get_run_location.called
         assert mock_runner.run.called
 
         MockASVBenchmarkReporter.assert_called_with(
-            publish_uri, report_uri, branch, login, mock_report_auth)
+            publish_uri, self.report_uri, self.branch, self.login,
+            mock_report_auth)
+        assert tmpdir.join('request.json').check()
 
 
 class TestMakeReporter:
@@ -151,8 +272,8 @@ class TestASVRemoteBenchmarkReporter:
         self.factory = BenchmarkerFactory.makeFactory()
 
     @patch('autobencher.reporter.check_call', autospec=True)
-    @patch('autobencher.reporter.requests', autospec=True)
-    def test_s3_upload(self, mock_requests, mock_check_call):
+    @patch('autobencher.reporter.get_github_client')
+    def test_s3_upload(self, mock_client, mock_check_call):
         rep1 = ASVRemoteBenchmarkReporter(self.result_host,
                                           self.report_uri,
                                           self.branch_name, self.branch_owner,
@@ -185,6 +306,30 @@ class TestASVRemoteBenchmarkReporter:
         #                                             self.report_pass))
 
 
+class TestASVBenchmarkReporter:
+    @patch('autobencher.reporter.get_github_client')
+    def test_report_aborted(self, mock_client):
+        reporter = ASVBenchmarkReporter('result_host', 'fake_status_url',
+                                        'branch', 'owner',
+                                        Authorization('user', 'pass'))
+        reporter.report_aborted('wall time limit of 60s exceeded')
+        params = json.loads(mock_client.return_value.post.call_args[1]['data'])
+        assert params['state'] == 'error'
+        assert params['description'] == \
+            'ASV benchmark run aborted: wall time limit of 60s exceeded'
+
+    def test_failures_dont_fail_the_run(self, tmpdir):
+        process = ASVProcess.__new__(ASVProcess)
+        process._branch_dir = str(tmpdir)
+        process._reporter = Mock()
+        process._reporter.report_aborted.side_effect = \
+            requests.HTTPError('502 Server Error')
+        process._reporter.report_aborted.__name__ = 'report_aborted'
+        process._report_aborted('wall time limit of 60s exceeded')
+        process._reporter.report_aborted.assert_called_once_with(
+            'wall time limit of 60s exceeded')
+
+
 class TestGitHubStatusReporter:
     def setup_method(self, test_method):
         self.result_uri = 'result_uri'
@@ -193,12 +338,12 @@ class TestGitHubStatusReporter:
         self.report_pass = 'fake_pass'
         self.report_auth = Authorization(self.report_user, self.report_pass)
 
-    @patch('autobencher.reporter.requests', autospec=True)
-    def test_formal_parameters(self, mock_requests):
+    @patch('autobencher.reporter.get_github_client')
+    def test_formal_parameters(self, mock_client):
         rep = GitHubStatusReporter(self.result_uri, self.report_uri,
                                    '', '', self.report_auth)
         rep.report()
-        assert mock_requests.post.called
+        assert mock_client.return_value.post.called
 
 
 class TestGitHubCommentReporter:
@@ -253,8 +398,8 @@ class TestGitHubCommentReporter:
                                      '', '', auth)
         assert rep1 != rep2
 
-    @patch('autobencher.reporter.requests', autospec=True)
-    def test_comment_report(self, mock_requests):
+    @patch('autobencher.reporter.get_github_client')
+    def test_comment_report(self, mock_client):
         rep = GitHubCommentReporter(self.result_uri, self.report_uri,
                                     '', '', self.report_auth)
         expected_markdown_comment = ('{"body": "## Automated report\\n'
@@ -264,6 +409,6 @@ class TestGitHubCommentReporter:
                                      'scikit-bio.org/benchmarks/pull_requests'
                                      '///index.html)"}')
         rep.report()
-        mock_requests.post.assert_called_with('fake_comment_url',
-                                              auth=('fake_user', 'fake_pass'),
-                                              data=expected_markdown_comment)
+        mock_client.return_value.post.assert_called_with(
+            'fake_comment_url', auth=('fake_user', 'fake_pass'),
+            data=expected_markdown_comment)
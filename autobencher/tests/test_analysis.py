@@ -0,0 +1,61 @@
+import testing_import_hack
+
+from autobencher.analysis import compare, flatten_results
+
+
+testing_import_hack.use_package_so_flake8_is_happy()
+
+
+class TestFlattenResults:
+    def test_scalar_and_parametrized(self):
+        results = {
+            'time_a': 1.5,
+            'time_b': {'params': [['1', '2'], ['x']], 'result': [3.0, None]},
+            'time_c': None,
+        }
+        assert list(flatten_results(results)) == [
+            ('time_a', (), 1.5),
+            ('time_b', ('1', 'x'), 3.0),
+            ('time_b', ('2', 'x'), None),
+            ('time_c', (), None),
+        ]
+
+
+class TestCompare:
+    def test_regressions_and_improvements(self):
+        base = {'py3': {'time_a': 1.0, 'time_b': 1.0, 'time_c': 1.0}}
+        tip = {'py3': {'time_a': 2.0, 'time_b': 0.5, 'time_c': 1.1}}
+        report = compare(base, tip)
+        assert report.has_regressions
+        assert [c.benchmark for c in report.regressions] == ['time_a']
+        assert [c.benchmark for c in report.improvements] == ['time_b']
+        assert report.compared == 3
+
+    def test_reports_every_regression(self):
+        base = {'py2': {'time_a': 1.0}, 'py3': {'time_a': 1.0}}
+        tip = {'py2': {'time_a': 3.0}, 'py3': {'time_a': 3.0}}
+        report = compare(base, tip)
+        assert [c.configuration for c in report.regressions] == \
+            ['py2', 'py3']
+
+    def test_parametrized_and_missing_values(self):
+        base = {'py3': {'time_p': {'params': [['1', '2']],
+                                   'result': [1.0, 1.0]},
+                        'time_q': None}}
+        tip = {'py3': {'time_p': {'params': [['1', '2']],
+                                  'result': [None, 4.0]},
+                       'time_q': 1.0}}
+        report = compare(base, tip)
+        assert report.compared == 1
+        assert [c.name for c in report.regressions] == ['time_p(2)']
+
+    def test_per_benchmark_thresholds(self):
+        base = {'py3': {'time_noisy': 1.0, 'time_stable': 1.0}}
+        tip = {'py3': {'time_noisy': 1.5, 'time_stable': 1.5}}
+        report = compare(base, tip, {'time_noisy': 1.0, 'default': .25})
+        assert [c.benchmark for c in report.regressions] == ['time_stable']
+
+    def test_missing_configuration(self):
+        report = compare({}, {'py3': {'time_a': 1.0}})
+        assert not report.has_regressions
+        assert report.compared == 0
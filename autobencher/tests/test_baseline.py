@@ -0,0 +1,108 @@
+import json
+import os
+import threading
+import time
+import testing_import_hack
+
+from testing_helpers import write_result
+from autobencher.baseline import BaselineService
+
+
+testing_import_hack.use_package_so_flake8_is_happy()
+
+
+class TestBaselineService:
+    def setup_method(self, test_method):
+        self.base = 'a' * 40
+
+    def make_service(self, tmpdir):
+        self.master_dir = str(tmpdir.join('master', 'results'))
+        self.branch_dir = str(tmpdir.join('branch', 'results'))
+        return BaselineService(self.master_dir, str(tmpdir.join('locks')))
+
+    def write_benchmarks(self, *names):
+        with open(os.path.join(self.master_dir, 'benchmarks.json'),
+                  'w') as benchmarks_fp:
+            json.dump(dict((name, {}) for name in names + ('version',)),
+                      benchmarks_fp)
+
+    def test_existing_results(self, tmpdir):
+        service = self.make_service(tmpdir)
+        write_result(self.master_dir, 'box', self.base, 'py3', 1,
+                     {'bench_io.time_read': 1.0})
+        self.write_benchmarks('bench_io.time_read')
+        assert service.has_results(self.base, 'box')
+        assert service.has_results(self.base, 'box', ['bench_io'])
+        assert not service.has_results(self.base, 'box', ['bench_core'])
+        assert not service.has_results(self.base, 'other')
+        assert not service.has_results('b' * 40, 'box')
+
+    def test_runs_missing_baseline_into_master(self, tmpdir):
+        service = self.make_service(tmpdir)
+
+        def run_baseline():
+            return [write_result(self.branch_dir, 'box', self.base, 'py3', 1,
+                                 {'bench_io.time_read': 1.0})]
+
+        assert service.ensure(self.base, 'box', None, run_baseline)
+        assert service.has_results(self.base, 'box')
+        assert os.path.exists(os.path.join(self.master_dir, 'box',
+                                           'machine.json'))
+        assert not service.ensure(self.base, 'box', None, run_baseline)
+
+    def test_single_flight(self, tmpdir):
+        service = self.make_service(tmpdir)
+        runs = []
+
+        def run_baseline():
+            runs.append(True)
+            time.sleep(.1)
+            return [write_result(self.branch_dir, 'box', self.base, 'py3', 1,
+                                 {'bench_io.time_read': 1.0})]
+
+        threads = [threading.Thread(target=service.ensure,
+                                    args=(self.base, 'box', None,
+                                          run_baseline))
+                   for i in range(3)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert len(runs) == 1
+
+    def test_partial_baseline_doesnt_cover_everything(self, tmpdir):
+        service = self.make_service(tmpdir)
+        write_result(self.master_dir, 'box', self.base, 'py3', 1,
+                     {'bench_io.time_read': 1.0})
+        self.write_benchmarks('bench_io.time_read', 'bench_core.time_add')
+        assert service.has_results(self.base, 'box', ['bench_io'])
+        assert not service.has_results(self.base, 'box')
+
+    def test_full_baseline_runs_once(self, tmpdir):
+        service = self.make_service(tmpdir)
+        os.makedirs(self.master_dir)
+        self.write_benchmarks('bench_io.time_read', 'bench_new.time_new')
+
+        def run_baseline():
+            return [write_result(self.branch_dir, 'box', self.base, 'py3', 1,
+                                 {'bench_io.time_read': 1.0})]
+
+        assert service.ensure(self.base, 'box', None, run_baseline)
+        assert not service.ensure(self.base, 'box', None, run_baseline)
+
+    def test_baselines_merge_into_master(self, tmpdir):
+        service = self.make_service(tmpdir)
+        write_result(self.master_dir, 'box', self.base, 'py3', 1,
+                     {'bench_io.time_read': 1.0})
+
+        def run_baseline():
+            return [write_result(self.branch_dir, 'box', self.base, 'py3', 1,
+                                 {'bench_core.time_add': 2.0})]
+
+        assert service.ensure(self.base, 'box', ['bench_core'], run_baseline)
+        assert service.has_results(self.base, 'box', ['bench_io'])
+        assert service.has_results(self.base, 'box', ['bench_core'])
+        with open(os.path.join(self.master_dir, 'box',
+                               '%s-py3.json' % self.base[:8])) as result_fp:
+            assert json.load(result_fp)['results'] == {
+                'bench_io.time_read': 1.0, 'bench_core.time_add': 2.0}
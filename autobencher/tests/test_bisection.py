@@ -0,0 +1,56 @@
+import re
+import subprocess
+import testing_import_hack
+
+from testing_helpers import git
+from autobencher.bisection import (RegressionBisector, benchmark_regex,
+                                   commits_between)
+
+
+testing_import_hack.use_package_so_flake8_is_happy()
+
+
+class TestRegressionBisector:
+    def setup_method(self, test_method):
+        self.commits = ['c%d' % i for i in range(16)]
+        self.tested = []
+
+    def bisect(self, first_bad):
+        def is_regressed(commit):
+            self.tested.append(commit)
+            return self.commits.index(commit) >= first_bad
+        return RegressionBisector(is_regressed).bisect(self.commits)
+
+    def test_finds_every_first_bad_commit(self):
+        for first_bad in range(len(self.commits)):
+            self.tested = []
+            commit, tested = self.bisect(first_bad)
+            assert commit == self.commits[first_bad]
+            assert tested == self.tested
+            assert len(tested) <= 4
+
+    def test_single_commit_needs_no_runs(self):
+        self.commits = ['only']
+        assert self.bisect(0) == ('only', [])
+
+
+class TestCommitsBetween:
+    def test_first_parent_range(self, tmpdir):
+        repo = str(tmpdir)
+        subprocess.check_call(['git', 'init', '-q', '-b', 'master', repo])
+        git(repo, 'commit', '-q', '--allow-empty', '-m', 'base')
+        base = git(repo, 'rev-parse', 'HEAD')
+        expected = []
+        for i in range(3):
+            git(repo, 'commit', '-q', '--allow-empty', '-m', str(i))
+            expected.append(git(repo, 'rev-parse', 'HEAD'))
+        assert commits_between(repo, base, expected[-1]) == expected
+
+
+class TestBenchmarkRegex:
+    def test_matches_only_named_benchmarks(self):
+        pattern = re.compile(benchmark_regex(['a.time_x', 'b.Suite.time_y']))
+        assert pattern.match('a.time_x')
+        assert pattern.match('b.Suite.time_y')
+        assert not pattern.match('a.time_x2')
+        assert not pattern.match('aXtime_x')
@@ -0,0 +1,105 @@
+import os
+import testing_import_hack
+
+from autobencher.cleanup import (CLOSED_MARKER, RunsCollector, disk_usage,
+                                 mark_used, run_lock)
+from autobencher.event import GitHubWebhooksParser
+
+
+testing_import_hack.use_package_so_flake8_is_happy()
+
+
+def make_run(runs_dir, key, size, last_used):
+    path = os.path.join(runs_dir, key)
+    os.makedirs(os.path.join(path, 'results'))
+    with open(os.path.join(path, 'request.json'), 'w') as request_fp:
+        request_fp.write('x' * size)
+    os.utime(path, (last_used, last_used))
+    return path
+
+
+class TestRunsCollector:
+    def setup_method(self, test_method):
+        self.active = set()
+
+    def make_collector(self, tmpdir, max_bytes):
+        runs_dir = str(tmpdir.join('runs'))
+        make_run(runs_dir, 'master', 100, 1)
+        make_run(runs_dir, 'alice/old', 100, 1)
+        make_run(runs_dir, 'bob/feature/new', 100, 3)
+        make_run(runs_dir, 'carol/closed', 100, 2)
+        collector = RunsCollector(runs_dir, max_bytes,
+                                  lambda: self.active)
+        collector.mark_closed('carol/closed')
+        return runs_dir, collector
+
+    def test_closed_first_then_least_recently_used(self, tmpdir):
+        runs_dir, collector = self.make_collector(tmpdir, 250)
+        assert collector.sweep() == 200
+        assert collector.stats()['last_sweep']['removed'] == \
+            ['carol/closed', 'alice/old']
+        assert not os.path.exists(os.path.join(runs_dir, 'alice', 'old'))
+        assert os.path.exists(os.path.join(runs_dir, 'bob', 'feature', 'new'))
+
+    def test_within_budget(self, tmpdir):
+        runs_dir, collector = self.make_collector(tmpdir, 400)
+        assert collector.sweep() == 0
+
+    def test_active_and_locked_runs_are_kept(self, tmpdir):
+        runs_dir, collector = self.make_collector(tmpdir, 0)
+        self.active.add('alice/old')
+        with run_lock(runs_dir, 'bob/feature/new'):
+            assert collector.sweep() == 100
+        assert os.path.exists(os.path.join(runs_dir, 'alice', 'old'))
+        assert os.path.exists(os.path.join(runs_dir, 'master'))
+        assert collector.stats()['reclaimed_bytes'] == 100
+
+    def test_use_reopens(self, tmpdir):
+        runs_dir, collector = self.make_collector(tmpdir, 0)
+        mark_used(runs_dir, 'carol/closed')
+        assert not os.path.exists(
+            os.path.join(runs_dir, 'carol', 'closed', CLOSED_MARKER))
+
+    def test_hard_links_counted_once(self, tmpdir):
+        tmpdir.join('a').write('x' * 10)
+        os.link(str(tmpdir.join('a')), str(tmpdir.join('b')))
+        assert disk_usage(str(tmpdir)) == 10
+
+
+class TestClosedEvents:
+    def make_event(self, action, merged):
+        return {'action': action, 'pull_request': {
+            'merged': merged,
+            'head': {'ref': 'feature', 'sha': 'abc',
+                     'repo': {'owner': {'login': 'alice'},
+                              'clone_url': 'https://example.com/a.git'}},
+            'base': {'sha': 'def'}}}
+
+    def test_closed_key(self):
+        for merged in (True, False):
+            event_data = GitHubWebhooksParser(
+                self.make_event('closed', merged)).get_event_data()
+            assert event_data.closed_run_key == 'alice/feature'
+        event_data = GitHubWebhooksParser(
+            self.make_event('opened', False)).get_event_data()
+        assert event_data.closed_run_key is None
+
+    def test_deleted_fork(self):
+        event = self.make_event('closed', False)
+        event['pull_request']['head']['repo'] = None
+        event_data = GitHubWebhooksParser(event).get_event_data()
+        assert event_data.closed_run_key is None
+
+    def test_merged_from_deleted_fork(self):
+        event = self.make_event('closed', True)
+        event['pull_request']['head']['repo'] = None
+        event['pull_request']['base']['repo'] = {
+            'owner': {'login': 'upstream'},
+            'clone_url': 'https://example.com/upstream.git'}
+        event_data = GitHubWebhooksParser(event).get_event_data()
+        assert event_data.valid
+        assert event_data.is_master_update
+        assert event_data.closed_run_key is None
+        assert event_data.runner_data.branch_owner == 'upstream'
+        assert event_data.runner_data.repository_uri == \
+            'https://example.com/upstream.git'
@@ -0,0 +1,108 @@
+import gzip
+import os
+import shutil
+import tempfile
+import testing_import_hack
+
+from tornado.testing import AsyncHTTPTestCase
+
+from autobencher.compression import (IMMUTABLE, accepted_encodings,
+                                     artifact_headers, precompress)
+from autobencher.job import JobStore
+from autobencher.scheduler import JobScheduler
+from autobencher.server import make_app
+
+
+testing_import_hack.use_package_so_flake8_is_happy()
+
+
+GRAPH = '[%s]' % ', '.join('[%d, 1.5]' % i for i in range(200))
+
+
+class TestPrecompress:
+    def test_variants(self, tmpdir):
+        tmpdir.join('graph.json').write(GRAPH)
+        tmpdir.join('tiny.json').write('[]')
+        tmpdir.join('logo.png').write('x' * 1000)
+        assert precompress(str(tmpdir)) >= 1
+        assert gzip.decompress(tmpdir.join('graph.json.gz').read_binary()) \
+            == GRAPH.encode()
+        assert not tmpdir.join('tiny.json.gz').check()
+        assert not tmpdir.join('logo.png.gz').check()
+
+    def test_unchanged_files_are_skipped(self, tmpdir):
+        tmpdir.join('graph.json').write(GRAPH)
+        precompress(str(tmpdir))
+        assert precompress(str(tmpdir)) == 0
+
+    def test_orphaned_variants_are_removed(self, tmpdir):
+        tmpdir.join('graph.json').write(GRAPH)
+        tmpdir.join('archive.gz').write('data')
+        precompress(str(tmpdir))
+        tmpdir.join('graph.json').remove()
+        precompress(str(tmpdir))
+        assert sorted(os.listdir(str(tmpdir))) == ['archive.gz']
+
+    def test_headers(self):
+        assert artifact_headers('graphs/a.json.gz') == {
+            'Content-Type': 'application/json; charset=utf-8',
+            'Content-Encoding': 'gzip', 'Cache-Control': 'no-cache'}
+        assert artifact_headers('asv.3f2a9c1e.js')['Cache-Control'] == \
+            IMMUTABLE
+        assert 'Content-Encoding' not in artifact_headers('archive.gz')
+
+    def test_accepted_encodings(self):
+        assert accepted_encodings('gzip, deflate, br;q=0') == \
+            set(['gzip', 'deflate'])
+        assert accepted_encodings(None) == set()
+
+
+class TestPrecompressedStaticFileHandler(AsyncHTTPTestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        html_dir = os.path.join(self.directory, 'runs', 'master', 'html')
+        os.makedirs(html_dir)
+        for name in ('graph.json', 'app.0123abcd.js'):
+            with open(os.path.join(html_dir, name), 'w') as file_fp:
+                file_fp.write(GRAPH)
+        precompress(html_dir)
+        super(TestPrecompressedStaticFileHandler, self).setUp()
+
+    def tearDown(self):
+        super(TestPrecompressedStaticFileHandler, self).tearDown()
+        shutil.rmtree(self.directory)
+
+    def get_app(self):
+        scheduler = JobScheduler(lambda job: None, JobStore(':memory:'))
+        return make_app(scheduler, directory=self.directory)
+
+    def fetch_graph(self, **headers):
+        return self.fetch('/runs/master/html/graph.json', headers=headers,
+                          decompress_response=False)
+
+    def test_gzip_variant(self):
+        response = self.fetch_graph(**{'Accept-Encoding': 'gzip'})
+        assert response.headers['Content-Encoding'] == 'gzip'
+        assert response.headers['Content-Type'] == \
+            'application/json; charset=utf-8'
+        assert response.headers['Vary'] == 'Accept-Encoding'
+        assert response.headers['Cache-Control'] == 'no-cache'
+        assert gzip.decompress(response.body) == GRAPH.encode()
+
+    def test_identity(self):
+        response = self.fetch_graph(**{'Accept-Encoding': 'identity'})
+        assert 'Content-Encoding' not in response.headers
+        assert response.body == GRAPH.encode()
+
+    def test_strong_etag_revalidates(self):
+        etag = self.fetch_graph(**{'Accept-Encoding': 'gzip'}).headers['Etag']
+        assert not etag.startswith('W/')
+        response = self.fetch_graph(**{'Accept-Encoding': 'gzip',
+                                       'If-None-Match': etag})
+        assert response.code == 304
+        other = self.fetch_graph(**{'Accept-Encoding': 'identity'})
+        assert other.headers['Etag'] != etag
+
+    def test_hashed_files_are_immutable(self):
+        response = self.fetch('/runs/master/html/app.0123abcd.js')
+        assert response.headers['Cache-Control'] == IMMUTABLE
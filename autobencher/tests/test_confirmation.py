@@ -0,0 +1,66 @@
+import pytest
+import testing_import_hack
+
+from autobencher.analysis import compare
+from autobencher.confirmation import (ConfirmationSettings,
+                                      RegressionConfirmer, sign_test)
+
+
+testing_import_hack.use_package_so_flake8_is_happy()
+
+
+class TestSignTest:
+    def test_p_values(self):
+        assert sign_test(0, 4) == 1
+        assert sign_test(4, 4) == 1 / 16.0
+        assert sign_test(3, 4) == 5 / 16.0
+
+
+class TestConfirmationSettings:
+    def test_off_without_config(self):
+        assert ConfirmationSettings.from_config({}) is None
+
+    def test_defaults(self):
+        settings = ConfirmationSettings.from_config({'confirmation': {}})
+        assert settings.first_pass_repeat == 1
+        assert settings.max_rounds == 8
+
+    def test_unreachable_confidence(self):
+        with pytest.raises(ValueError):
+            ConfirmationSettings(confidence=0.95, max_rounds=4)
+
+
+class TestRegressionConfirmer:
+    def setup_method(self, test_method):
+        self.rounds = []
+        self.report = compare({'py3': {'a': 1.0, 'b': 1.0, 'c': 1.0}},
+                              {'py3': {'a': 2.0, 'b': 2.0, 'c': 1.0}})
+
+    def confirm(self, tip_results):
+        def run_round(benchmarks, tip_first):
+            self.rounds.append((benchmarks, tip_first))
+            return compare({'py3': {'a': 1.0, 'b': 1.0}},
+                           {'py3': tip_results})
+        confirmer = RegressionConfirmer(run_round, ConfirmationSettings())
+        return confirmer.confirm(self.report)
+
+    def test_noise_is_cleared_early(self):
+        report = self.confirm({'a': 2.0, 'b': 1.0})
+        assert report.regressed_benchmarks == ['a']
+        assert report.confirmation['b [py3]'] == {
+            'regressed_rounds': 0, 'rounds': 2, 'confirmed': False}
+        assert report.confirmation['a [py3]']['rounds'] == 5
+
+    def test_rounds_alternate_and_drop_decided(self):
+        self.confirm({'a': 2.0, 'b': 1.0})
+        assert [tip_first for _, tip_first in self.rounds] == \
+            [False, True, False, True, False]
+        assert [benchmarks for benchmarks, _ in self.rounds] == \
+            [['a', 'b'], ['a', 'b'], ['a'], ['a'], ['a']]
+
+    def test_keeps_improvements(self):
+        self.report = compare({'py3': {'a': 1.0, 'b': 2.0}},
+                              {'py3': {'a': 2.0, 'b': 1.0}})
+        report = self.confirm({'a': 1.0, 'b': 1.0})
+        assert not report.has_regressions
+        assert len(report.improvements) == 1
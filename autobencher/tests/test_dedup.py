@@ -0,0 +1,56 @@
+import time
+import testing_import_hack
+
+from autobencher.dedup import DeliveryCache, delivery_keys
+
+
+testing_import_hack.use_package_so_flake8_is_happy()
+
+
+class TestDeliveryKeys:
+    def test_delivery_and_event_keys(self):
+        event = {
+            'action': 'synchronize',
+            'repository': {'full_name': 'owner/project'},
+            'pull_request': {'head': {'sha': 'abc'}}
+        }
+        assert delivery_keys(event, 'guid') == [
+            'delivery:guid', 'event:owner/project:abc:synchronize']
+
+    def test_falls_back_to_base_repo(self):
+        event = {
+            'action': 'opened',
+            'pull_request': {
+                'head': {'sha': 'abc'},
+                'base': {'repo': {'full_name': 'owner/project'}}
+            }
+        }
+        assert delivery_keys(event) == ['event:owner/project:abc:opened']
+
+
+class TestDeliveryCache:
+    def test_known_key(self):
+        cache = DeliveryCache(':memory:')
+        cache.add(['a', 'b'], 'job1')
+        assert cache.get(['x', 'b']) == 'job1'
+        assert cache.get(['x']) is None
+
+    def test_bounded(self):
+        cache = DeliveryCache(':memory:', max_entries=2)
+        cache.add(['a'], 'job1')
+        cache.add(['b'], 'job2')
+        cache.add(['c'], 'job3')
+        assert len(cache) == 2
+        assert cache.get(['a']) is None
+        assert cache.get(['c']) == 'job3'
+
+    def test_expires(self):
+        cache = DeliveryCache(':memory:', ttl=60)
+        cache.add(['a'], 'job1')
+        cache._entries['a'] = ('job1', time.time() - 120)
+        assert cache.get(['a']) is None
+
+    def test_persisted(self, tmpdir):
+        path = str(tmpdir.join('deliveries.sqlite'))
+        DeliveryCache(path).add(['a'], 'job1')
+        assert DeliveryCache(path).get(['a']) == 'job1'
@@ -0,0 +1,62 @@
+import os
+import testing_import_hack
+
+from autobencher.environment import EnvironmentPool
+
+
+testing_import_hack.use_package_so_flake8_is_happy()
+
+
+class TestEnvironmentPool:
+    def setup_method(self, test_method):
+        self.config = {'environment_type': 'conda', 'pythons': ['3.4'],
+                       'matrix': {'numpy': []}}
+
+    def test_key_ignores_unrelated_settings(self, tmpdir):
+        pool = EnvironmentPool(str(tmpdir))
+        other = dict(self.config, repo='other', branches=['feature'])
+        assert pool.key_for(self.config) == pool.key_for(other)
+        different = dict(self.config, pythons=['3.5'])
+        assert pool.key_for(self.config) != pool.key_for(different)
+
+    def test_reuses_released_environment(self, tmpdir):
+        pool = EnvironmentPool(str(tmpdir))
+        first = pool.acquire(self.config)
+        env_dir = first.env_dir
+        first.release()
+        second = pool.acquire(self.config)
+        assert second.env_dir == env_dir
+        second.release()
+
+    def test_leases_are_exclusive(self, tmpdir):
+        pool = EnvironmentPool(str(tmpdir))
+        first = pool.acquire(self.config)
+        second = pool.acquire(self.config)
+        assert first.env_dir != second.env_dir
+        first.release()
+        second.release()
+
+    def test_evicts_least_recently_used(self, tmpdir):
+        pool = EnvironmentPool(str(tmpdir))
+        old = pool.acquire(self.config)
+        with open(os.path.join(old.env_dir, 'payload'), 'w') as fp:
+            fp.write('x' * 100)
+        os.utime(old.env_dir, (1, 1))
+        old.release()
+
+        current = pool.acquire(dict(self.config, pythons=['3.5']))
+        with open(os.path.join(current.env_dir, 'payload'), 'w') as fp:
+            fp.write('x' * 100)
+
+        assert pool.evict(150) == 100
+        assert not os.path.exists(old.env_dir)
+        assert os.path.exists(current.env_dir)
+
+    def test_does_not_evict_leased(self, tmpdir):
+        pool = EnvironmentPool(str(tmpdir))
+        lease = pool.acquire(self.config)
+        with open(os.path.join(lease.env_dir, 'payload'), 'w') as fp:
+            fp.write('x' * 100)
+        assert pool.evict(0) == 0
+        assert os.path.exists(lease.env_dir)
+        lease.release()
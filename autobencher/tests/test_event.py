@@ -150,6 +150,13 @@ class TestRunnerData:
                           self.branch, 'different')
         assert obs1 != obs2
 
+    def test_eq_different_head_sha(self):
+        obs1 = RunnerData(self.repo_uri, self.repo_base,
+                          self.branch, self.branch_owner, 'abc')
+        obs2 = RunnerData(self.repo_uri, self.repo_base,
+                          self.branch, self.branch_owner, 'def')
+        assert obs1 != obs2
+
 
 class TestEventData:
     def setup_method(self, test_method):
@@ -179,7 +186,8 @@ class TestGitHubStatusEventParser:
                             'login': login
                         }
                     },
-                    'ref': branch
+                    'ref': branch,
+                    'sha': 'headsha'
                 },
                 'statuses_url': report_uri,
                 'base': {
@@ -193,11 +201,12 @@ class TestGitHubStatusEventParser:
         exp_reporter_data = ReporterData(report_uri=report_uri,
                                          branch=branch, branch_owner=login)
         exp_runner_data = RunnerData(repository_uri, repository_base, branch,
-                                     branch_owner=login)
+                                     branch_owner=login, head_sha='headsha')
 
         assert event_data.valid
         assert event_data.reporter_data == exp_reporter_data
         assert event_data.runner_data == exp_runner_data
+        assert event_data.run_key == 'dummy_login/branch'
 
 
 class TestASVEventParser:
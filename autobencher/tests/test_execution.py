@@ -0,0 +1,89 @@
+import os
+import signal
+import sys
+import threading
+import time
+import pytest
+import testing_import_hack
+
+from subprocess import CalledProcessError
+
+from autobencher.execution import CommandCancelled, CommandGroup, get_engine
+
+
+testing_import_hack.use_package_so_flake8_is_happy()
+
+
+class TestExecutionEngine:
+    def setup_method(self, test_method):
+        self.engine = get_engine()
+
+    def test_runs_in_cwd(self, tmpdir):
+        result = self.engine.run(
+            [sys.executable, '-c', 'import os; print(os.getcwd())'],
+            str(tmpdir))
+        assert result.returncode == 0
+        assert result.stdout.strip() == os.path.realpath(str(tmpdir))
+        assert result.duration >= 0
+
+    def test_streams_output(self, tmpdir):
+        chunks = []
+        group = CommandGroup(lambda name, text: chunks.append((name, text)))
+        self.engine.run([sys.executable, '-c',
+                         'import sys; print("out"); '
+                         'print("err", file=sys.stderr)'],
+                        str(tmpdir), group)
+        assert ''.join(text for name, text in chunks
+                       if name == 'stdout') == 'out\n'
+        assert ''.join(text for name, text in chunks
+                       if name == 'stderr') == 'err\n'
+        assert [result.returncode for result in group.results] == [0]
+
+    def test_keeps_only_tail_unless_captured(self, tmpdir):
+        command = [sys.executable, '-c', 'print("x" * 100000 + "end")']
+        chunks = []
+        group = CommandGroup(lambda name, text: chunks.append((name, text)))
+        result = self.engine.run(command, str(tmpdir), group)
+        assert len(''.join(text for name, text in chunks
+                           if name == 'stdout')) == 100004
+        assert len(result.stdout) <= 4096
+        assert result.stdout.endswith('end\n')
+        assert len(self.engine.check_output(command, str(tmpdir))) == 100004
+
+    def test_check_call_raises(self, tmpdir):
+        with pytest.raises(CalledProcessError) as excinfo:
+            self.engine.check_call(
+                [sys.executable, '-c', 'raise SystemExit(3)'], str(tmpdir))
+        assert excinfo.value.returncode == 3
+
+    def test_cancel_kills_command(self, tmpdir):
+        group = CommandGroup()
+        timer = threading.Timer(.2, group.cancel)
+        timer.start()
+        start = time.time()
+        with pytest.raises(CommandCancelled):
+            self.engine.run([sys.executable, '-c',
+                             'import time; time.sleep(30)'], str(tmpdir),
+                            group)
+        assert time.time() - start < 10
+        assert group.results[0].returncode != 0
+
+    def test_cancel_kills_command_ignoring_sigterm(self, tmpdir):
+        group = CommandGroup(kill_grace=.2)
+        timer = threading.Timer(.5, group.cancel)
+        timer.start()
+        start = time.time()
+        with pytest.raises(CommandCancelled):
+            self.engine.run([sys.executable, '-c',
+                             'import signal, time; '
+                             'signal.signal(signal.SIGTERM, signal.SIG_IGN); '
+                             'time.sleep(30)'], str(tmpdir), group)
+        assert time.time() - start < 10
+        assert group.results[0].returncode == -signal.SIGKILL
+
+    def test_cancelled_group_starts_nothing(self, tmpdir):
+        group = CommandGroup()
+        group.cancel()
+        with pytest.raises(CommandCancelled):
+            self.engine.run(['true'], str(tmpdir), group)
+        assert group.results == []
@@ -0,0 +1,143 @@
+import json
+import time
+import pytest
+import requests
+import testing_import_hack
+
+from testing_helpers import ServerThread
+from unittest.mock import patch
+from tornado.testing import bind_unused_port
+from tornado.web import Application, RequestHandler
+
+from autobencher.github import GitHubClient, endpoint
+from autobencher.reporter import ASVBenchmarkReporter
+from autobencher.util import Authorization
+
+
+testing_import_hack.use_package_so_flake8_is_happy()
+
+
+SHA = 'a' * 40
+
+
+class FakeGitHubHandler(RequestHandler):
+    """Answers with the next queued (status, headers, body) response, or
+       201 once there are none left"""
+
+    def initialize(self, github):
+        self._github = github
+
+    def post(self, path):
+        self._github.requests.append(
+            (path, self.request.headers.get('Authorization'),
+             json.loads(self.request.body.decode('utf-8'))))
+        status, headers, body = self._github.responses.pop(0) \
+            if self._github.responses else (201, {}, {})
+        self.set_status(status)
+        for name, value in headers.items():
+            self.set_header(name, value)
+        self.write(body)
+
+
+class FakeGitHub(object):
+    def __init__(self):
+        self.requests = []
+        self.responses = []
+        self.server = ServerThread(Application([
+            (r'/(.*)', FakeGitHubHandler, {'github': self})]))
+        self.server.start()
+
+    def url(self, path):
+        return 'http://127.0.0.1:%d/%s' % (self.server.port, path)
+
+
+class TestGitHubClient:
+    def setup_method(self, test_method):
+        self.github = FakeGitHub()
+        self.sleeps = []
+        self.client = GitHubClient(retries=2, sleep=self.sleeps.append)
+        self.status_url = self.github.url('repos/o/r/statuses/' + SHA)
+
+    def teardown_method(self, test_method):
+        self.github.server.stop()
+
+    def post_status(self):
+        return self.client.post(self.status_url,
+                                data=json.dumps({'state': 'pending'}))
+
+    def test_retries_server_errors(self):
+        self.github.responses = [(502, {}, {})]
+        assert self.post_status().status_code == 201
+        assert len(self.github.requests) == 2
+        stats = self.client.stats()
+        assert stats['calls'] == {'POST /repos/o/r/statuses/{sha}': 2}
+        assert stats['retries'] == {'POST /repos/o/r/statuses/{sha}': 1}
+        assert 0 <= self.sleeps[0] <= 1
+
+    def test_secondary_rate_limit_honours_retry_after(self):
+        self.github.responses = [
+            (403, {'Retry-After': '7'},
+             {'message': 'You have exceeded a secondary rate limit.'})]
+        assert self.post_status().status_code == 201
+        assert self.sleeps == [7]
+
+    def test_errors_are_raised_after_retries(self):
+        self.github.responses = [(500, {}, {})] * 3
+        with pytest.raises(requests.HTTPError):
+            self.post_status()
+        assert len(self.github.requests) == 3
+
+    def test_client_errors_are_not_retried(self):
+        self.github.responses = [(422, {}, {'message': 'Validation Failed'})]
+        with pytest.raises(requests.HTTPError):
+            self.post_status()
+        assert len(self.github.requests) == 1
+        assert self.sleeps == []
+
+    def test_timed_out_posts_are_not_retried(self):
+        with patch.object(self.client._session, 'request',
+                          side_effect=requests.ReadTimeout()) as request:
+            with pytest.raises(requests.ReadTimeout):
+                self.post_status()
+            assert request.call_count == 1
+            with pytest.raises(requests.ReadTimeout):
+                self.client.get(self.status_url)
+            assert request.call_count == 4
+
+    def test_unsent_posts_are_retried(self):
+        # nothing listens on the port once the socket is closed
+        sock, port = bind_unused_port()
+        sock.close()
+        with pytest.raises(requests.ConnectionError):
+            self.client.post('http://127.0.0.1:%d/comments' % port)
+        assert len(self.sleeps) == 2
+
+    def test_throttles_ahead_of_limit(self):
+        reset = time.time() + 100
+        self.github.responses = [
+            (201, {'X-RateLimit-Remaining': '10',
+                   'X-RateLimit-Reset': str(int(reset))}, {})]
+        self.post_status()
+        assert self.sleeps == []
+        self.post_status()
+        assert 8 < self.sleeps[0] <= 10
+        assert self.client.stats()['rate_limit_remaining'] == 9
+
+    def test_reporter_posts_through_client(self):
+        reporter = ASVBenchmarkReporter('result_host', self.status_url,
+                                        'branch', 'owner',
+                                        Authorization('user', 'pass'))
+        with patch('autobencher.reporter.get_github_client',
+                   return_value=self.client):
+            reporter.report_started()
+        path, authorization, body = self.github.requests[0]
+        assert path == 'repos/o/r/statuses/' + SHA
+        assert authorization.startswith('Basic ')
+        assert body['state'] == 'pending'
+
+
+class TestEndpoint:
+    def test_ids_and_hashes_are_grouped(self):
+        assert endpoint('delete', 'https://api.github.com/repos/o/r/issues/'
+                        'comments/12345') == \
+            'DELETE /repos/o/r/issues/comments/{id}'
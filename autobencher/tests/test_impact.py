@@ -0,0 +1,83 @@
+import re
+import testing_import_hack
+
+from autobencher.impact import ImpactAnalyzer, bench_regex
+
+
+testing_import_hack.use_package_so_flake8_is_happy()
+
+
+class TestImpactAnalyzer:
+    def setup_method(self, test_method):
+        self.sources = {
+            'pkg/__init__.py': '',
+            'pkg/core.py': 'from ._util import helper\n',
+            'pkg/_util.py': 'def helper():\n    pass\n',
+            'pkg/io.py': 'import os\n',
+            'benchmarks/__init__.py': '',
+            'benchmarks/bench_core.py': 'from pkg.core import something\n',
+            'benchmarks/bench_io.py': 'import pkg.io\n',
+        }
+
+    def make_analyzer(self, tmpdir, **kwargs):
+        for path, source in self.sources.items():
+            tmpdir.join(path).write(source, ensure=True)
+        return ImpactAnalyzer(str(tmpdir), **kwargs)
+
+    def test_docs_only_skips(self, tmpdir):
+        analyzer = self.make_analyzer(tmpdir)
+        assert analyzer.affected_benchmarks(['README.md', 'docs/x.rst']) == \
+            set()
+
+    def test_direct_import(self, tmpdir):
+        analyzer = self.make_analyzer(tmpdir)
+        assert analyzer.affected_benchmarks(['pkg/io.py']) == \
+            set(['bench_io'])
+
+    def test_transitive_relative_import(self, tmpdir):
+        analyzer = self.make_analyzer(tmpdir)
+        assert analyzer.affected_benchmarks(['pkg/_util.py']) == \
+            set(['bench_core'])
+
+    def test_changed_benchmark(self, tmpdir):
+        analyzer = self.make_analyzer(tmpdir)
+        assert analyzer.affected_benchmarks(['benchmarks/bench_io.py']) == \
+            set(['bench_io'])
+
+    def test_changed_benchmark_helper(self, tmpdir):
+        self.sources['benchmarks/common.py'] = 'def make_data():\n    pass\n'
+        self.sources['benchmarks/bench_io.py'] = \
+            'import pkg.io\nfrom .common import make_data\n'
+        analyzer = self.make_analyzer(tmpdir)
+        assert analyzer.affected_benchmarks(['benchmarks/common.py']) == \
+            set(['bench_io'])
+
+    def test_changed_benchmark_package_runs_everything(self, tmpdir):
+        analyzer = self.make_analyzer(tmpdir)
+        assert analyzer.affected_benchmarks(
+            ['benchmarks/__init__.py']) is None
+
+    def test_non_python_change_runs_everything(self, tmpdir):
+        analyzer = self.make_analyzer(tmpdir)
+        assert analyzer.affected_benchmarks(['pkg/_speedups.pyx']) is None
+        assert analyzer.affected_benchmarks(None) is None
+
+    def test_requirements_change_runs_everything(self, tmpdir):
+        analyzer = self.make_analyzer(tmpdir)
+        assert analyzer.affected_benchmarks(['requirements.txt']) is None
+        assert analyzer.affected_benchmarks(['pkg/data/words.txt']) is None
+        assert analyzer.affected_benchmarks(['README.txt']) == set()
+
+    def test_mapping(self, tmpdir):
+        analyzer = self.make_analyzer(
+            tmpdir, mapping={'pkg/*.pyx': ['bench_core']})
+        assert analyzer.affected_benchmarks(['pkg/_speedups.pyx']) == \
+            set(['bench_core'])
+
+
+class TestBenchRegex:
+    def test_matches_only_selected_modules(self):
+        pattern = re.compile(bench_regex(['bench_io', 'bench_core']))
+        assert pattern.search('bench_io.TimeRead.time_read')
+        assert not pattern.search('bench_iox.TimeRead.time_read')
+        assert not pattern.search('bench_stats.time_mean')
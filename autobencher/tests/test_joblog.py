@@ -0,0 +1,121 @@
+import json
+import shutil
+import tempfile
+import testing_import_hack
+
+from tornado.testing import AsyncHTTPTestCase, gen_test
+
+from autobencher.joblog import JobLog, JobLogs, decode_complete
+from autobencher.job import JobStore
+from autobencher.scheduler import JobScheduler
+from autobencher.server import make_app
+
+
+testing_import_hack.use_package_so_flake8_is_happy()
+
+
+def read_all(log, offset=0):
+    chunks = []
+    while True:
+        start, data = log.read(offset)
+        if not data:
+            return b''.join(chunks)
+        chunks.append(data)
+        offset = start + len(data)
+
+
+class TestJobLog:
+    def test_ring_is_bounded(self, tmpdir):
+        log = JobLog(str(tmpdir), 'job', capacity=10)
+        for i in range(10):
+            log.write('line %d\n' % i)
+        assert log.end == 70
+        assert log.read(67) == (67, b' 9\n')
+        # older output comes back from disk
+        assert read_all(log).decode().splitlines()[0] == 'line 0'
+
+    def test_rotation_drops_oldest_files(self, tmpdir):
+        log = JobLog(str(tmpdir), 'job', capacity=10, max_file_bytes=14,
+                     backups=1)
+        for i in range(10):
+            log.write('line %d\n' % i)
+        start, data = log.read(0)
+        assert start == 42
+        assert read_all(log, start) == b'line 6\nline 7\nline 8\nline 9\n'
+        assert len(tmpdir.listdir()) == 2
+
+    def test_finished_log_is_read_from_disk(self, tmpdir):
+        logs = JobLogs(str(tmpdir))
+        logs.open('job').write('done\n')
+        logs.close('job')
+        log = logs.get('job')
+        assert log.closed
+        assert read_all(log) == b'done\n'
+        assert logs.get('missing') is None
+
+    def test_decode_complete(self):
+        data = 'né'.encode('utf-8')
+        assert decode_complete(data[:-1]) == ('n', 1)
+        assert decode_complete(data) == ('né', 3)
+
+
+class TestJobLogHandler(AsyncHTTPTestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        super(TestJobLogHandler, self).setUp()
+
+    def tearDown(self):
+        super(TestJobLogHandler, self).tearDown()
+        shutil.rmtree(self.directory)
+
+    def get_app(self):
+        self.logs = JobLogs(self.directory)
+        scheduler = JobScheduler(lambda job: None, JobStore(':memory:'))
+        return make_app(scheduler, directory=self.directory, logs=self.logs)
+
+    def events(self, body):
+        events = []
+        for block in body.decode().split('\n\n'):
+            fields = dict(line.split(': ', 1) for line in block.splitlines()
+                          if not line.startswith(':'))
+            if fields:
+                events.append(fields)
+        return events
+
+    def test_unknown_job(self):
+        assert self.fetch('/jobs/missing/log').code == 404
+
+    def test_streams_and_resumes(self):
+        log = self.logs.open('job')
+        log.write('first\n')
+        log.write('second\n')
+        self.logs.close('job')
+
+        response = self.fetch('/jobs/job/log')
+        events = self.events(response.body)
+        assert response.headers['Content-Type'] == 'text/event-stream'
+        assert json.loads(events[0]['data'])['text'] == 'first\nsecond\n'
+        assert events[-1]['event'] == 'end'
+
+        response = self.fetch('/jobs/job/log',
+                              headers={'Last-Event-ID': '6'})
+        data = json.loads(self.events(response.body)[0]['data'])
+        assert data == {'offset': 6, 'text': 'second\n'}
+
+    @gen_test
+    def test_live_output(self):
+        log = self.logs.open('job')
+        chunks = []
+
+        def on_chunk(chunk):
+            chunks.append(chunk)
+            if len(chunks) == 1:
+                log.write('later\n')
+                self.logs.close('job')
+
+        log.write('now\n')
+        yield self.http_client.fetch(self.get_url('/jobs/job/log'),
+                                     streaming_callback=on_chunk)
+        texts = [json.loads(event['data']).get('text') for event in
+                 self.events(b''.join(chunks))]
+        assert ''.join(text for text in texts if text) == 'now\nlater\n'
@@ -0,0 +1,106 @@
+import json
+import signal
+import sys
+import pytest
+import testing_import_hack
+
+from autobencher.execution import CommandCancelled, CommandGroup, get_engine
+from autobencher.limits import LimitMonitor, RunLimits
+
+
+testing_import_hack.use_package_so_flake8_is_happy()
+
+
+class TestRunLimits:
+    def test_no_file(self, tmpdir):
+        limits = RunLimits.load(str(tmpdir), 'https://example.com/repo.git')
+        assert not any(limits.to_dict().values())
+        assert limits.command(['asv', 'run']) == ['asv', 'run']
+
+    def test_repository_overrides_default(self, tmpdir):
+        tmpdir.join('limits.json').write(json.dumps({
+            'default': {'wall_seconds': 3600, 'rss_bytes': 1024},
+            'https://example.com/repo.git': {'wall_seconds': 60},
+        }))
+        limits = RunLimits.load(str(tmpdir), 'https://example.com/repo.git')
+        assert limits.wall_seconds == 60
+        assert limits.rss_bytes == 1024
+        other = RunLimits.load(str(tmpdir), 'https://example.com/other.git')
+        assert other.wall_seconds == 3600
+
+    def test_unknown_limit(self, tmpdir):
+        tmpdir.join('limits.json').write(json.dumps({
+            'default': {'wall_time': 60}}))
+        with pytest.raises(ValueError):
+            RunLimits.load(str(tmpdir), 'https://example.com/repo.git')
+
+    def test_command_sets_rlimits(self, tmpdir):
+        command = RunLimits(cpu_seconds=30).command(
+            [sys.executable, '-c',
+             'import resource; '
+             'print(resource.getrlimit(resource.RLIMIT_CPU)[0])'])
+        output = get_engine().check_output(command, str(tmpdir))
+        assert output.strip() == '30'
+
+
+class TestLimitMonitor:
+    def run_monitored(self, limits, code, tmpdir):
+        group = CommandGroup()
+        monitor = LimitMonitor(limits, group, str(tmpdir), interval=.05)
+        monitor.start()
+        try:
+            with pytest.raises(CommandCancelled):
+                get_engine().run([sys.executable, '-c', code], str(tmpdir),
+                                 group)
+        finally:
+            monitor.stop()
+        return monitor.breach
+
+    def test_wall_time(self, tmpdir):
+        breach = self.run_monitored(RunLimits(wall_seconds=.2),
+                                    'import time; time.sleep(30)', tmpdir)
+        assert breach == 'wall time limit of 0.2s exceeded'
+
+    def test_memory_of_child_processes(self, tmpdir):
+        code = ('import subprocess, sys; subprocess.call([sys.executable, '
+                '"-c", "import time; x = bytearray(200 * 2 ** 20); '
+                'time.sleep(30)"])')
+        breach = self.run_monitored(RunLimits(rss_bytes=100 * 2 ** 20),
+                                    code, tmpdir)
+        assert breach.startswith('memory limit')
+
+    def test_disk(self, tmpdir):
+        tmpdir.join('big').write('x' * 2048)
+        breach = self.run_monitored(RunLimits(disk_bytes=1024),
+                                    'import time; time.sleep(30)', tmpdir)
+        assert breach == 'disk limit of 1024 bytes exceeded'
+
+    def test_cpu_rlimit_kill(self, tmpdir):
+        limits = RunLimits(cpu_seconds=1)
+        group = CommandGroup()
+        monitor = LimitMonitor(limits, group, str(tmpdir))
+        result = get_engine().run(
+            limits.command([sys.executable, '-c', 'while True: pass']),
+            str(tmpdir), group)
+        assert monitor.command_exited(result.returncode) == \
+            'CPU time limit of 1s exceeded'
+        assert group.cancelled
+
+    def test_exit_codes_without_limits(self, tmpdir):
+        monitor = LimitMonitor(RunLimits(), CommandGroup(), str(tmpdir))
+        assert monitor.command_exited(-signal.SIGKILL) is None
+        assert monitor.command_exited(-signal.SIGXFSZ) is None
+        assert monitor.command_exited(1) is None
+
+    def test_file_size_rlimit_kill(self, tmpdir):
+        monitor = LimitMonitor(RunLimits(disk_bytes=1024), CommandGroup(),
+                               str(tmpdir))
+        assert monitor.command_exited(-signal.SIGXFSZ) == \
+            'disk limit of 1024 bytes exceeded'
+
+    def test_breach_after_last_command(self, tmpdir):
+        monitor = LimitMonitor(RunLimits(disk_bytes=1024), CommandGroup(),
+                               str(tmpdir), interval=60)
+        monitor.start()
+        tmpdir.join('big').write('x' * 2048)
+        assert monitor.finish() == 'disk limit of 1024 bytes exceeded'
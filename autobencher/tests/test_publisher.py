@@ -0,0 +1,154 @@
+import os
+import pytest
+import threading
+import testing_import_hack
+
+from autobencher.publisher import ASVPublisher, PublishQueue
+from autobencher.storage import LocalStorage, storage_for
+
+
+testing_import_hack.use_package_so_flake8_is_happy()
+
+
+class RecordingStorage(LocalStorage):
+    def __init__(self, root, fail=()):
+        super(RecordingStorage, self).__init__(root)
+        self.puts = []
+        self.headers = {}
+        self.fail = set(fail)
+
+    def put(self, key, path, headers=None):
+        if key in self.fail:
+            raise IOError('upload of %s failed' % key)
+        self.puts.append(key)
+        self.headers[key] = headers
+        super(RecordingStorage, self).put(key, path, headers)
+
+
+class TestASVPublisher:
+    def setup_method(self, test_method):
+        self.uri = 's3://bucket/benchmarks'
+
+    def write(self, tmpdir, name, content):
+        tmpdir.join('branch', 'html', name).write(content, ensure=True)
+
+    def publish(self, tmpdir, storage):
+        publisher = ASVPublisher(self.uri, storage)
+        return publisher.upload('pr/a', str(tmpdir.join('branch')))
+
+    def test_only_changes_are_uploaded(self, tmpdir):
+        storage = RecordingStorage(str(tmpdir.join('remote')))
+        self.write(tmpdir, 'index.html', 'index')
+        self.write(tmpdir, 'graphs/a.json', '[1]')
+        assert self.publish(tmpdir, storage) == (2, 0)
+        assert storage.headers['pr/a/index.html'] == {
+            'Content-Type': 'text/html; charset=utf-8',
+            'Cache-Control': 'no-cache'}
+
+        self.write(tmpdir, 'graphs/a.json', '[1, 2]')
+        storage.puts = []
+        assert self.publish(tmpdir, storage) == (1, 0)
+        assert storage.puts == ['pr/a/graphs/a.json']
+        assert tmpdir.join('remote', 'pr', 'a', 'graphs', 'a.json').read() \
+            == '[1, 2]'
+
+    def test_stale_files_are_deleted(self, tmpdir):
+        storage = RecordingStorage(str(tmpdir.join('remote')))
+        self.write(tmpdir, 'index.html', 'index')
+        self.write(tmpdir, 'old.json', '{}')
+        self.publish(tmpdir, storage)
+        os.remove(str(tmpdir.join('branch', 'html', 'old.json')))
+        assert self.publish(tmpdir, storage) == (0, 1)
+        assert not tmpdir.join('remote', 'pr', 'a', 'old.json').check()
+
+    def test_failed_uploads_are_retried(self, tmpdir):
+        storage = RecordingStorage(str(tmpdir.join('remote')),
+                                   fail=['pr/a/b.json'])
+        self.write(tmpdir, 'a.json', '1')
+        self.write(tmpdir, 'b.json', '2')
+        with pytest.raises(IOError):
+            self.publish(tmpdir, storage)
+        storage.fail = set()
+        storage.puts = []
+        self.publish(tmpdir, storage)
+        assert storage.puts == ['pr/a/b.json']
+
+    def test_other_destination_uploads_everything(self, tmpdir):
+        storage = RecordingStorage(str(tmpdir.join('remote')))
+        self.write(tmpdir, 'index.html', 'index')
+        self.publish(tmpdir, storage)
+        self.uri = 's3://other'
+        assert self.publish(tmpdir, storage) == (1, 0)
+
+
+class TestPublishQueue:
+    def setup_method(self, test_method):
+        self.published = []
+        self.queue = PublishQueue(delay=0.05, max_delay=1)
+
+    def publish(self, target):
+        def publish(directory):
+            self.published.append((target, directory))
+        return publish
+
+    def test_bursts_are_merged(self, tmpdir):
+        for i in range(5):
+            self.queue.submit('master', str(tmpdir.join('master%d' % i)),
+                              self.publish('master'))
+        self.queue.submit('pr', str(tmpdir.join('pr')), self.publish('pr'))
+        assert self.queue.join(5)
+        assert sorted(self.published) == [
+            ('master', str(tmpdir.join('master4'))),
+            ('pr', str(tmpdir.join('pr')))]
+
+    def test_same_target_is_serialized(self, tmpdir):
+        started = threading.Event()
+        release = threading.Event()
+        running = []
+
+        def slow_publish(directory):
+            running.append(directory)
+            started.set()
+            release.wait(5)
+            running.remove(directory)
+            self.published.append(directory)
+
+        def checked_publish(directory):
+            assert not running
+            self.published.append(directory)
+
+        self.queue.submit('master', str(tmpdir), slow_publish)
+        assert started.wait(5)
+        self.queue.submit('master', str(tmpdir), checked_publish)
+        release.set()
+        assert self.queue.join(5)
+        assert self.published == [str(tmpdir), str(tmpdir)]
+
+    def test_failures_are_contained(self, tmpdir):
+        def failing_publish(directory):
+            raise RuntimeError('upload failed')
+
+        self.queue.submit('a', str(tmpdir), failing_publish)
+        assert self.queue.join(5)
+        self.queue.submit('a', str(tmpdir), self.publish('a'))
+        assert self.queue.join(5)
+        assert self.published == [('a', str(tmpdir))]
+
+
+class TestStorage:
+    def test_local_uris(self, tmpdir):
+        storage = storage_for('file://' + str(tmpdir))
+        tmpdir.join('source').write('data')
+        storage.put('a/b.txt', str(tmpdir.join('source')))
+        assert tmpdir.join('a', 'b.txt').read() == 'data'
+        storage.delete('a/b.txt')
+        storage.delete('a/b.txt')
+        assert not tmpdir.join('a', 'b.txt').check()
+
+    def test_keys_stay_inside_root(self, tmpdir):
+        with pytest.raises(ValueError):
+            LocalStorage(str(tmpdir)).put('../escape', __file__)
+
+    def test_unknown_scheme(self):
+        with pytest.raises(ValueError):
+            storage_for('ftp://host/path')
@@ -0,0 +1,122 @@
+import os
+import subprocess
+import testing_import_hack
+
+from testing_helpers import commit_file, git
+from autobencher.repository import SourceRepository
+
+
+testing_import_hack.use_package_so_flake8_is_happy()
+
+
+class TestGitRepository:
+    def make_repos(self, tmpdir):
+        upstream = str(tmpdir.join('upstream'))
+        subprocess.check_call(['git', 'init', '-q', '-b', 'master', upstream])
+        commit_file(upstream, 'a.py', 'a = 1\n')
+
+        fork = str(tmpdir.join('fork'))
+        subprocess.check_call(['git', 'clone', '-q', upstream, fork])
+        git(fork, 'checkout', '-q', '-b', 'feature')
+        head = commit_file(fork, 'b.py', 'b = 1\n')
+        return upstream, fork, head
+
+    def check_out_like_asv(self, repo, sha, build):
+        subprocess.check_call(['git', 'clone', '-q', '--shared',
+                               repo.asv_repo, build])
+        git(build, 'checkout', '-q', '-f', sha)
+        with open(os.path.join(build, 'a.py')) as source_fp:
+            assert source_fp.read() == 'a = 1\n'
+
+    def test_fork_branch_uses_shared_mirror(self, tmpdir):
+        upstream, fork, head = self.make_repos(tmpdir)
+        mirrors = str(tmpdir.join('mirrors'))
+        checkout = str(tmpdir.join('runs', 'source_repo'))
+
+        repo = SourceRepository.makeRepository(fork, 'feature', checkout,
+                                               mirrors, upstream)
+
+        mirror_name = os.path.basename(repo.asv_repo)
+        assert sorted(os.listdir(mirrors)) == [mirror_name,
+                                               mirror_name + '.lock']
+        assert repo.asv_branch.startswith('forks/')
+        assert repo.asv_branch.endswith('/feature')
+        assert git(checkout, 'rev-parse', 'HEAD') == head
+        assert os.path.isfile(os.path.join(checkout, '.git'))
+
+    def test_existing_checkout_is_updated(self, tmpdir):
+        upstream, fork, head = self.make_repos(tmpdir)
+        mirrors = str(tmpdir.join('mirrors'))
+        checkout = str(tmpdir.join('runs', 'source_repo'))
+        SourceRepository.makeRepository(fork, 'feature', checkout, mirrors,
+                                        upstream)
+
+        new_head = commit_file(fork, 'c.py', 'c = 1\n')
+        SourceRepository.makeRepository(fork, 'feature', checkout, mirrors,
+                                        upstream)
+        assert git(checkout, 'rev-parse', 'HEAD') == new_head
+
+    def test_upstream_branch(self, tmpdir):
+        upstream, fork, head = self.make_repos(tmpdir)
+        mirrors = str(tmpdir.join('mirrors'))
+        checkout = str(tmpdir.join('master', 'source_repo'))
+        repo = SourceRepository.makeRepository(upstream, 'master', checkout,
+                                               mirrors, upstream)
+        assert repo.asv_branch == 'master'
+        assert git(checkout, 'rev-parse', 'HEAD') == \
+            git(upstream, 'rev-parse', 'HEAD')
+
+    def test_pins_webhook_head(self, tmpdir):
+        upstream, fork, head = self.make_repos(tmpdir)
+        commit_file(fork, 'c.py', 'c = 1\n')
+        mirrors = str(tmpdir.join('mirrors'))
+        checkout = str(tmpdir.join('runs', 'source_repo'))
+
+        repo = SourceRepository.makeRepository(fork, 'feature', checkout,
+                                               mirrors, upstream, head)
+        assert git(checkout, 'rev-parse', 'HEAD') == head
+        assert git(repo.asv_repo, 'rev-parse',
+                   'refs/heads/' + repo.asv_branch) == head
+
+    def test_records_fetch_stats(self, tmpdir):
+        upstream, fork, head = self.make_repos(tmpdir)
+        mirrors = str(tmpdir.join('mirrors'))
+        checkout = str(tmpdir.join('runs', 'source_repo'))
+        repo = SourceRepository.makeRepository(fork, 'feature', checkout,
+                                               mirrors, upstream, head)
+        stats = repo.fetch_stats
+        assert stats['fetch_seconds'] > 0
+        assert stats['fetch_bytes'] >= 0
+
+    def test_asv_can_check_out_older_commits(self, tmpdir):
+        upstream, fork, head = self.make_repos(tmpdir)
+        # let upstream serve partial clones, as GitHub does
+        git(upstream, 'config', 'uploadpack.allowFilter', 'true')
+        old = git(upstream, 'rev-parse', 'HEAD')
+        commit_file(upstream, 'a.py', 'a = 2\n')
+        mirrors = str(tmpdir.join('mirrors'))
+        checkout = str(tmpdir.join('master', 'source_repo'))
+        repo = SourceRepository.makeRepository('file://' + upstream,
+                                               'master', checkout, mirrors)
+
+        self.check_out_like_asv(repo, old, str(tmpdir.join('build')))
+
+    def test_blobless_mirror_is_filled_in(self, tmpdir):
+        upstream, fork, head = self.make_repos(tmpdir)
+        git(upstream, 'config', 'uploadpack.allowFilter', 'true')
+        old = git(upstream, 'rev-parse', 'HEAD')
+        commit_file(upstream, 'a.py', 'a = 2\n')
+        mirrors = str(tmpdir.join('mirrors'))
+        checkout = str(tmpdir.join('master', 'source_repo'))
+        repo = SourceRepository.makeRepository('file://' + upstream,
+                                               'master', checkout, mirrors)
+        subprocess.check_call(['rm', '-rf', repo.asv_repo, checkout])
+        subprocess.check_call(['git', 'clone', '-q', '--bare',
+                               '--filter=blob:none', 'file://' + upstream,
+                               repo.asv_repo])
+
+        SourceRepository.makeRepository('file://' + upstream, 'master',
+                                        checkout, mirrors)
+        self.check_out_like_asv(repo, old, str(tmpdir.join('build')))
+        assert subprocess.call(['git', '--git-dir', repo.asv_repo, 'config',
+                                'remote.origin.promisor']) == 1
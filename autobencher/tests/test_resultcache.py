@@ -0,0 +1,57 @@
+import json
+import os
+import subprocess
+import testing_import_hack
+
+from testing_helpers import commit_file, write_result
+from autobencher.resultcache import ResultCache, tree_key
+
+
+testing_import_hack.use_package_so_flake8_is_happy()
+
+
+class TestTreeKey:
+    def setup_method(self, test_method):
+        self.ignore_paths = ('*.md', '.github/*')
+
+    def make_repo(self, tmpdir):
+        repo = str(tmpdir.join('repo'))
+        subprocess.check_call(['git', 'init', '-q', '-b', 'master', repo])
+        return repo, commit_file(repo, 'pkg/core.py', 'a = 1\n')
+
+    def test_ignored_changes_keep_key(self, tmpdir):
+        repo, base = self.make_repo(tmpdir)
+        commit_file(repo, 'README.md', 'docs\n')
+        tip = commit_file(repo, '.github/workflows/ci.yml', 'on: push\n')
+        assert tree_key(repo, base, self.ignore_paths) == \
+            tree_key(repo, tip, self.ignore_paths)
+
+    def test_code_changes_change_key(self, tmpdir):
+        repo, base = self.make_repo(tmpdir)
+        tip = commit_file(repo, 'pkg/core.py', 'a = 2\n')
+        assert tree_key(repo, base, self.ignore_paths) != \
+            tree_key(repo, tip, self.ignore_paths)
+
+
+class TestResultCache:
+    def test_store_and_restore(self, tmpdir):
+        cache = ResultCache(str(tmpdir.join('cache')))
+        results_dir = str(tmpdir.join('results'))
+        paths = [write_result(results_dir, 'box', 'a' * 40, env_name, 1000,
+                              {'bench.time_a': 1.5})
+                 for env_name in ('py3.5', 'py3.6')]
+
+        assert not cache.has('key', 'box')
+        cache.store('key', 'box', paths)
+        assert cache.has('key', 'box')
+        assert not cache.has('key', 'other')
+
+        restored_dir = str(tmpdir.join('restored'))
+        assert cache.restore('key', 'box', 'b' * 40, 2000, restored_dir) == 2
+
+        restored_path = os.path.join(restored_dir, 'bbbbbbbb-py3.5.json')
+        with open(restored_path) as result_fp:
+            restored = json.load(result_fp)
+        assert restored['commit_hash'] == 'b' * 40
+        assert restored['date'] == 2000
+        assert restored['results'] == {'bench.time_a': 1.5}
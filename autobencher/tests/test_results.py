@@ -0,0 +1,161 @@
+import os
+import testing_import_hack
+
+from testing_helpers import write_result
+from unittest.mock import Mock, patch
+
+from autobencher.results import ResultsIndex
+from autobencher.runner import ASVProcess
+from autobencher.util import link_tree
+
+
+testing_import_hack.use_package_so_flake8_is_happy()
+
+
+class TestResultsIndex:
+    def make_index(self, tmpdir):
+        results_dir = str(tmpdir.join('results'))
+        os.makedirs(results_dir)
+        index = ResultsIndex(results_dir, str(tmpdir.join('index.sqlite')))
+        return results_dir, index
+
+    def test_lookup_by_commit(self, tmpdir):
+        results_dir, index = self.make_index(tmpdir)
+        write_result(results_dir, 'box', 'base', 'py3', 1, {'a': 1.0})
+        write_result(results_dir, 'box', 'tip', 'py3', 2, {'a': 2.0})
+
+        assert index.refresh() == 2
+        assert index.latest_commit() == 'tip'
+        observed = index.get_results('base')
+        assert observed == [{'machine': 'box', 'env_name': 'py3',
+                             'commit_hash': 'base', 'date': 1,
+                             'results': {'a': 1.0}}]
+        assert index.get_results('base', machine='other') == []
+
+    def test_refresh_only_parses_changed_files(self, tmpdir):
+        results_dir, index = self.make_index(tmpdir)
+        write_result(results_dir, 'box', 'base', 'py3', 1, {'a': 1.0})
+        assert index.refresh() == 1
+        assert index.refresh() == 0
+
+        write_result(results_dir, 'box', 'base', 'py3', 1, {'a': 10.0})
+        assert index.refresh() == 1
+        assert index.get_results('base')[0]['results'] == {'a': 10.0}
+
+    def test_refresh_drops_deleted_files(self, tmpdir):
+        results_dir, index = self.make_index(tmpdir)
+        path = write_result(results_dir, 'box', 'base', 'py3', 1, {})
+        index.refresh()
+        os.remove(path)
+        index.refresh()
+        assert index.get_results('base') == []
+        assert index.latest_commit() is None
+
+    def test_base_index_covers_linked_files(self, tmpdir):
+        master_dir = str(tmpdir.join('master'))
+        base = ResultsIndex(master_dir, str(tmpdir.join('master.sqlite')))
+        write_result(master_dir, 'box', 'base', 'py3', 1, {'a': 1.0})
+        branch_dir = str(tmpdir.join('branch'))
+        link_tree(master_dir, branch_dir)
+        write_result(branch_dir, 'box', 'tip', 'py3', 2, {'a': 2.0})
+        index = ResultsIndex(branch_dir, str(tmpdir.join('branch.sqlite')),
+                             base)
+
+        assert index.refresh() == 1
+        assert index.refresh() == 0
+        assert index.get_results('base')[0]['results'] == {'a': 1.0}
+        assert index.get_result_paths('base') == [
+            os.path.join(branch_dir, 'box', 'base-py3.json')]
+        assert index.get_results('tip')[0]['results'] == {'a': 2.0}
+
+    def test_base_files_not_in_branch_are_ignored(self, tmpdir):
+        master_dir = str(tmpdir.join('master'))
+        base = ResultsIndex(master_dir, str(tmpdir.join('master.sqlite')))
+        branch_dir = str(tmpdir.join('branch'))
+        os.makedirs(branch_dir)
+        index = ResultsIndex(branch_dir, str(tmpdir.join('branch.sqlite')),
+                             base)
+        write_result(master_dir, 'box', 'base', 'py3', 1, {'a': 1.0})
+        index.refresh()
+        assert index.get_results('base') == []
+
+    def test_rewritten_branch_file_is_indexed(self, tmpdir):
+        master_dir = str(tmpdir.join('master'))
+        base = ResultsIndex(master_dir, str(tmpdir.join('master.sqlite')))
+        write_result(master_dir, 'box', 'base', 'py3', 1, {'a': 1.0})
+        branch_dir = str(tmpdir.join('branch'))
+        link_tree(master_dir, branch_dir)
+        index = ResultsIndex(branch_dir, str(tmpdir.join('branch.sqlite')),
+                             base)
+        path = os.path.join(branch_dir, 'box', 'base-py3.json')
+        os.remove(path)
+        write_result(branch_dir, 'box', 'base', 'py3', 1, {'a': 3.0})
+
+        assert index.refresh() == 1
+        assert index.get_results('base')[0]['results'] == {'a': 3.0}
+        assert index.get_result_paths('base') == [path]
+
+
+class TestCompareResults:
+    def make_process(self, tmpdir, base_commit):
+        process = ASVProcess.__new__(ASVProcess)
+        process._branch_dir = str(tmpdir)
+        process._run_dir = str(tmpdir.join('runs'))
+        process._results_dir = str(tmpdir.join('results'))
+        process._repo_config = {}
+        process._base_commit = base_commit
+        process._machine = 'box'
+        return process
+
+    def test_regression(self, tmpdir):
+        process = self.make_process(tmpdir, 'base')
+        write_result(process._results_dir, 'box', 'base', 'py3', 1,
+                     {'a': 1.0, 'b': 1.0})
+        write_result(process._results_dir, 'box', 'tip', 'py3', 2,
+                     {'a': 1.0, 'b': 2.0})
+        report = process._compare_results('tip')
+        assert report.has_regressions
+        assert [change.benchmark for change in report.regressions] == ['b']
+        assert tmpdir.join('comparison.json').check()
+
+    def test_no_regression(self, tmpdir):
+        process = self.make_process(tmpdir, 'base')
+        write_result(process._results_dir, 'box', 'base', 'py3', 1,
+                     {'a': 1.0})
+        write_result(process._results_dir, 'box', 'tip', 'py3', 2,
+                     {'a': 1.1})
+        assert not process._compare_results('tip').has_regressions
+
+    def test_other_machines_ignored(self, tmpdir):
+        process = self.make_process(tmpdir, 'base')
+        write_result(process._results_dir, 'other', 'base', 'py3', 1,
+                     {'a': 1.0})
+        write_result(process._results_dir, 'box', 'tip', 'py3', 2,
+                     {'a': 2.0})
+        report = process._compare_results('tip')
+        assert not report.has_regressions
+        assert report.compared == 0
+
+    def test_bisect_uses_existing_results(self, tmpdir):
+        process = self.make_process(tmpdir, 'base')
+        for date, (commit, time) in enumerate([('base', 1.0), ('c1', 1.0),
+                                               ('c2', 2.0), ('tip', 2.0)]):
+            write_result(process._results_dir, 'box', commit, 'py3', date,
+                         {'a': time})
+        process._source_repo = str(tmpdir)
+        process._call_asv = Mock()
+        report = process._compare_results('tip')
+        with patch('autobencher.runner.commits_between',
+                   return_value=['c1', 'c2', 'tip']):
+            assert process._bisect(report, 'tip') == 'c2'
+        assert not process._call_asv.called
+
+    def test_unshare_results(self, tmpdir):
+        process = self.make_process(tmpdir, 'base')
+        write_result(str(tmpdir.join('master')), 'box', 'base', 'py3', 1,
+                     {'a': 1.0})
+        master_path = str(tmpdir.join('master', 'box', 'base-py3.json'))
+        os.makedirs(process._results_dir)
+        os.link(master_path, str(tmpdir.join('results', 'base-py3.json')))
+        process._unshare_results('base')
+        assert os.stat(master_path).st_nlink == 1
@@ -0,0 +1,271 @@
+import threading
+import time
+import testing_import_hack
+
+from autobencher.job import Job, JobStore
+from autobencher.scheduler import JobScheduler
+from autobencher.affinity import CoreAllocator
+from autobencher.limits import RunAborted
+
+
+testing_import_hack.use_package_so_flake8_is_happy()
+
+
+def wait_for(scheduler, job, timeout=5):
+    deadline = time.time() + timeout
+    job = scheduler.get_job(job.job_id)
+    while not job.done and time.time() < deadline:
+        time.sleep(.01)
+        job = scheduler.get_job(job.job_id)
+    return job
+
+
+class TestJobStore:
+    def setup_method(self, test_method):
+        self.store = JobStore(':memory:')
+
+    def test_round_trip(self):
+        job = Job({'action': 'opened'})
+        self.store.add(job)
+        observed = self.store.get(job.job_id)
+        assert observed.event == {'action': 'opened'}
+        assert observed.state == Job.QUEUED
+        assert observed.enqueued == job.enqueued
+
+    def test_metadata_round_trip(self):
+        job = Job({}, metadata={'fetch_seconds': 1.5})
+        self.store.add(job)
+        job.metadata['fetch_bytes'] = 10
+        self.store.update(job)
+        assert self.store.get(job.job_id).metadata == {
+            'fetch_seconds': 1.5, 'fetch_bytes': 10}
+
+    def test_claim_oldest_first(self):
+        first = Job({'n': 1}, enqueued=1)
+        second = Job({'n': 2}, enqueued=2)
+        self.store.add(second)
+        self.store.add(first)
+        claimed = self.store.claim_next()
+        assert claimed.job_id == first.job_id
+        assert claimed.state == Job.RUNNING
+        assert self.store.count(Job.QUEUED) == 1
+        assert self.store.position(second) == 0
+
+    def test_claim_empty(self):
+        assert self.store.claim_next() is None
+
+    def test_claim_for_machine(self):
+        pinned = Job({'n': 1}, enqueued=1, machine='other')
+        anywhere = Job({'n': 2}, enqueued=2)
+        self.store.add(pinned)
+        self.store.add(anywhere)
+        assert self.store.claim_next('box').job_id == anywhere.job_id
+        assert self.store.claim_next('box') is None
+        assert self.store.claim_next('other').job_id == pinned.job_id
+
+    def test_requeue_running(self, tmpdir):
+        path = str(tmpdir.join('jobs.sqlite'))
+        store = JobStore(path)
+        job = Job({})
+        store.add(job)
+        store.claim_next()
+
+        restarted = JobStore(path)
+        assert restarted.requeue_running() == 1
+        assert restarted.get(job.job_id).state == Job.QUEUED
+
+
+class TestJobScheduler:
+    def setup_method(self, test_method):
+        self.handled = []
+        self.release = threading.Event()
+        self.store = JobStore(':memory:')
+
+    def _handler(self, job):
+        self.release.wait(5)
+        self.handled.append(job.event)
+
+    def test_submit_returns_queued_job(self):
+        scheduler = JobScheduler(self._handler, self.store)
+        job = scheduler.submit({'action': 'opened'})
+        assert job.state == Job.QUEUED
+        assert scheduler.get_job(job.job_id).state == Job.QUEUED
+        assert scheduler.stats() == {'slots': 1, 'queued': 1, 'running': 0,
+                                     'agents': [scheduler.machine]}
+
+    def test_unknown_job(self):
+        scheduler = JobScheduler(self._handler, self.store)
+        assert scheduler.get_job('missing') is None
+
+    def test_runs_job_in_background(self):
+        scheduler = JobScheduler(self._handler, self.store)
+        scheduler.start()
+        job = scheduler.submit({'action': 'opened'})
+        self.release.set()
+        job = wait_for(scheduler, job)
+        assert job.state == Job.SUCCEEDED
+        assert self.handled == [{'action': 'opened'}]
+
+    def test_slots_bound_concurrency(self):
+        running = []
+        peak = []
+
+        def handler(job):
+            running.append(job)
+            peak.append(len(running))
+            time.sleep(.05)
+            running.remove(job)
+
+        scheduler = JobScheduler(handler, self.store, slots=2)
+        scheduler.start()
+        jobs = [scheduler.submit({'n': i}) for i in range(5)]
+        for job in jobs:
+            wait_for(scheduler, job)
+        assert max(peak) <= 2
+
+    def test_supersedes_queued_jobs_for_key(self):
+        scheduler = JobScheduler(self._handler, self.store)
+        old = scheduler.submit({'n': 1}, 'owner/branch', 'aaa')
+        other = scheduler.submit({'n': 2}, 'owner/other', 'bbb')
+        new = scheduler.submit({'n': 3}, 'owner/branch', 'ccc')
+        assert scheduler.get_job(old.job_id).state == Job.SUPERSEDED
+        assert scheduler.get_job(other.job_id).state == Job.QUEUED
+        assert scheduler.get_job(new.job_id).state == Job.QUEUED
+
+    def test_cancels_running_job_for_new_head(self):
+        started = threading.Event()
+        cancelled = threading.Event()
+
+        def handler(job):
+            job.on_cancel(cancelled.set)
+            if job.head_sha == 'aaa':
+                started.set()
+                cancelled.wait(5)
+
+        scheduler = JobScheduler(handler, self.store, slots=2)
+        scheduler.start()
+        old = scheduler.submit({}, 'owner/branch', 'aaa')
+        assert started.wait(5)
+        new = scheduler.submit({}, 'owner/branch', 'bbb')
+        assert wait_for(scheduler, old).state == Job.SUPERSEDED
+        assert wait_for(scheduler, new).state == Job.SUCCEEDED
+
+    def test_same_head_is_not_cancelled(self):
+        job = Job({}, key='master', head_sha='aaa')
+        calls = []
+        job.on_cancel(lambda: calls.append(True))
+        scheduler = JobScheduler(self._handler, self.store)
+        scheduler._running[job.job_id] = job
+        scheduler._cancel_stale('master', 'aaa')
+        assert calls == []
+
+    def test_claimed_job_is_running(self):
+        scheduler = JobScheduler(self._handler, self.store)
+        job = scheduler.submit({}, 'owner/branch', 'aaa')
+        claimed = scheduler._claim_next(scheduler.machine)
+        assert claimed.job_id == job.job_id
+        assert scheduler.get_job(job.job_id) is claimed
+        scheduler.submit({}, 'owner/branch', 'bbb')
+        assert claimed.cancelled
+
+    def test_aborted_job(self):
+        def handler(job):
+            raise RunAborted('wall time limit of 60s exceeded')
+
+        scheduler = JobScheduler(handler, self.store)
+        scheduler.start()
+        job = wait_for(scheduler, scheduler.submit({}))
+        assert job.state == Job.ABORTED
+        assert job.error == 'wall time limit of 60s exceeded'
+
+    def test_records_slot_cores(self):
+        allocator = CoreAllocator(range(5), 2)
+        cores = []
+        scheduler = JobScheduler(
+            lambda job: cores.append(job.metadata['cores']), self.store,
+            slots=2, allocator=allocator)
+        scheduler.start()
+        job = wait_for(scheduler, scheduler.submit({}))
+        assert job.metadata['cores'] in ([1, 2], [3, 4])
+        assert cores == [job.metadata['cores']]
+
+    def test_failed_job_records_error(self):
+        def handler(job):
+            raise RuntimeError('clone failed')
+
+        scheduler = JobScheduler(handler, self.store)
+        scheduler.start()
+        job = wait_for(scheduler, scheduler.submit({}))
+        assert job.state == Job.FAILED
+        assert job.error == 'clone failed'
+
+
+class TestAgents:
+    def setup_method(self, test_method):
+        self.store = JobStore(':memory:')
+        self.scheduler = JobScheduler(lambda job: None, self.store, slots=0,
+                                      machine='server')
+
+    def test_claim_and_finish(self):
+        job = self.scheduler.submit({'action': 'opened'}, 'owner/branch')
+        claimed = self.scheduler.claim('box')
+        assert claimed.job_id == job.job_id
+        assert claimed.metadata['machine'] == 'box'
+        assert self.scheduler.claim('box') is None
+        assert self.scheduler.machines() == set(['box'])
+
+        assert self.scheduler.finish('other', job.job_id) is None
+        self.scheduler.finish('box', job.job_id, metadata={'env_dir': 'e'})
+        finished = self.store.get(job.job_id)
+        assert finished.state == Job.SUCCEEDED
+        assert finished.metadata == {'machine': 'box', 'env_dir': 'e'}
+
+    def test_failed_job(self):
+        job = self.scheduler.submit({})
+        self.scheduler.claim('box')
+        self.scheduler.finish('box', job.job_id, 'asv missing')
+        assert self.store.get(job.job_id).state == Job.FAILED
+        assert self.store.get(job.job_id).error == 'asv missing'
+
+    def test_heartbeat_reports_cancellation(self):
+        old = self.scheduler.submit({}, 'owner/branch', 'aaa')
+        self.scheduler.claim('box')
+        assert not self.scheduler.heartbeat('box', old.job_id).cancelled
+        self.scheduler.submit({}, 'owner/branch', 'bbb')
+        assert self.scheduler.heartbeat('box', old.job_id).cancelled
+        self.scheduler.finish('box', old.job_id)
+        assert self.store.get(old.job_id).state == Job.SUPERSEDED
+
+    def test_lost_agent_job_is_requeued(self):
+        scheduler = JobScheduler(lambda job: None, self.store, slots=0,
+                                 agent_timeout=-1)
+        job = scheduler.submit({})
+        scheduler.claim('box')
+        assert scheduler.machines() == set()
+        assert self.store.get(job.job_id).state == Job.QUEUED
+        assert scheduler.heartbeat('box', job.job_id) is None
+
+    def test_jobs_for_lost_agent_fail(self):
+        scheduler = JobScheduler(lambda job: None, self.store, slots=1,
+                                 machine='server', agent_timeout=-1)
+        gone = scheduler.submit({}, 'master', machine='box')
+        local = scheduler.submit({}, 'master', machine='server')
+        anywhere = scheduler.submit({})
+        scheduler.register_agent('box')
+        assert scheduler.machines() == set(['server'])
+        assert self.store.get(gone.job_id).state == Job.FAILED
+        assert self.store.get(gone.job_id).error == 'machine went away'
+        assert self.store.get(local.job_id).state == Job.QUEUED
+        assert self.store.get(anywhere.job_id).state == Job.QUEUED
+
+    def test_agents_get_time_to_return_after_restart(self):
+        job = self.scheduler.submit({}, 'master', machine='box')
+        assert self.scheduler.machines() == set()
+        assert self.store.get(job.job_id).state == Job.QUEUED
+
+    def test_pinned_jobs(self):
+        first = self.scheduler.submit({}, 'master', machine='a')
+        second = self.scheduler.submit({}, 'master', machine='b')
+        assert self.store.get(first.job_id).state == Job.QUEUED
+        assert self.scheduler.claim('b').job_id == second.job_id
+        assert self.scheduler.claim('b') is None
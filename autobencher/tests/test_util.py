@@ -0,0 +1,87 @@
+import errno
+import os
+import pytest
+import testing_import_hack
+
+from unittest.mock import patch
+from autobencher.util import atomic_copy, atomic_write, link_tree
+
+
+testing_import_hack.use_package_so_flake8_is_happy()
+
+
+class TestLinkTree:
+    def setup_method(self, test_method):
+        self.files = {
+            os.path.join('box', 'abc-py3.json'): '{"a": 1}',
+            os.path.join('box', 'machine.json'): '{}',
+            'benchmarks.json': '{}',
+        }
+
+    def make_source(self, tmpdir):
+        source = tmpdir.join('master')
+        for name, content in self.files.items():
+            source.join(name).write(content, ensure=True)
+        return str(source)
+
+    def test_links_results(self, tmpdir):
+        source = self.make_source(tmpdir)
+        dest = str(tmpdir.join('branch'))
+        linked, copied = link_tree(source, dest,
+                                   copy_names=('machine.json',
+                                               'benchmarks.json'))
+        assert (linked, copied) == (1, 2)
+        result = os.path.join('box', 'abc-py3.json')
+        assert os.path.samefile(os.path.join(source, result),
+                                os.path.join(dest, result))
+        machine = os.path.join('box', 'machine.json')
+        assert not os.path.samefile(os.path.join(source, machine),
+                                    os.path.join(dest, machine))
+
+    def test_second_snapshot_only_links_new_files(self, tmpdir):
+        source = self.make_source(tmpdir)
+        dest = str(tmpdir.join('branch'))
+        link_tree(source, dest)
+        tmpdir.join('master', 'box', 'def-py3.json').write('{}')
+        assert link_tree(source, dest) == (1, 0)
+
+    def test_falls_back_to_copy(self, tmpdir):
+        source = self.make_source(tmpdir)
+        dest = str(tmpdir.join('branch'))
+        error = OSError(errno.EXDEV, 'Invalid cross-device link')
+        with patch('autobencher.util.os.link', side_effect=error):
+            linked, copied = link_tree(source, dest)
+        assert (linked, copied) == (0, 3)
+        with open(os.path.join(dest, 'box', 'abc-py3.json')) as result_fp:
+            assert result_fp.read() == '{"a": 1}'
+
+
+class TestAtomicWrite:
+    def test_replaces_without_touching_links(self, tmpdir):
+        path = str(tmpdir.join('result.json'))
+        link = str(tmpdir.join('link.json'))
+        tmpdir.join('result.json').write('old')
+        os.link(path, link)
+        with atomic_write(path) as result_fp:
+            result_fp.write('new')
+        assert tmpdir.join('result.json').read() == 'new'
+        assert tmpdir.join('link.json').read() == 'old'
+        assert sorted(os.listdir(str(tmpdir))) == ['link.json',
+                                                   'result.json']
+
+    def test_failure_keeps_old_file(self, tmpdir):
+        tmpdir.join('result.json').write('old')
+        with pytest.raises(ValueError):
+            with atomic_write(str(tmpdir.join('result.json'))) as result_fp:
+                result_fp.write('partial')
+                raise ValueError()
+        assert tmpdir.join('result.json').read() == 'old'
+        assert os.listdir(str(tmpdir)) == ['result.json']
+
+    def test_copy_over_itself_unshares(self, tmpdir):
+        path = str(tmpdir.join('result.json'))
+        tmpdir.join('result.json').write('data')
+        os.link(path, str(tmpdir.join('link.json')))
+        atomic_copy(path, path)
+        assert os.stat(path).st_nlink == 1
+        assert tmpdir.join('result.json').read() == 'data'
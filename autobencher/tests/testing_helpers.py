@@ -0,0 +1,72 @@
+# Helpers shared by the test files for git repositories, asv results and
+# HTTP servers
+import asyncio
+import json
+import os
+import subprocess
+import threading
+
+from tornado.httpserver import HTTPServer
+from tornado.ioloop import IOLoop
+from tornado.testing import bind_unused_port
+
+
+GIT_ENV = dict(os.environ, GIT_AUTHOR_NAME='test',
+               GIT_AUTHOR_EMAIL='test@example.com', GIT_COMMITTER_NAME='test',
+               GIT_COMMITTER_EMAIL='test@example.com')
+
+
+def git(directory, *args):
+    return subprocess.check_output(('git', '-C', directory) + args,
+                                   env=GIT_ENV).decode().strip()
+
+
+def commit_file(directory, name, content):
+    path = os.path.join(directory, name)
+    if not os.path.exists(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+    with open(path, 'w') as file_fp:
+        file_fp.write(content)
+    git(directory, 'add', name)
+    git(directory, 'commit', '-q', '-m', 'change ' + name)
+    return git(directory, 'rev-parse', 'HEAD')
+
+
+def write_result(results_dir, machine, commit_hash, env_name, date, results):
+    """Write an asv result file, and the machine.json next to it"""
+    machine_dir = os.path.join(results_dir, machine)
+    if not os.path.exists(machine_dir):
+        os.makedirs(machine_dir)
+    path = os.path.join(machine_dir,
+                        '%s-%s.json' % (commit_hash[:8], env_name))
+    with open(path, 'w') as result_fp:
+        json.dump({'commit_hash': commit_hash, 'env_name': env_name,
+                   'date': date, 'params': {'machine': machine},
+                   'results': results}, result_fp)
+    with open(os.path.join(machine_dir, 'machine.json'), 'w') as machine_fp:
+        json.dump({'machine': machine}, machine_fp)
+    return path
+
+
+class ServerThread(threading.Thread):
+    def __init__(self, app):
+        super(ServerThread, self).__init__(daemon=True)
+        self._app = app
+        self._socket, self.port = bind_unused_port()
+        self._ready = threading.Event()
+
+    def run(self):
+        asyncio.set_event_loop(asyncio.new_event_loop())
+        server = HTTPServer(self._app)
+        server.add_sockets([self._socket])
+        self._loop = IOLoop.current()
+        self._ready.set()
+        self._loop.start()
+
+    def start(self):
+        super(ServerThread, self).start()
+        self._ready.wait(5)
+
+    def stop(self):
+        self._loop.add_callback(self._loop.stop)
+        self.join(5)
@@ -1,3 +1,11 @@
+import errno
+import fcntl
+import os
+import shutil
+
+from contextlib import contextmanager
+
+
 class Authorization(object):
     def __init__(self, username, password):
         self._username = username
@@ -14,3 +22,126 @@ class Authorization(object):
     def __eq__(self, other):
         return (self._username == other._username and
                 self._password == other._password)
+
+
+class FileLock(object):
+    """Exclusive advisory lock on a file, usable across threads and
+       processes"""
+
+    def __init__(self, path):
+        self._path = path
+        self._fp = None
+
+    @property
+    def path(self):
+        return self._path
+
+    def acquire(self, blocking=True):
+        self._fp = open(self._path, 'a')
+        flags = fcntl.LOCK_EX
+        if not blocking:
+            flags |= fcntl.LOCK_NB
+        try:
+            fcntl.flock(self._fp, flags)
+        except BlockingIOError:
+            self._fp.close()
+            self._fp = None
+            return False
+        return True
+
+    def release(self):
+        fcntl.flock(self._fp, fcntl.LOCK_UN)
+        self._fp.close()
+        self._fp = None
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.release()
+
+
+_NO_LINK_ERRORS = (errno.EXDEV, errno.EPERM, errno.EMLINK, errno.ENOTSUP,
+                   errno.EOPNOTSUPP)
+
+
+def link_tree(source, dest, copy_names=()):
+    """Mirror the files under source into dest using hard links, so that the
+       snapshot costs no data I/O or extra disk. Files named in copy_names
+       are always copied. Falls back to copying on filesystems that don't
+       support hard links. Returns the number of files linked and copied."""
+    linked = copied = 0
+    can_link = True
+    for root, dirs, files in os.walk(source):
+        target_dir = os.path.join(dest, os.path.relpath(root, source))
+        if not os.path.exists(target_dir):
+            os.makedirs(target_dir)
+
+        for filename in files:
+            source_path = os.path.join(root, filename)
+            dest_path = os.path.join(target_dir, filename)
+
+            if os.path.exists(dest_path):
+                if os.path.samefile(source_path, dest_path):
+                    continue
+                os.remove(dest_path)
+
+            if can_link and filename not in copy_names:
+                try:
+                    os.link(source_path, dest_path)
+                    linked += 1
+                    continue
+                except OSError as e:
+                    if e.errno not in _NO_LINK_ERRORS:
+                        raise
+                    can_link = False
+
+            shutil.copy2(source_path, dest_path)
+            copied += 1
+
+    return linked, copied
+
+
+@contextmanager
+def atomic_write(path, mode='w'):
+    """Open a temporary file next to path for writing, and rename it over
+       path once the block finishes. Readers never see a partial file, and
+       files hard linked to path keep their old contents."""
+    temp_path = path + '.tmp'
+    try:
+        with open(temp_path, mode) as temp_fp:
+            yield temp_fp
+    except BaseException:
+        try:
+            os.remove(temp_path)
+        except FileNotFoundError:
+            pass
+        raise
+    os.rename(temp_path, path)
+
+
+def atomic_copy(source, dest):
+    """Copy source to dest the way atomic_write writes it"""
+    with atomic_write(dest, 'wb') as dest_fp:
+        with open(source, 'rb') as source_fp:
+            shutil.copyfileobj(source_fp, dest_fp)
+
+
+def list_dir(path):
+    """The names in the directory path, or none if it doesn't exist"""
+    try:
+        return os.listdir(path)
+    except FileNotFoundError:
+        return []
+
+
+def directory_size(path):
+    total = 0
+    for root, dirs, files in os.walk(path):
+        for filename in files:
+            try:
+                total += os.lstat(os.path.join(root, filename)).st_size
+            except FileNotFoundError:
+                pass
+    return total
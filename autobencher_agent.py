@@ -0,0 +1,10 @@
+import logging
+import os
+from autobencher.agent import Agent
+from autobencher.affinity import CoreAllocator, pin
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    allocator = CoreAllocator.from_environ(1)
+    pin(allocator.housekeeping)
+    Agent.from_environ(os.getcwd(), allocator.slot_cores(0)).run_forever()